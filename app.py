@@ -1,50 +1,200 @@
 # app.py
 
 import os
-import random
+import time
+import atexit
 import base64
+import threading
 import numpy as np
 import cv2
-import logging
-import pandas as pd
+from concurrent.futures import TimeoutError as FutureTimeout
 
-from flask import Flask, render_template, g, request, jsonify
-from sqlalchemy import create_engine, not_
-from sqlalchemy.orm import sessionmaker
-from deepface import DeepFace
+from flask import Flask, render_template, g, request, jsonify, send_file, url_for, abort
+from sqlalchemy import func
 
 # Абсолютные импорты, которые работают всегда
+from src.database import repository
+from src.database.engine import get_engine, get_session_factory
 from src.database.models import Meme, Reaction
+from src.database.aggregator import ReactionAggregator
+from src.database.migrations import upgrade
 from src.recommender.model import MemeRecommender
+from src.recommender.queue import CandidateQueue
+from src.recommender.training import TrainingJob, reaction_history
+from src.emotion_analyzer.model import NO_FACE
+from src.emotion_analyzer.pool import EmotionWorkerPool, PoolBusy
+from src.emotion_analyzer.gating import FrameGate
+from src.emotion_store.store import get_emotion_store
+from src.image_store.store import get_image_store
+from src.metrics import REGISTRY, CONTENT_TYPE, RequestProfiler, timed
 
 # --- Настройка приложения ---
 app = Flask(__name__)
-DB_NAME = "memes.db"
-DATABASE_URL = f"sqlite:///{DB_NAME}"
 
-# Отключаем лишние логи от deepface
-logging.getLogger('deepface').setLevel(logging.ERROR)
-
-# Настройка подключения к БД
-engine = create_engine(DATABASE_URL)
-Session = sessionmaker(bind=engine)
+# Подключение к БД: общий движок процесса (путь к memes.db - MEMES_DB_PATH)
+Session = get_session_factory()
+# Старые базы обновляются до актуальной схемы прямо при старте
+upgrade(get_engine())
 
 # --- Инициализация модели ---
 recommender = MemeRecommender()
 recommender.load()
 
-# --- Рейтинг эмоций ---
-EMOTION_PRIORITY = {
-    'happy': 5,
-    'surprise': 4,
-    'neutral': 3,
-    'fear': 2,
-    'sad': 2,
-    'disgust': 1,
-    'angry': 1,
-    'лицо не найдено': 0,
-    'ошибка анализа': 0
-}
+# Очередь непросмотренных мемов, отсортированная по оценке модели
+candidate_queue = CandidateQueue(recommender)
+
+# Пул процессов с DeepFace: Flask-потоки не ждут TensorFlow напрямую
+emotion_pool = EmotionWorkerPool()
+# Предфильтр кадров: одинаковые кадры и кадры без лица в сеть не идут
+frame_gate = FrameGate()
+# Покадровые вероятности эмоций (только дописываются, без SQLite): из них учится модель
+emotion_events = get_emotion_store()
+
+# Сколько реакций читается за раз при полном переобучении
+REFIT_CHUNK = 5000
+
+
+def on_reactions_flushed(seen, reactions):
+    """Записанная пачка реакций сразу дообучает модель (partial_fit)."""
+    # Эти мемы отмечены просмотренными в базе - пересборка очереди их уже не увидит
+    candidate_queue.confirm_seen(seen)
+    if not reactions:
+        return
+    session = Session()
+    try:
+        sources = repository.meme_sources(session, reactions)
+    finally:
+        session.close()
+    meme_ids = [meme_id for meme_id in reactions if meme_id in sources]
+    recommender.partial_update(meme_ids, [sources[i] for i in meme_ids], [reactions[i] for i in meme_ids])
+    # Новые веса попадут в выдачу через несколько секунд
+    candidate_queue.mark_stale()
+
+
+# Реакции копятся в памяти и пишутся в базу пачками, а не на каждый кадр
+reaction_aggregator = ReactionAggregator(Session, on_flush=on_reactions_flushed)
+# Дообученная, но еще не сохраненная модель сохраняется при остановке
+atexit.register(recommender.checkpoint)
+
+# Полное переобучение идет в фоне; после него очередь пересобирается новой моделью
+training_job = TrainingJob(recommender, on_success=lambda version: candidate_queue.invalidate())
+
+
+def on_model_published(version):
+    """Другой процесс опубликовал новую версию модели - переключаемся на нее без перезапуска."""
+    if recommender.reload(version):
+        candidate_queue.invalidate()
+
+
+# Фоновые потоки процесса запускаются при первом запросе, а не при импорте:
+# в мастер-процессе serve.py потоков быть не должно (fork их не копирует,
+# а захваченные ими блокировки остались бы захваченными в воркерах)
+_background_pid = None
+_background_lock = threading.Lock()
+# Процесс прогрет (модель текущей версии, очередь кандидатов собрана) - см. /ready
+warmed_up = threading.Event()
+
+
+def start_background():
+    """Запускает слежение за версиями модели в текущем процессе (один раз на процесс)."""
+    global _background_pid
+    with _background_lock:
+        if _background_pid == os.getpid():
+            return
+        _background_pid = os.getpid()
+    recommender.registry.watch(on_model_published)
+
+
+def warm_up():
+    """
+    Готовит процесс к запросам: текущая версия модели и собранная очередь
+    кандидатов. Вызывается до первого запроса (в serve.py - еще в мастере,
+    чтобы воркеры получили готовую очередь через fork).
+    """
+    version = recommender.registry.current_version()
+    if version is not None and recommender.reload(version):
+        candidate_queue.invalidate()
+    session = Session()
+    try:
+        candidate_queue.warm_up(session)
+    finally:
+        session.close()
+    warmed_up.set()
+
+
+def init_worker():
+    """HTTP-воркер serve.py сразу после fork: свои соединения, потоки и слот в общем пуле эмоций."""
+    warmed_up.clear()
+    # Соединения SQLite из пула мастера движок сбрасывает сам (src/database/engine.py)
+    emotion_pool.attach()
+    start_background()
+    warm_up()
+
+# Картинки мемов с уменьшенными копиями (кладет парсер, отдает /media)
+image_store = get_image_store()
+# Адрес в кеше не меняется никогда, поэтому браузер может хранить картинку год
+MEDIA_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+# Сколько мемов можно запросить через /next за раз
+NEXT_MAX_K = 20
+
+# --- Прием кадров в бинарном виде ---
+FRAME_MIMETYPES = {'image/jpeg', 'image/png', 'image/webp'}
+MAX_FRAME_BYTES = 2 * 1024 * 1024
+
+# --- Метрики (/metrics) и выборочное профилирование запросов ---
+REQUEST_SECONDS = REGISTRY.histogram(
+    'memepulse_http_request_seconds', 'Время обработки HTTP-запроса', ['endpoint', 'status'])
+FRAMES = REGISTRY.counter(
+    'memepulse_frames_total', 'Кадры с веб-камеры: analyzed, skipped, busy, error', ['result'])
+QUEUE_SIZE = REGISTRY.gauge('memepulse_candidate_queue_size', 'Мемов в очереди кандидатов')
+POOL_PENDING = REGISTRY.gauge('memepulse_emotion_pool_pending', 'Кадров ждут ответа пула DeepFace')
+POOL_READY_WORKERS = REGISTRY.gauge('memepulse_emotion_pool_ready_workers', 'Воркеров DeepFace с загруженной моделью')
+request_profiler = RequestProfiler()
+
+
+@app.before_request
+def start_request_timer():
+    start_background()
+    g.request_started = time.perf_counter()
+    g.request_profile = request_profiler.start()
+
+
+@app.after_request
+def observe_request(response):
+    # Шаблон маршрута, а не сам путь: иначе каждый /media/<digest> был бы отдельной серией
+    endpoint = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    REQUEST_SECONDS.observe(time.perf_counter() - g.request_started, endpoint=endpoint, status=response.status_code)
+    return response
+
+
+@app.teardown_request
+def finish_request_profile(exception=None):
+    # Не в after_request: тот не вызывается, если представление упало, и профайлер
+    # остался бы включенным, а выборка - выключенной до конца жизни процесса
+    endpoint = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    request_profiler.finish(g.pop('request_profile', None), f"{request.method}-{endpoint}")
+
+
+@app.route("/metrics")
+def metrics():
+    """Счетчики и гистограммы в текстовом формате Prometheus."""
+    QUEUE_SIZE.set(len(candidate_queue))
+    pool_stats = emotion_pool.stats()
+    POOL_PENDING.set(pool_stats['pending'])
+    POOL_READY_WORKERS.set(pool_stats['ready_workers'])
+    return app.response_class(REGISTRY.render(), content_type=CONTENT_TYPE)
+
+
+@app.route("/ready")
+def ready():
+    """
+    Готовность принимать трафик (readiness probe): 200 только после прогрева
+    процесса и первого прогона модели эмоций хотя бы в одном воркере пула.
+    """
+    checks = {'warmed_up': warmed_up.is_set(), 'emotion_model': emotion_pool.is_ready}
+    return jsonify({'ready': all(checks.values()), **checks}), 200 if all(checks.values()) else 503
+
 
 # --- Управление сессиями БД ---
 def get_db_session():
@@ -58,55 +208,142 @@ def close_db_session(exception=None):
     if db_session is not None:
         db_session.close()
 
+def meme_image(meme):
+    """
+    Адреса картинки мема для шаблона: уменьшенные копии из кеша, если они есть,
+    и исходный адрес как запасной вариант (старые мемы, вытесненные из кеша).
+    """
+    fallback = meme.url if meme.url.startswith('http') else url_for('static', filename='images/' + meme.url)
+    if not image_store.has(meme.image_digest):
+        return {'src': fallback, 'srcset': '', 'fallback': fallback}
+    return {
+        'src': url_for('serve_media', digest=meme.image_digest, rendition='w720'),
+        'srcset': f"{url_for('serve_media', digest=meme.image_digest, rendition='w320')} 320w, "
+                  f"{url_for('serve_media', digest=meme.image_digest, rendition='w720')} 720w",
+        'fallback': fallback,
+    }
+
+def meme_payload(meme):
+    """Мем для клиентского переключения через /next."""
+    return {'id': meme.id, 'title': meme.title, 'image': meme_image(meme)}
+
 # --- Маршруты (API) ---
 
 @app.route("/")
 def show_meme():
     session = get_db_session()
-    
-    reacted_meme_ids_query = session.query(Reaction.meme_id).distinct()
-    reacted_ids = [id_tuple[0] for id_tuple in reacted_meme_ids_query.all()]
-    
-    unseen_memes_query = session.query(Meme).filter(not_(Meme.id.in_(reacted_ids)))
-    unseen_memes = unseen_memes_query.all()
-    
+
     next_meme = None
-    
-    if recommender.is_trained and unseen_memes:
-        print(f"Модель обучена. Подбираю лучший мем из {len(unseen_memes)}...")
-        unseen_memes_df = pd.DataFrame([{'id': m.id, 'source': m.source} for m in unseen_memes])
-        
-        scores = recommender.predict_scores(unseen_memes_df)
-        unseen_memes_df['score'] = scores
-        
-        best_meme_row = unseen_memes_df.sort_values(by='score', ascending=False).iloc[0]
-        best_meme_id = int(best_meme_row['id'])
-        next_meme = session.query(Meme).get(best_meme_id)
-        print(f"Выбран мем ID {next_meme.id} с оценкой {best_meme_row['score']:.2f}")
+    with timed('index.select'):
+        best_meme_id = candidate_queue.pop(session)
 
-    else:
-        if unseen_memes:
-             print("Модель не обучена. Выбираю случайный из непросмотренных мемов.")
-             next_meme = random.choice(unseen_memes)
-        else:
-            print("Все мемы просмотрены! Выбираю случайный из всех.")
-            all_memes = session.query(Meme).all()
-            if not all_memes:
-                return "В базе данных нет мемов! Сначала запустите парсер."
-            next_meme = random.choice(all_memes)
+    if best_meme_id is not None:
+        with timed('index.load'):
+            next_meme = session.get(Meme, best_meme_id)
+
+    if next_meme is None:
+        print("Все мемы просмотрены! Выбираю случайный из всех.")
+        next_meme = session.query(Meme).order_by(func.random()).first()
+        if next_meme is None:
+            return "В базе данных нет мемов! Сначала запустите парсер."
+    elif recommender.is_trained:
+        print(f"Выбран мем ID {next_meme.id} (осталось в очереди: {len(candidate_queue)})")
 
     model_is_trained = recommender.is_trained
 
-    return render_template('index.html', 
-                           meme_id=next_meme.id,
-                           meme_title=next_meme.title, 
-                           meme_url=next_meme.url,
-                           model_is_trained=model_is_trained)
+    with timed('index.render'):
+        return render_template('index.html', 
+                               meme_id=next_meme.id,
+                               meme_title=next_meme.title, 
+                               meme_image=meme_image(next_meme),
+                               model_is_trained=model_is_trained)
+
+
+@app.route("/next")
+def next_memes():
+    """
+    Следующие k мемов по оценке модели одним запросом. Клиент держит их
+    в своей очереди, заранее грузит картинки и переключает мемы без перехода на /.
+    """
+    k = min(max(request.args.get('k', 5, type=int), 1), NEXT_MAX_K)
+    session = get_db_session()
+
+    meme_ids = candidate_queue.pop_many(session, k)
+    memes_by_id = repository.memes_by_id(session, meme_ids)
+    memes = [memes_by_id[meme_id] for meme_id in meme_ids if meme_id in memes_by_id]
+
+    if not memes:
+        # Все мемы просмотрены - как и на главной, показываем случайные
+        memes = session.query(Meme).order_by(func.random()).limit(k).all()
+
+    return jsonify({
+        'memes': [meme_payload(meme) for meme in memes],
+        'model_is_trained': recommender.is_trained,
+    })
+
+
+@app.route("/media/<digest>/<rendition>")
+def serve_media(digest, rendition):
+    """Картинка из кеша по sha256. Содержимое по адресу неизменно - строгий ETag и 304."""
+    found = image_store.open(digest, rendition)
+    if found is None:
+        abort(404)
+    path, mimetype = found
+
+    etag = f"{digest}-{rendition}"
+    if etag in request.if_none_match:
+        response = app.response_class(status=304)
+    else:
+        response = send_file(path, mimetype=mimetype, etag=False, conditional=False, max_age=None)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = MEDIA_CACHE_CONTROL
+    return response
+
+
+def process_frame(img_np, meme_id, client_session):
+    """
+    Общая часть /analyze и /analyze/frame: эмоция по кадру и сохранение реакции.
+    Возвращает (json-ответ, http-код).
+    """
+    if img_np is None:
+        FRAMES.inc(result='error')
+        return {'emotion': 'ошибка: не удалось декодировать кадр'}, 400
+
+    # Сначала дешевый фильтр: тот же кадр или нет лица - сеть не запускаем
+    with timed('analyze.gate'):
+        decision = frame_gate.check(client_session, meme_id, img_np)
+    if decision.skip:
+        FRAMES.inc(result='skipped')
+        return {'emotion': decision.emotion, 'skipped': True,
+                'next_interval_ms': frame_gate.next_interval_ms(client_session)}, 200
+
+    try:
+        with timed('analyze.inference'):
+            result = emotion_pool.analyze(decision.frame, decision.face_crop)
+    except (PoolBusy, FutureTimeout):
+        # Все воркеры заняты: просим клиента просто пропустить этот кадр
+        FRAMES.inc(result='busy')
+        return {'emotion': 'сервер занят', 'busy': True}, 503
+
+    dominant_emotion = result['dominant_emotion']
+    frame_gate.remember(client_session, decision, dominant_emotion)
+    FRAMES.inc(result='analyzed')
+
+    if dominant_emotion != NO_FACE:
+        # В базу реакция попадет пачкой, когда мем сменится или по таймеру
+        # (сама запись в базу - этап reactions.flush)
+        with timed('analyze.record'):
+            reaction_aggregator.record(client_session, meme_id, dominant_emotion)
+            # Полный вектор вероятностей кадра - в хранилище событий для обучения
+            emotion_events.append(meme_id, client_session, result['emotion'])
+        candidate_queue.mark_seen(meme_id)
+
+    return {'emotion': dominant_emotion, 'next_interval_ms': frame_gate.next_interval_ms(client_session)}, 200
 
 
 @app.route("/analyze", methods=['POST'])
 def analyze_emotion():
-    session = get_db_session()
+    """Старый формат: JSON с кадром в виде data URL (base64). Оставлен для совместимости."""
     try:
         data = request.get_json()
         image_data = data['image']
@@ -115,58 +352,94 @@ def analyze_emotion():
             return jsonify({'emotion': 'ошибка: нет meme_id'}), 400
 
         header, encoded = image_data.split(",", 1)
-        binary_data = base64.b64decode(encoded)
+        with timed('analyze.decode'):
+            binary_data = base64.b64decode(encoded)
         nparr = np.frombuffer(binary_data, np.uint8)
-        img_np = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-
-        result = DeepFace.analyze(img_np, actions=['emotion'], enforce_detection=False, silent=True)
-        
-        dominant_emotion = "лицо не найдено"
-        if isinstance(result, list) and len(result) > 0:
-            dominant_emotion = result[0]['dominant_emotion']
-        
-        if dominant_emotion != "лицо не найдено":
-            existing_reaction = session.query(Reaction).filter_by(meme_id=meme_id).first()
-
-            if not existing_reaction:
-                new_reaction = Reaction(meme_id=meme_id, dominant_emotion=dominant_emotion)
-                session.add(new_reaction)
-                session.commit()
-                print(f"Сохранена ПЕРВАЯ реакция '{dominant_emotion}' для мема ID {meme_id}")
-            else:
-                current_priority = EMOTION_PRIORITY.get(existing_reaction.dominant_emotion, 0)
-                new_priority = EMOTION_PRIORITY.get(dominant_emotion, 0)
-
-                if new_priority > current_priority:
-                    existing_reaction.dominant_emotion = dominant_emotion
-                    session.commit()
-                    print(f"Обновлена реакция для мема ID {meme_id} на более важную: '{dominant_emotion}'")
-
-        return jsonify({'emotion': dominant_emotion})
+        with timed('analyze.imdecode'):
+            img_np = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+
+        client_session = data.get('session_id') or request.remote_addr
+        body, status = process_frame(img_np, meme_id, client_session)
+        return jsonify(body), status
 
     except Exception as e:
+        FRAMES.inc(result='error')
         print(f"Критическая ошибка в /analyze: {e}")
         return jsonify({'emotion': 'ошибка анализа'}), 500
 
 
+@app.route("/analyze/frame", methods=['POST'])
+def analyze_frame():
+    """
+    Кадр приходит телом запроса как есть (image/jpeg), meme_id и session_id - в query string.
+    Без base64 и JSON: тело сразу декодируется OpenCV из буфера запроса.
+    """
+    try:
+        meme_id = request.args.get('meme_id', type=int)
+        if not meme_id:
+            return jsonify({'emotion': 'ошибка: нет meme_id'}), 400
+        if request.mimetype not in FRAME_MIMETYPES:
+            return jsonify({'emotion': f'ошибка: неподдерживаемый тип {request.mimetype}'}), 415
+        if (request.content_length or 0) > MAX_FRAME_BYTES:
+            return jsonify({'emotion': 'ошибка: слишком большой кадр'}), 413
+
+        # np.frombuffer не копирует байты, imdecode читает прямо из них
+        nparr = np.frombuffer(request.get_data(cache=False), np.uint8)
+        with timed('analyze.imdecode'):
+            img_np = cv2.imdecode(nparr, cv2.IMREAD_COLOR) if nparr.size else None
+
+        client_session = request.args.get('session_id') or request.remote_addr
+        body, status = process_frame(img_np, meme_id, client_session)
+        return jsonify(body), status
+
+    except Exception as e:
+        FRAMES.inc(result='error')
+        print(f"Критическая ошибка в /analyze/frame: {e}")
+        return jsonify({'emotion': 'ошибка анализа'}), 500
+
+
+@app.route("/analyze/stats")
+def analyze_stats():
+    """Размеры пачек, время ожидания в очереди и доля кадров, отсеянных фильтром."""
+    return jsonify({'batching': emotion_pool.stats(), 'gate': frame_gate.stats()})
+
+
 @app.route("/train")
 def train_model_endpoint():
     session = get_db_session()
     print("Получен запрос на обучение модели...")
+    # Дописываем в базу реакции, которые еще копятся в памяти
+    reaction_aggregator.flush()
     
-    query = session.query(Reaction.dominant_emotion, Meme.source).join(Meme)
-    reactions_df = pd.read_sql(query.statement, session.bind)
+    reactions_count = session.query(func.count(Reaction.id)).scalar()
     
-    if reactions_df.empty or len(reactions_df) < 10:
-        message = f"Обучение невозможно. Собрано {len(reactions_df)} реакций, а нужно минимум 10."
+    if reactions_count < 10:
+        message = f"Обучение невозможно. Собрано {reactions_count} реакций, а нужно минимум 10."
         print(message)
         return jsonify({"message": message})
 
-    recommender.train(reactions_df)
-    
-    message = f"Модель обучена на {len(reactions_df)} реакциях!"
-    return jsonify({"message": message})
+    # История реакций читается кусками по REFIT_CHUNK, а не в один DataFrame
+    if not training_job.start(reaction_history(Session, emotion_events, REFIT_CHUNK)):
+        return jsonify({"message": "Обучение уже идет", "status": training_job.status()}), 409
+
+    message = f"Обучение на {reactions_count} реакциях запущено"
+    return jsonify({"message": message, "status": training_job.status()}), 202
+
+
+@app.route("/train/status")
+def train_status():
+    """Состояние фонового обучения: state = idle / running / done / failed, эпоха и прогресс."""
+    status = training_job.status()
+    status['model_version'] = recommender.version
+    status['model_is_trained'] = recommender.is_trained
+    return jsonify(status)
 
 
 if __name__ == '__main__':
+    # Сервер разработки. В бою приложение запускает serve.py (gunicorn с предзагрузкой моделей).
+    # С debug=True код выполняется дважды (процесс-наблюдатель и рабочий),
+    # пул поднимаем только в рабочем, чтобы не грузить TensorFlow два раза
+    if os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        emotion_pool.start()
+        warm_up()
     app.run(debug=True)
\ No newline at end of file
@@ -0,0 +1,128 @@
+# benchmarks/check_serve_metrics.py
+#
+# Проверка, что /metrics под serve.py считает запросы всех HTTP-воркеров,
+# а не только того, который ответил на scrape. Поднимает serve.py с двумя
+# воркерами на синтетической базе и заглушке DeepFace, шлет кадры и
+# несколько раз сверяет memepulse_frames_total с числом отправленных кадров.
+#
+#   python benchmarks/check_serve_metrics.py
+#   python benchmarks/check_serve_metrics.py --workers 4 --frames 200
+#
+# Код выхода 1, если хотя бы один scrape разошелся с отправленным.
+
+import io
+import os
+import re
+import sys
+import time
+import socket
+import signal
+import argparse
+import contextlib
+import tempfile
+import subprocess
+import urllib.error
+import urllib.request
+from types import SimpleNamespace
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+from benchmarks.run import prepare_environment, _frames
+
+FRAMES_TOTAL = re.compile(r'^memepulse_frames_total\{result="([^"]+)"\} (\S+)$', re.MULTILINE)
+GAUGE_PID = re.compile(r'^memepulse_candidate_queue_size\{pid="(\d+)"\}', re.MULTILINE)
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _request(url, data=None, headers=None, timeout=30):
+    """(код, тело). Каждый запрос - новое соединение, поэтому запросы расходятся по воркерам."""
+    request = urllib.request.Request(url, data=data, headers={'Connection': 'close', **(headers or {})})
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            return response.status, response.read().decode()
+    except urllib.error.HTTPError as e:
+        return e.code, e.read().decode()
+
+
+def _wait_ready(base_url, server, timeout=180):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"serve.py завершился с кодом {server.returncode}")
+        try:
+            if _request(f"{base_url}/ready", timeout=5)[0] == 200:
+                return
+        except OSError:
+            pass
+        time.sleep(0.5)
+    raise RuntimeError(f"serve.py не стал готов за {timeout} с")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Метрики serve.py складываются по всем воркерам")
+    parser.add_argument('--workers', type=int, default=2, help="HTTP-воркеров gunicorn")
+    parser.add_argument('--frames', type=int, default=60, help="сколько кадров отправить")
+    parser.add_argument('--scrapes', type=int, default=10, help="сколько раз читать /metrics")
+    parser.add_argument('--verbose', action='store_true', help="показать вывод serve.py")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory(prefix='memepulse-metrics-') as workdir:
+        paths = prepare_environment(workdir, SimpleNamespace(post_count=1, real_emotion_model=False))
+        from benchmarks.synthetic_db import generate
+        with contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO()):
+            generate(paths['MEMES_DB_PATH'], memes=2000, reactions=500, images=0,
+                     embeddings_path=paths['EMBEDDINGS_PATH'])
+
+        port = _free_port()
+        base_url = f"http://127.0.0.1:{port}"
+        env = dict(os.environ, SERVE_BIND=f"127.0.0.1:{port}", SERVE_WORKERS=str(args.workers),
+                   SERVE_RELOAD_INTERVAL='0', EMOTION_WORKERS='1',
+                   METRICS_MULTIPROC_DIR=os.path.join(workdir, 'metrics'),
+                   PYTHONPATH=os.pathsep.join(filter(None, [PROJECT_ROOT, os.getenv('PYTHONPATH')])))
+        output = None if args.verbose else subprocess.DEVNULL
+        server = subprocess.Popen([sys.executable, os.path.join(PROJECT_ROOT, 'serve.py')], cwd=workdir,
+                                  env=env, stdout=output, stderr=output)
+        try:
+            _wait_ready(base_url, server)
+            frames = _frames(0)
+            statuses = {}
+            for i in range(args.frames):
+                # Разные сессии и кадры: фильтр кадров их не отсеет, но считаются все
+                status, _ = _request(f"{base_url}/analyze/frame?meme_id={i % 100 + 1}&session_id=check-{i}",
+                                     data=frames[i % len(frames)], headers={'Content-Type': 'image/jpeg'})
+                statuses[status] = statuses.get(status, 0) + 1
+            print(f"Отправлено кадров: {args.frames}, ответы: {statuses}")
+
+            failed = 0
+            pids = set()
+            for _ in range(args.scrapes):
+                _, body = _request(f"{base_url}/metrics")
+                counted = sum(float(value) for _, value in FRAMES_TOTAL.findall(body))
+                pids.update(GAUGE_PID.findall(body))
+                if counted != args.frames:
+                    failed += 1
+                    print(f"  scrape: memepulse_frames_total = {counted:g}, ожидалось {args.frames}")
+            print(f"Процессов с метриками (по метке pid): {len(pids)}")
+        finally:
+            server.send_signal(signal.SIGTERM)
+            try:
+                server.wait(timeout=60)
+            except subprocess.TimeoutExpired:
+                server.kill()
+
+    if failed:
+        print(f"ОШИБКА: {failed} из {args.scrapes} scrape разошлись с числом кадров.")
+        return 1
+    print(f"OK: все {args.scrapes} scrape показали {args.frames} кадров.")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,55 @@
+# benchmarks/fake_emotion.py
+#
+# Детерминированная замена EmotionModel для бенчмарков: без DeepFace и TensorFlow,
+# но с тем же интерфейсом и похожей стоимостью пачки. Подключается в воркеры пула так:
+#
+#   EMOTION_MODEL=benchmarks.fake_emotion:FakeEmotionModel
+
+import os
+import time
+import zlib
+
+import numpy as np
+
+from src.emotion_analyzer.model import EMOTION_LABELS, WARMUP_FRAME_SHAPE
+
+# Имитация сети: постоянная часть на вызов predict и добавка за каждый кадр пачки
+FAKE_EMOTION_BATCH_MS = float(os.getenv("FAKE_EMOTION_BATCH_MS", "20"))
+FAKE_EMOTION_FRAME_MS = float(os.getenv("FAKE_EMOTION_FRAME_MS", "3"))
+# Имитация загрузки весов при старте воркера
+FAKE_EMOTION_LOAD_MS = float(os.getenv("FAKE_EMOTION_LOAD_MS", "0"))
+
+
+class FakeEmotionModel:
+    """
+    Эмоция - функция от содержимого кадра: одинаковый кадр всегда дает
+    одинаковый ответ, поэтому прогоны бенчмарка сравнимы между собой.
+    Время ответа пачки - FAKE_EMOTION_BATCH_MS + FAKE_EMOTION_FRAME_MS на кадр.
+    """
+
+    def __init__(self, batch_ms=FAKE_EMOTION_BATCH_MS, frame_ms=FAKE_EMOTION_FRAME_MS, load_ms=FAKE_EMOTION_LOAD_MS):
+        self.batch_ms = batch_ms
+        self.frame_ms = frame_ms
+        self.load_ms = load_ms
+
+    def load(self):
+        time.sleep(self.load_ms / 1000)
+        self.warmup()
+
+    def warmup(self):
+        self.analyze_batch([np.zeros(WARMUP_FRAME_SHAPE, dtype=np.uint8)])
+
+    def analyze(self, img_np, face_crop=False):
+        return self.analyze_batch([img_np], [face_crop])[0]
+
+    def analyze_batch(self, frames, face_crops=None):
+        time.sleep((self.batch_ms + self.frame_ms * len(frames)) / 1000)
+        return [self._predict(frame) for frame in frames]
+
+    @staticmethod
+    def _predict(frame):
+        # Прореженный кадр: хеш не зависит от мелкого шума сжатия JPEG на краях
+        seed = zlib.crc32(np.ascontiguousarray(frame[::16, ::16]).tobytes())
+        probabilities = np.random.default_rng(seed).dirichlet(np.ones(len(EMOTION_LABELS)))
+        emotion = {label: 100 * float(p) for label, p in zip(EMOTION_LABELS, probabilities)}
+        return {'dominant_emotion': max(emotion, key=emotion.get), 'emotion': emotion}
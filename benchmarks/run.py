@@ -0,0 +1,473 @@
+# benchmarks/run.py
+#
+# Воспроизводимый замер горячих путей целиком: главная страница, анализ кадров,
+# обучение, публикация в Telegram и парсинг. Все внешнее подменено: база -
+# синтетическая (synthetic_db.py), DeepFace - детерминированная заглушка
+# (fake_emotion.py), Reddit, VK и Bot API - локальные серверы (stubs.py).
+# Результат - JSON с перцентилями задержек, пропускной способностью и пиком памяти,
+# который можно сравнивать между коммитами.
+#
+#   python benchmarks/run.py --out bench.json
+#   python benchmarks/run.py --memes 20000 --reactions 10000 --requests 200 --out new.json --compare bench.json
+#   python benchmarks/run.py show_meme analyze_emotion --max-regression 20   # код 1, если p50 вырос больше чем на 20%
+#
+# Все файлы (база, кеш картинок, модели) создаются во временной папке,
+# настоящие данные проекта не трогаются.
+
+import os
+import io
+import sys
+import json
+import time
+import base64
+import shutil
+import random
+import asyncio
+import platform
+import argparse
+import resource
+import sqlite3
+import tempfile
+import subprocess
+import contextlib
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+# Сценарии в порядке запуска: обучение идет первым, чтобы выдача и публикация шли по модели
+SCENARIOS = ('train_model_endpoint', 'show_meme', 'analyze_emotion', 'analyze_frame',
+             'post_best_meme', 'run_parsing_job')
+
+# Настройки, которые влияют на цифры и поэтому попадают в отчет
+REPORTED_ENV = ('EMOTION_WORKERS', 'EMOTION_MAX_BATCH', 'EMOTION_MAX_WAIT_MS', 'EMOTION_QUEUE_SIZE',
+                'FAKE_EMOTION_BATCH_MS', 'FAKE_EMOTION_FRAME_MS', 'PARSER_MAX_WORKERS', 'DOWNLOAD_MAX_WORKERS',
+                'SELECTION_CHUNK', 'TG_POST_COUNT')
+
+FRAME_SHAPE = (480, 640, 3)
+FRAME_VARIANTS = 64
+
+
+# --- Окружение ---
+
+def prepare_environment(workdir, args):
+    """
+    Направляет все пути приложения во временную папку. Вызывается до импорта
+    модулей src: пути читаются из окружения при импорте.
+    """
+    paths = {
+        'MEMES_DB_PATH': os.path.join(workdir, 'memes.db'),
+        'IMAGE_STORE_DIR': os.path.join(workdir, 'images'),
+        'EMBEDDINGS_PATH': os.path.join(workdir, 'embeddings.f32'),
+        'PHASH_INDEX_PATH': os.path.join(workdir, 'phash_index.npz'),
+        'MODELS_DIR': os.path.join(workdir, 'models'),
+        'REACTION_JOURNAL_DIR': os.path.join(workdir, 'reaction_journal'),
+        'EMOTION_EVENTS_DIR': os.path.join(workdir, 'emotion_events'),
+        'PROFILE_DIR': os.path.join(workdir, 'profiles'),
+    }
+    os.environ.update(paths)
+    os.environ['TG_POST_COUNT'] = str(args.post_count)
+    # Лица на синтетических кадрах нет - детектор в фильтре кадров отключаем
+    os.environ['GATE_FACE_DETECTION'] = '0'
+    if not args.real_emotion_model:
+        os.environ['EMOTION_MODEL'] = 'benchmarks.fake_emotion:FakeEmotionModel'
+    os.environ.pop('METRICS_TEXTFILE', None)
+    os.environ.pop('PROFILE_SAMPLE_RATE', None)
+    return paths
+
+
+def git_revision():
+    def git(*command):
+        return subprocess.run(['git', *command], cwd=PROJECT_ROOT, capture_output=True, text=True).stdout.strip()
+    try:
+        return {'commit': git('rev-parse', 'HEAD') or None, 'dirty': bool(git('status', '--porcelain', '--untracked-files=no'))}
+    except OSError:
+        return {'commit': None, 'dirty': None}
+
+
+# --- Замеры ---
+
+def _peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # На macOS ru_maxrss в байтах, на Linux - в килобайтах
+    return round((peak / 1024 if sys.platform == 'darwin' else peak) / 1024, 1)
+
+
+def _children_peak_rss_mb():
+    """Сумма пиков памяти живых дочерних процессов (воркеры пула эмоций); Linux."""
+    total_kb = 0
+    for child in multiprocessing.active_children():
+        try:
+            with open(f"/proc/{child.pid}/status") as f:
+                total_kb += next((int(line.split()[1]) for line in f if line.startswith('VmHWM:')), 0)
+        except OSError:
+            return None
+    return round(total_kb / 1024, 1)
+
+
+def summarize(samples, wall_seconds, operations=None, **extra):
+    """Перцентили задержки (мс), пропускная способность (операций/с) и пик памяти."""
+    ms = np.asarray(samples, dtype=float) * 1000
+    result = {'count': len(samples)}
+    if len(ms):
+        result.update({
+            'p50_ms': round(float(np.percentile(ms, 50)), 3),
+            'p90_ms': round(float(np.percentile(ms, 90)), 3),
+            'p99_ms': round(float(np.percentile(ms, 99)), 3),
+            'max_ms': round(float(ms.max()), 3),
+            'mean_ms': round(float(ms.mean()), 3),
+        })
+    result['wall_seconds'] = round(wall_seconds, 3)
+    operations = len(samples) if operations is None else operations
+    result['throughput_per_s'] = round(operations / wall_seconds, 3) if wall_seconds > 0 else None
+    result['peak_rss_mb'] = _peak_rss_mb()
+    children = _children_peak_rss_mb()
+    if children:
+        result['children_peak_rss_mb'] = children
+    result.update(extra)
+    return result
+
+
+def run_load(call, requests, concurrency):
+    """
+    Вызывает call(i) requests раз в concurrency потоков.
+    Возвращает (задержки в секундах, коды ответов, общее время).
+    """
+    def timed_call(i):
+        started = time.perf_counter()
+        status = call(i)
+        return time.perf_counter() - started, status
+
+    started = time.perf_counter()
+    if concurrency <= 1:
+        results = [timed_call(i) for i in range(requests)]
+    else:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            results = list(executor.map(timed_call, range(requests)))
+    wall = time.perf_counter() - started
+    statuses = {}
+    for _, status in results:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    return [seconds for seconds, _ in results], statuses, wall
+
+
+def _scalar(db_path, sql):
+    connection = sqlite3.connect(db_path)
+    try:
+        return connection.execute(sql).fetchone()[0]
+    finally:
+        connection.close()
+
+
+def _frames(seed):
+    """Несколько разных JPEG-кадров размером с кадр веб-камеры."""
+    import cv2
+
+    rng = np.random.default_rng(seed)
+    frames = []
+    for _ in range(FRAME_VARIANTS):
+        blocks = rng.integers(0, 256, (12, 16, 3), dtype=np.uint8)
+        frame = cv2.resize(blocks, (FRAME_SHAPE[1], FRAME_SHAPE[0]), interpolation=cv2.INTER_LINEAR)
+        frames.append(cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, 80])[1].tobytes())
+    return frames
+
+
+# --- Сценарии ---
+
+class Bench:
+    """Общее состояние прогона: приложение, заглушки, параметры."""
+
+    def __init__(self, args, paths, stubs):
+        self.args = args
+        self.paths = paths
+        self.stubs = stubs
+        self.rng = random.Random(args.seed)
+        self._app = None
+
+    @property
+    def app(self):
+        if self._app is None:
+            import app
+            self._app = app
+        return self._app
+
+    def close(self):
+        """Останавливает фоновые части приложения, пока временная папка еще существует."""
+        if self._app is not None:
+            self._app.reaction_aggregator.stop()
+            self._app.recommender.checkpoint()
+            self._app.emotion_pool.shutdown()
+            # Иначе atexit закроет сегмент событий уже после удаления временной папки
+            self._app.emotion_events.seal()
+
+    def unseen_ids(self, limit=10000):
+        connection = sqlite3.connect(self.paths['MEMES_DB_PATH'])
+        try:
+            return [row[0] for row in connection.execute(
+                "SELECT id FROM memes WHERE is_seen = 0 AND published_at IS NULL ORDER BY id LIMIT ?", (limit,))]
+        finally:
+            connection.close()
+
+    def train_model_endpoint(self):
+        client = self.app.app.test_client()
+        samples, states = [], []
+        started = time.perf_counter()
+        for _ in range(self.args.train_runs):
+            run_started = time.perf_counter()
+            response = client.get('/train')
+            if response.status_code != 202:
+                states.append(f"http {response.status_code}")
+                continue
+            # /train только запускает обучение - ждем, пока фоновая задача закончит
+            while True:
+                status = client.get('/train/status').get_json()
+                if status['state'] not in ('running', 'idle'):
+                    break
+                time.sleep(0.02)
+            samples.append(time.perf_counter() - run_started)
+            states.append(status['state'])
+        reactions = _scalar(self.paths['MEMES_DB_PATH'], "SELECT COUNT(*) FROM reactions")
+        return summarize(samples, time.perf_counter() - started, operations=reactions * len(samples),
+                         reactions=reactions, states=states, throughput_unit='reactions/s')
+
+    def show_meme(self):
+        client = self.app.app.test_client()
+        samples, statuses, wall = run_load(lambda i: client.get('/').status_code,
+                                           self.args.requests, self.args.concurrency)
+        return summarize(samples, wall, statuses=statuses, first_ms=round(samples[0] * 1000, 3) if samples else None)
+
+    def _start_pool(self):
+        started = time.perf_counter()
+        pool = self.app.emotion_pool
+        pool.start()
+        deadline = started + 120
+        while not pool.is_ready:
+            if time.perf_counter() > deadline:
+                raise RuntimeError("Воркеры пула эмоций не поднялись за 120 с")
+            time.sleep(0.05)
+        return round(time.perf_counter() - started, 3)
+
+    def _analyze(self, send):
+        pool_start = self._start_pool()
+        frames = _frames(self.args.seed)
+        meme_ids = self.unseen_ids()
+        # Каждый "клиент" смотрит свой мем и шлет разные кадры, чтобы фильтр их не отсеял
+        plan = [(self.rng.choice(meme_ids), frames[i % len(frames)], f"bench-{i % 32}")
+                for i in range(self.args.requests)]
+        client = self.app.app.test_client()
+        samples, statuses, wall = run_load(lambda i: send(client, *plan[i]), self.args.requests,
+                                           self.args.concurrency)
+        self.app.reaction_aggregator.flush()
+        return summarize(samples, wall, statuses=statuses, pool_start_seconds=pool_start,
+                         avg_batch_size=self.app.emotion_pool.stats().get('avg_batch_size'),
+                         gate_skip_rate=self.app.frame_gate.stats().get('skip_rate'))
+
+    def analyze_emotion(self):
+        def send(client, meme_id, frame, session_id):
+            data_url = 'data:image/jpeg;base64,' + base64.b64encode(frame).decode()
+            return client.post('/analyze', json={'image': data_url, 'meme_id': meme_id,
+                                                 'session_id': session_id}).status_code
+        return self._analyze(send)
+
+    def analyze_frame(self):
+        def send(client, meme_id, frame, session_id):
+            return client.post(f"/analyze/frame?meme_id={meme_id}&session_id={session_id}",
+                               data=frame, content_type='image/jpeg').status_code
+        return self._analyze(send)
+
+    def post_best_meme(self):
+        from src.telegram_bot import poster
+        from src.telegram_bot.publisher import close_publisher
+
+        db_path = self.paths['MEMES_DB_PATH']
+        published_before = _scalar(db_path, "SELECT COUNT(*) FROM memes WHERE published_at IS NOT NULL")
+        uploads_before = self.stubs.calls['telegram.uploads']
+        loop = asyncio.new_event_loop()
+        samples = []
+        started = time.perf_counter()
+        try:
+            for _ in range(self.args.post_runs):
+                run_started = time.perf_counter()
+                loop.run_until_complete(poster.post_best_meme())
+                samples.append(time.perf_counter() - run_started)
+            wall = time.perf_counter() - started
+            loop.run_until_complete(close_publisher())
+        finally:
+            loop.close()
+        published = _scalar(db_path, "SELECT COUNT(*) FROM memes WHERE published_at IS NOT NULL") - published_before
+        return summarize(samples, wall, operations=published, published=published,
+                         uploads=self.stubs.calls['telegram.uploads'] - uploads_before, throughput_unit='memes/s')
+
+    def run_parsing_job(self):
+        import scheduler
+
+        db_path = self.paths['MEMES_DB_PATH']
+        samples, added = [], []
+        started = time.perf_counter()
+        images_before = self.stubs.calls['image']
+        for run in range(self.args.parse_runs):
+            if run:
+                # Между запусками в каждой ленте появляются новые посты
+                self.stubs.advance(self.args.new_posts)
+            memes_before = _scalar(db_path, "SELECT COUNT(*) FROM memes")
+            run_started = time.perf_counter()
+            scheduler.run_parsing_job()
+            samples.append(time.perf_counter() - run_started)
+            added.append(_scalar(db_path, "SELECT COUNT(*) FROM memes") - memes_before)
+        wall = time.perf_counter() - started
+        return summarize(samples, wall, operations=sum(added), memes_added=added,
+                         images_downloaded=self.stubs.calls['image'] - images_before, throughput_unit='memes/s')
+
+
+# --- Отчет ---
+
+def compare(report, baseline):
+    """Строки сравнения с прошлым отчетом: относительное изменение p50, p99 и пропускной способности."""
+    rows = []
+    for name, current in report['scenarios'].items():
+        previous = baseline.get('scenarios', {}).get(name)
+        if not previous or 'error' in current or 'error' in previous:
+            continue
+        changes = {}
+        for key in ('p50_ms', 'p99_ms', 'throughput_per_s', 'peak_rss_mb'):
+            if current.get(key) is not None and previous.get(key):
+                changes[key] = (previous[key], current[key], 100.0 * (current[key] - previous[key]) / previous[key])
+        rows.append({'scenario': name, 'changes': changes})
+    return rows
+
+
+def print_summary(report, comparison, out=sys.stderr):
+    print(f"{'сценарий':<22}{'n':>6}{'p50, мс':>11}{'p90, мс':>11}{'p99, мс':>11}{'оп/с':>11}{'RSS, МБ':>10}", file=out)
+    for name, row in report['scenarios'].items():
+        if 'error' in row:
+            print(f"{name:<22}  ошибка: {row['error']}", file=out)
+            continue
+        cells = [f"{row.get(key, 0) or 0:>11.2f}" for key in ('p50_ms', 'p90_ms', 'p99_ms', 'throughput_per_s')]
+        print(f"{name:<22}{row['count']:>6}{''.join(cells)}{row['peak_rss_mb']:>10.1f}", file=out)
+    if comparison:
+        print("\nИзменение относительно базового отчета:", file=out)
+        for row in comparison:
+            changes = ', '.join(f"{key} {old:.2f} -> {new:.2f} ({delta:+.1f}%)"
+                                for key, (old, new, delta) in row['changes'].items())
+            print(f"  {row['scenario']}: {changes}", file=out)
+
+
+def regressions(comparison, max_regression):
+    """Сценарии, где p50 вырос больше чем на max_regression процентов."""
+    problems = []
+    for row in comparison:
+        old, new, delta = row['changes'].get('p50_ms', (None, None, 0))
+        if delta > max_regression:
+            problems.append(f"{row['scenario']}: p50 {old:.2f} -> {new:.2f} мс ({delta:+.1f}%)")
+    return problems
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Бенчмарк горячих путей MemePulseAI на синтетических данных")
+    parser.add_argument('scenarios', nargs='*', metavar='scenario',
+                        help=f"какие сценарии запускать: {', '.join(SCENARIOS)} (по умолчанию все)")
+    parser.add_argument('--memes', type=int, default=100_000, help="мемов в синтетической базе")
+    parser.add_argument('--reactions', type=int, default=50_000, help="мемов с реакцией")
+    parser.add_argument('--frames-per-reaction', type=int, default=20, help="кадров на реакцию в среднем")
+    parser.add_argument('--images', type=int, default=2000, help="разных картинок в кеше")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--requests', type=int, default=500, help="запросов в сценариях show_meme и analyze_*")
+    parser.add_argument('--concurrency', type=int, default=4, help="параллельных клиентов в HTTP-сценариях")
+    parser.add_argument('--train-runs', type=int, default=3)
+    parser.add_argument('--post-runs', type=int, default=5)
+    parser.add_argument('--post-count', type=int, default=5, help="мемов за одну публикацию (TG_POST_COUNT)")
+    parser.add_argument('--parse-runs', type=int, default=3, help="первый запуск парсинга и инкрементальные")
+    parser.add_argument('--new-posts', type=int, default=20, help="новых постов в ленте между запусками парсинга")
+    parser.add_argument('--feed-posts', type=int, default=300, help="постов в каждой ленте заглушек в начале")
+    parser.add_argument('--telegram-latency-ms', type=float, default=0, help="задержка ответа заглушки Bot API")
+    parser.add_argument('--real-emotion-model', action='store_true', help="настоящий DeepFace вместо заглушки")
+    parser.add_argument('--workdir', help="папка для базы и кешей (по умолчанию временная, удаляется)")
+    parser.add_argument('--out', help="куда записать JSON-отчет (по умолчанию stdout)")
+    parser.add_argument('--compare', metavar='BASELINE', help="прошлый JSON-отчет для сравнения")
+    parser.add_argument('--max-regression', type=float, help="код 1, если p50 вырос больше, чем на столько процентов")
+    parser.add_argument('--verbose', action='store_true', help="не скрывать вывод приложения")
+    args = parser.parse_args(argv)
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"неизвестные сценарии: {', '.join(sorted(unknown))}")
+    if args.max_regression is not None and not args.compare:
+        parser.error("--max-regression имеет смысл только вместе с --compare")
+    selected = [name for name in SCENARIOS if name in (args.scenarios or SCENARIOS)]
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+    out_path = os.path.abspath(args.out) if args.out else None
+
+    workdir = os.path.abspath(args.workdir) if args.workdir else tempfile.mkdtemp(prefix='memepulse-bench-')
+    os.makedirs(workdir, exist_ok=True)
+    paths = prepare_environment(workdir, args)
+
+    from benchmarks.stubs import StubServices
+    from benchmarks.synthetic_db import generate
+
+    report = {'meta': {
+        **git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'started_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'params': {key: value for key, value in vars(args).items()
+                   if key not in ('scenarios', 'workdir', 'out', 'compare', 'max_regression', 'verbose')},
+        'env': {name: os.environ[name] for name in REPORTED_ENV if name in os.environ},
+    }, 'scenarios': {}}
+
+    def quiet():
+        # Приложение много печатает - в отчет это не нужно
+        return contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+
+    try:
+        with StubServices(initial_posts=args.feed_posts, telegram_latency_ms=args.telegram_latency_ms) as stubs:
+            os.environ.update(stubs.env())
+            print(f"Синтетическая база: {args.memes} мемов в {workdir}...", file=sys.stderr)
+            with quiet():
+                report['meta']['dataset'] = generate(
+                    paths['MEMES_DB_PATH'], args.memes, args.reactions, args.frames_per_reaction, args.images,
+                    embeddings_path=paths['EMBEDDINGS_PATH'], image_store_dir=paths['IMAGE_STORE_DIR'],
+                    events_dir=paths['EMOTION_EVENTS_DIR'], seed=args.seed)
+            bench = Bench(args, paths, stubs)
+            for name in selected:
+                print(f"Сценарий {name}...", file=sys.stderr)
+                try:
+                    with quiet():
+                        report['scenarios'][name] = getattr(bench, name)()
+                except Exception as e:
+                    report['scenarios'][name] = {'error': f"{type(e).__name__}: {e}"}
+            report['meta']['stub_calls'] = dict(stubs.calls)
+            with quiet():
+                bench.close()
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    comparison = compare(report, baseline) if baseline else []
+    if comparison:
+        report['comparison'] = {'baseline_commit': baseline.get('meta', {}).get('commit'),
+                                'rows': comparison}
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if out_path:
+        with open(out_path, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+    print_summary(report, comparison)
+
+    problems = regressions(comparison, args.max_regression) if args.max_regression is not None else []
+    for problem in problems:
+        print(f"РЕГРЕССИЯ: {problem}", file=sys.stderr)
+    failed = [name for name, row in report['scenarios'].items() if 'error' in row]
+    return 1 if problems or failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,154 @@
+# benchmarks/startup.py
+#
+# Время импорта и память каждой точки входа. Каждый модуль импортируется
+# в отдельном чистом процессе (иначе второй замер получил бы уже загруженные
+# зависимости первого), поэтому цифры - это честный холодный старт.
+#
+#   python benchmarks/startup.py
+#   python benchmarks/startup.py --repeat 5 --json
+#   python benchmarks/startup.py --max-seconds 2 --max-rss-mb 300   # для CI: код 1 при регрессии
+
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+import tempfile
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Точка входа -> модуль, который она импортирует при старте
+TARGETS = {
+    'app': 'app',
+    'scheduler': 'scheduler',
+    'poster': 'src.telegram_bot.poster',
+    'reddit_parser': 'src.parsers.reddit_parser',
+    'vk_parser': 'src.parsers.vk_parser',
+}
+
+# Зависимости, которые не должны грузиться без необходимости
+HEAVY_MODULES = ('tensorflow', 'deepface', 'torch', 'sklearn', 'pandas', 'scipy',
+                 'cv2', 'PIL', 'praw', 'vk_api', 'aiogram', 'flask', 'sqlalchemy')
+
+# Код, который выполняется в дочернем процессе
+_PROBE = r'''
+import sys, time, json, resource, importlib
+started = time.perf_counter()
+error = None
+try:
+    importlib.import_module(sys.argv[1])
+except BaseException as e:
+    error = f"{type(e).__name__}: {e}"
+seconds = time.perf_counter() - started
+
+rss_kb = None
+try:
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                rss_kb = int(line.split()[1])
+except OSError:
+    pass
+peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+# На macOS ru_maxrss в байтах, на Linux - в килобайтах
+peak_kb = peak // 1024 if sys.platform == 'darwin' else peak
+heavy = sorted(name for name in json.loads(sys.argv[2]) if name in sys.modules)
+print(json.dumps({'seconds': seconds, 'rss_kb': rss_kb or peak_kb, 'peak_rss_kb': peak_kb,
+                  'modules': len(sys.modules), 'heavy': heavy, 'error': error}))
+'''
+
+
+def probe(module, workdir):
+    """Импортирует module в новом интерпретаторе и возвращает его замер."""
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [PROJECT_ROOT, os.getenv('PYTHONPATH')])))
+    # app.py при импорте создает и мигрирует memes.db (по умолчанию - в корне проекта),
+    # поэтому база и все данные, которые процесс может записать, живут во временной папке
+    data_dir = os.path.join(workdir, 'data')
+    env.update(
+        MEMES_DB_PATH=os.path.join(workdir, 'memes.db'),
+        IMAGE_STORE_DIR=os.path.join(data_dir, 'images'),
+        EMBEDDINGS_PATH=os.path.join(data_dir, 'embeddings.f32'),
+        PHASH_INDEX_PATH=os.path.join(data_dir, 'phash_index.npz'),
+        EMOTION_EVENTS_DIR=os.path.join(data_dir, 'emotion_events'),
+        REACTION_JOURNAL_DIR=os.path.join(data_dir, 'reaction_journal'),
+    )
+    result = subprocess.run([sys.executable, '-c', _PROBE, module, json.dumps(HEAVY_MODULES)],
+                            cwd=workdir, env=env, capture_output=True, text=True)
+    # Последняя строка - наш JSON, все выше - печать самих модулей при импорте
+    lines = result.stdout.strip().splitlines()
+    if result.returncode != 0 or not lines:
+        return {'seconds': None, 'rss_kb': None, 'peak_rss_kb': None, 'modules': None, 'heavy': [],
+                'error': (result.stderr.strip().splitlines() or ['процесс упал'])[-1]}
+    return json.loads(lines[-1])
+
+
+def measure(targets, repeat=3):
+    """Медиана времени по repeat запускам, память и тяжелые модули - по последнему."""
+    report = {}
+    with tempfile.TemporaryDirectory(prefix='memepulse-startup-') as workdir:
+        baseline = [probe('sys', workdir) for _ in range(repeat)]
+        report['python'] = dict(baseline[-1], seconds=statistics.median(r['seconds'] for r in baseline))
+        for name in targets:
+            runs = [probe(TARGETS[name], workdir) for _ in range(repeat)]
+            last = runs[-1]
+            times = [r['seconds'] for r in runs if r['seconds'] is not None]
+            report[name] = dict(last, seconds=statistics.median(times) if times else None)
+    return report
+
+
+def check_budget(report, max_seconds=None, max_rss_mb=None):
+    """Список нарушений бюджета (пустой - все в порядке)."""
+    problems = []
+    for name, row in report.items():
+        if name == 'python':
+            continue
+        if row['error']:
+            problems.append(f"{name}: импорт не удался ({row['error']})")
+            continue
+        if max_seconds is not None and row['seconds'] > max_seconds:
+            problems.append(f"{name}: импорт {row['seconds']:.2f} c > {max_seconds} c")
+        if max_rss_mb is not None and row['rss_kb'] / 1024 > max_rss_mb:
+            problems.append(f"{name}: память {row['rss_kb'] / 1024:.0f} МБ > {max_rss_mb} МБ")
+    return problems
+
+
+def print_table(report):
+    print(f"{'точка входа':<15}{'импорт, с':>10}{'RSS, МБ':>10}{'модулей':>10}  тяжелые зависимости")
+    for name, row in report.items():
+        if row['seconds'] is None:
+            print(f"{name:<15}{'-':>10}{'-':>10}{'-':>10}  ошибка: {row['error']}")
+            continue
+        heavy = ', '.join(row['heavy']) or '-'
+        print(f"{name:<15}{row['seconds']:>10.3f}{row['rss_kb'] / 1024:>10.1f}{row['modules']:>10}  {heavy}")
+        if row['error']:
+            print(f"{'':<15}ошибка импорта: {row['error']}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Время импорта и память точек входа MemePulseAI")
+    parser.add_argument('targets', nargs='*', metavar='target',
+                        help=f"какие точки входа мерить: {', '.join(TARGETS)} (по умолчанию все)")
+    parser.add_argument('--repeat', type=int, default=3, help="запусков на точку входа (берется медиана)")
+    parser.add_argument('--json', action='store_true', help="вывести результат в JSON")
+    parser.add_argument('--max-seconds', type=float, help="бюджет на время импорта одной точки входа")
+    parser.add_argument('--max-rss-mb', type=float, help="бюджет на память после импорта")
+    args = parser.parse_args(argv)
+    unknown = set(args.targets) - set(TARGETS)
+    if unknown:
+        parser.error(f"неизвестные точки входа: {', '.join(sorted(unknown))}")
+
+    report = measure(args.targets or list(TARGETS), repeat=max(1, args.repeat))
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        print_table(report)
+
+    problems = check_budget(report, args.max_seconds, args.max_rss_mb)
+    for problem in problems:
+        print(f"РЕГРЕССИЯ: {problem}", file=sys.stderr)
+    return 1 if problems else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
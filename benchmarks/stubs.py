@@ -0,0 +1,291 @@
+# benchmarks/stubs.py
+#
+# Локальные заглушки внешних сервисов для бенчмарков: Reddit (OAuth и ленты /hot, /new),
+# VK API (groups.getById, wall.get) и Telegram Bot API (sendPhoto, sendMediaGroup),
+# плюс раздача картинок. Ответы детерминированы, а задержка задается явно,
+# поэтому время парсинга и публикации зависит только от нашего кода.
+#
+#   with StubServices() as stubs:
+#       os.environ.update(stubs.env())
+#       ...
+#       stubs.advance(20)   # в каждой ленте появилось 20 новых постов
+
+import json
+import time
+import zlib
+import email
+import itertools
+import threading
+from collections import Counter
+from urllib.parse import urlparse, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import numpy as np
+
+# Условное "сейчас" лент: посты идут раз в минуту до этого момента
+FEED_EPOCH = 1_700_000_000
+# Каждый N-й пост Reddit - ссылка, а не картинка; каждый M-й - кросспост картинки из r/memes
+REDDIT_LINK_EVERY = 5
+REDDIT_CROSSPOST_EVERY = 20
+# Сколько постов Reddit отдает на одну страницу при запросе без limit
+REDDIT_PAGE_MAX = 100
+
+
+def synthetic_image(key, size=320):
+    """Детерминированный JPEG по ключу: разные ключи дают непохожие картинки."""
+    import cv2
+
+    rng = np.random.default_rng(zlib.crc32(key.encode()))
+    blocks = rng.integers(0, 256, (8, 8, 3), dtype=np.uint8)
+    image = cv2.resize(blocks, (size, size), interpolation=cv2.INTER_NEAREST)
+    return cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, 85])[1].tobytes()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """Общая часть обработчиков: чтение тела (в том числе chunked) и ответы."""
+    protocol_version = 'HTTP/1.1'
+    service = None  # StubServices, проставляется в start()
+
+    def log_message(self, format, *args):
+        pass
+
+    def _body(self):
+        if self.headers.get('Transfer-Encoding') == 'chunked':
+            # aiohttp отправляет файлы (FSInputFile) потоком, без Content-Length
+            body = b''
+            while True:
+                size = int(self.rfile.readline().strip(), 16)
+                if not size:
+                    self.rfile.readline()
+                    return body
+                body += self.rfile.read(size)
+                self.rfile.readline()
+        return self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+    def _send(self, status, body, content_type='application/json'):
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _image(self, key):
+        self.service.count('image')
+        self._send(200, synthetic_image(key, self.service.image_size), 'image/jpeg')
+
+
+class _RedditHandler(_Handler):
+
+    def do_POST(self):
+        self._body()
+        if self.path.startswith('/api/v1/access_token'):
+            self.service.count('reddit.token')
+            return self._send(200, {'access_token': 'bench-token', 'token_type': 'bearer',
+                                    'expires_in': 86400, 'scope': '*'})
+        self._send(404, {'error': 404})
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        parts = url.path.strip('/').split('/')
+        if parts[0] == 'img':
+            return self._image(url.path)
+        # Первый запуск парсера читает /hot, дальнейшие - /new. В заглушке это
+        # одна и та же лента от новых к старым
+        if len(parts) >= 3 and parts[0] == 'r' and parts[2] in ('hot', 'new'):
+            self.service.count(f'reddit.{parts[2]}')
+            query = {key: values[0] for key, values in parse_qs(url.query).items()}
+            return self._send(200, self._listing(parts[1], int(query.get('limit', REDDIT_PAGE_MAX)),
+                                                 query.get('after')))
+        self._send(404, {'error': 404})
+
+    def _post(self, sub, number):
+        base = f"http://127.0.0.1:{self.server.server_address[1]}/img"
+        if number % REDDIT_CROSSPOST_EVERY == 0:
+            url = f"{base}/r/memes/{number}.jpg"
+        elif number % REDDIT_LINK_EVERY == 0:
+            url = f"https://example.com/{sub}/{number}.html"
+        else:
+            url = f"{base}/r/{sub}/{number}.jpg"
+        post_id = f"{zlib.crc32(sub.encode()) & 0xfffff:x}z{number}"
+        return {'kind': 't3', 'data': {
+            'id': post_id, 'name': f"t3_{post_id}", 'title': f"{sub} пост {number}", 'url': url,
+            'created_utc': float(FEED_EPOCH + number * 60), 'stickied': False,
+            'subreddit': sub, 'author': 'bench', 'permalink': f"/r/{sub}/comments/{post_id}/",
+        }}
+
+    def _listing(self, sub, limit, after):
+        top = self.service.feed_top(f"r/{sub}")
+        numbers = list(range(top, 0, -1))
+        if after:
+            # after - fullname последнего поста прошлой страницы
+            last = int(after.rsplit('z', 1)[1])
+            numbers = [number for number in numbers if number < last]
+        page = numbers[:min(limit, REDDIT_PAGE_MAX)]
+        children = [self._post(sub, number) for number in page]
+        if not after:
+            # Закрепленный старый пост стоит первым, как на настоящем сабреддите
+            pinned = self._post(sub, 1)
+            pinned['data']['stickied'] = True
+            children.insert(0, pinned)
+        next_after = children[-1]['data']['name'] if len(numbers) > len(page) else None
+        return {'kind': 'Listing', 'data': {'after': next_after, 'before': None, 'children': children}}
+
+
+class _VkHandler(_Handler):
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path.startswith('/img/'):
+            return self._image(url.path)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        method = url.path.rsplit('/', 1)[-1]
+        self.service.count(f"vk.{method}")
+        if method == 'groups.getById':
+            return self._send(200, {'response': [{'id': self.service.vk_group_id(query['group_id'])}]})
+        if method == 'wall.get':
+            return self._send(200, {'response': self._wall(query['owner_id'], int(query.get('count', 20)),
+                                                           int(query.get('offset', 0)))})
+        self._send(200, {'error': {'error_code': 3, 'error_msg': f"Unknown method {method}"}})
+
+    def _wall(self, owner_id, count, offset):
+        group_id = abs(int(owner_id))
+        top = self.service.feed_top(f"vk/{group_id}")
+        # Закрепленный пост - старый, но стоит первым
+        numbers = [1] + list(range(top, 0, -1))
+        base = f"http://127.0.0.1:{self.server.server_address[1]}/img/vk"
+        items = []
+        for position, number in enumerate(numbers[offset:offset + count], start=offset):
+            post = {'id': number, 'date': FEED_EPOCH + number * 60, 'text': f"пост {number}",
+                    'attachments': [{'type': 'photo', 'photo': {'id': group_id * 1_000_000 + number, 'sizes': [
+                        {'width': 130, 'url': f"{base}/{group_id}/{number}_s.jpg"},
+                        {'width': 604, 'url': f"{base}/{group_id}/{number}.jpg"},
+                    ]}}]}
+            if position == 0:
+                post['is_pinned'] = 1
+            items.append(post)
+        return {'count': len(numbers), 'items': items}
+
+
+class _TelegramHandler(_Handler):
+
+    def do_POST(self):
+        method = self.path.rsplit('/', 1)[-1]
+        body = self._body()
+        fields, uploads = self._fields(body)
+        self.service.count(f"telegram.{method}")
+        self.service.count('telegram.uploads', uploads)
+        if self.service.telegram_latency_ms:
+            time.sleep(self.service.telegram_latency_ms / 1000)
+
+        if method == 'sendPhoto':
+            return self._send(200, {'ok': True, 'result': self._message(fields.get('photo', ''))})
+        if method == 'sendMediaGroup':
+            media = fields['media']
+            media = json.loads(media) if isinstance(media, str) else media
+            return self._send(200, {'ok': True, 'result': [self._message(item['media']) for item in media]})
+        self._send(200, {'ok': True, 'result': True})
+
+    def _fields(self, body):
+        content_type = self.headers.get('Content-Type', '')
+        if 'multipart' in content_type:
+            message = email.message_from_bytes(b'Content-Type: ' + content_type.encode() + b'\r\n\r\n' + body)
+            fields, uploads = {}, 0
+            for part in message.get_payload():
+                if part.get_filename() is not None:
+                    uploads += 1
+                else:
+                    fields[part.get_param('name', header='content-disposition')] = part.get_payload(decode=True).decode()
+            return fields, uploads
+        if 'json' in content_type:
+            return json.loads(body), 0
+        # Запросы без файлов aiogram отправляет обычной формой
+        return {key: values[0] for key, values in parse_qs(body.decode()).items()}, 0
+
+    def _message(self, photo):
+        # Уже известный file_id возвращается как есть, загрузка и url получают новый
+        file_id = photo if photo and not photo.startswith(('attach://', 'http')) else self.service.new_file_id()
+        return {'message_id': self.service.new_message_id(), 'date': FEED_EPOCH, 'chat': {'id': -1, 'type': 'channel'},
+                'photo': [{'file_id': f"{file_id}_s", 'file_unique_id': f"{file_id}_s", 'width': 90, 'height': 90},
+                          {'file_id': file_id, 'file_unique_id': file_id, 'width': 320, 'height': 320}]}
+
+
+class StubServices:
+    """
+    Три заглушки на свободных портах 127.0.0.1. У каждой ленты (сабреддит
+    или группа VK) сначала initial_posts постов; advance(n) добавляет n
+    новых во все ленты. Счетчики вызовов - в calls.
+    """
+
+    def __init__(self, initial_posts=60, image_size=320, telegram_latency_ms=0):
+        self.initial_posts = initial_posts
+        self.image_size = image_size
+        self.telegram_latency_ms = telegram_latency_ms
+        self.calls = Counter()
+        self._feeds = {}
+        self._extra_posts = 0
+        self._file_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._servers = {}
+
+    # --- Состояние, общее для обработчиков ---
+
+    def count(self, name, amount=1):
+        with self._lock:
+            self.calls[name] += amount
+
+    def feed_top(self, feed):
+        """Номер самого нового поста ленты."""
+        with self._lock:
+            return self._feeds.setdefault(feed, self.initial_posts) + self._extra_posts
+
+    def vk_group_id(self, short_name):
+        return zlib.crc32(short_name.encode()) % 1_000_000 + 1
+
+    def new_file_id(self):
+        with self._lock:
+            return f"F{next(self._file_ids)}"
+
+    def new_message_id(self):
+        with self._lock:
+            return next(self._message_ids)
+
+    def advance(self, posts):
+        with self._lock:
+            self._extra_posts += posts
+
+    # --- Запуск ---
+
+    def start(self):
+        for name, handler in (('reddit', _RedditHandler), ('vk', _VkHandler), ('telegram', _TelegramHandler)):
+            server = ThreadingHTTPServer(('127.0.0.1', 0), type(handler.__name__, (handler,), {'service': self}))
+            server.daemon_threads = True
+            threading.Thread(target=server.serve_forever, name=f"stub-{name}", daemon=True).start()
+            self._servers[name] = server
+        return self
+
+    def url(self, name):
+        return f"http://127.0.0.1:{self._servers[name].server_address[1]}"
+
+    def env(self):
+        """Переменные окружения, которые направляют парсеры и публикатор на заглушки."""
+        return {
+            'REDDIT_CLIENT_ID': 'bench', 'REDDIT_CLIENT_SECRET': 'bench', 'REDDIT_USER_AGENT': 'memepulse-bench',
+            'REDDIT_URL': self.url('reddit'), 'REDDIT_OAUTH_URL': self.url('reddit'),
+            'VK_ACCESS_TOKEN': 'bench', 'VK_API_URL': self.url('vk'),
+            'BOT_TOKEN': '123456:bench', 'TELEGRAM_API_URL': self.url('telegram'), 'TG_CHANNEL_ID': '-1001',
+        }
+
+    def stop(self):
+        for server in self._servers.values():
+            server.shutdown()
+            server.server_close()
+        self._servers.clear()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
@@ -0,0 +1,245 @@
+# benchmarks/synthetic_db.py
+#
+# Синтетическая memes.db для бенчмарков: сотни тысяч мемов с реалистичным
+# распределением по источникам (несколько крупных сабреддитов и групп и длинный
+# хвост мелких), реакции, покадровые счетчики эмоций, эмбеддинги и картинки
+# в кеше. Генерация детерминирована: одинаковый --seed дает одинаковую базу.
+#
+#   python benchmarks/synthetic_db.py /tmp/bench/memes.db --memes 100000 --reactions 50000
+#
+# Схема создается миграциями приложения, строки пишутся напрямую через sqlite3
+# пачками - 100 тысяч мемов укладываются в несколько секунд.
+
+import os
+import sys
+import time
+import shutil
+import sqlite3
+import argparse
+import datetime
+
+import numpy as np
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+# Источники, которые реально парсит scheduler.py, - голова распределения
+HEAD_SOURCES = (['memes', 'dankmemes', 'Pikabu', 'wholesomememes', 'rus_memes', 'comics', 'Epicentr']
+                + [f"vk/{group}" for group in ('memes', '4ch', 'dayvinchik', 'dobriememy', 'anekdot')])
+# Длинный хвост: источники, которые когда-то парсились и остались в базе
+TAIL_SOURCES = 40
+# Показатель закона Ципфа: доля i-го по размеру источника ~ 1 / i^ZIPF_EXPONENT
+ZIPF_EXPONENT = 1.1
+
+POSITIVE = ('happy', 'surprise')
+NEGATIVE = ('neutral', 'sad', 'angry', 'disgust', 'fear')
+# Доля опубликованных в канал мемов (они уже не кандидаты)
+PUBLISHED_SHARE = 0.02
+# База "начинается" за год до этой даты, чтобы результат не зависел от текущего времени
+EPOCH_END = datetime.datetime(2024, 1, 1)
+INSERT_BATCH = 10000
+
+
+def source_names():
+    return list(HEAD_SOURCES) + [f"tail_{i:02d}" for i in range(TAIL_SOURCES)]
+
+
+def source_weights(count, exponent=ZIPF_EXPONENT):
+    weights = 1.0 / np.arange(1, count + 1) ** exponent
+    return weights / weights.sum()
+
+
+def _meme_url(source, meme_id):
+    if source.startswith('vk/'):
+        # Мемы из VK хранят в url имя файла, как vk_parser
+        return f"vk_{meme_id}_{meme_id * 7 + 1}.jpg"
+    return f"https://i.redd.it/synthetic{meme_id:08d}.jpg"
+
+
+def _random_image(rng, size=320):
+    """JPEG из крупных цветных блоков: сжимается как картинка, а не как шум."""
+    import cv2
+
+    blocks = rng.integers(0, 256, (8, 8, 3), dtype=np.uint8)
+    image = cv2.resize(blocks, (size, size), interpolation=cv2.INTER_NEAREST)
+    return cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, 85])[1].tobytes()
+
+
+def _create_schema(db_path):
+    from sqlalchemy import create_engine
+    from src.database.migrations import upgrade
+    from src.database.pragmas import configure_sqlite
+
+    engine = configure_sqlite(create_engine(f"sqlite:///{db_path}"))
+    upgrade(engine)
+    engine.dispose()
+
+
+def _insert(connection, sql, rows):
+    for start in range(0, len(rows), INSERT_BATCH):
+        connection.executemany(sql, rows[start:start + INSERT_BATCH])
+
+
+def _write_events(rng, events_dir, count_rows, meme_seconds):
+    """
+    Покадровые события эмоций (src/emotion_store) для тех же кадров, что
+    в reaction_emotion_counts: у каждого кадра его эмоция (у реакций
+    с улыбкой большинство кадров нейтральные) получает 60-100% вероятности,
+    остальное размазано по другим классам. Пишутся сразу сжатым файлом.
+    """
+    from src.emotion_analyzer.model import EMOTION_LABELS
+    from src.emotion_store.store import EVENT_DTYPE, EmotionEventStore
+
+    shutil.rmtree(events_dir, ignore_errors=True)
+    counts = np.array([count for _, _, count in count_rows], dtype=np.int64)
+    meme_ids = np.repeat([meme_id for meme_id, _, _ in count_rows], counts)
+    labels = np.repeat([EMOTION_LABELS.index(emotion) for _, emotion, _ in count_rows], counts)
+
+    probabilities = 0.4 * rng.dirichlet(np.full(len(EMOTION_LABELS), 0.3), size=len(meme_ids))
+    probabilities[np.arange(len(meme_ids)), labels] += 0.6
+    # Кадры реакции идут раз в 1.5 секунды начиная с момента, когда мем появился
+    frame_numbers = np.arange(len(meme_ids)) - np.repeat(np.cumsum(counts) - counts, counts)
+    year_ago = (EPOCH_END - datetime.timedelta(days=365)).timestamp()
+
+    events = np.zeros(len(meme_ids), dtype=EVENT_DTYPE)
+    events['meme_id'] = meme_ids
+    events['session'] = meme_ids * 2654435761 % 2 ** 32
+    events['timestamp_ms'] = (year_ago + meme_seconds[meme_ids - 1]) * 1000 + frame_numbers * 1500
+    events['probabilities'] = np.rint(probabilities * 255)
+
+    store = EmotionEventStore(root=events_dir)
+    store.append_records(events)
+    store.seal()
+    store.compact()
+    return len(events)
+
+
+def generate(db_path, memes=100_000, reactions=50_000, frames_per_reaction=20, images=2000,
+             embeddings_path=None, image_store_dir=None, events_dir=None, seed=0):
+    """
+    Создает базу db_path с нуля. reactions - сколько мемов получили реакцию
+    (у мема одна итоговая реакция), frames_per_reaction - среднее число
+    проанализированных кадров на реакцию в reaction_emotion_counts.
+    Эмбеддинги пишутся в embeddings_path, а images разных картинок - в кеш
+    image_store_dir, и каждый мем ссылается на одну из них (None - без картинок:
+    мемы останутся со ссылками на внешние url). Те же кадры, что в счетчиках,
+    пишутся покадровыми событиями эмоций в events_dir (None - не писать).
+    Возвращает сводку того, что создано.
+    """
+    started = time.perf_counter()
+    rng = np.random.default_rng(seed)
+    if os.path.exists(db_path):
+        os.remove(db_path)
+    os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+    _create_schema(db_path)
+
+    sources = source_names()
+    meme_sources = rng.choice(len(sources), size=memes, p=source_weights(len(sources)))
+    # У каждого источника своя "смешность": от нее зависит доля положительных реакций
+    like_rate = rng.beta(2, 2, size=len(sources))
+
+    meme_ids = np.arange(1, memes + 1)
+    seconds = np.sort(rng.integers(0, 365 * 24 * 3600, size=memes))
+    reacted = np.zeros(memes + 1, dtype=bool)
+    reacted[rng.choice(meme_ids, size=min(reactions, memes), replace=False)] = True
+    published = rng.random(memes) < PUBLISHED_SHARE
+    phashes = rng.integers(np.iinfo(np.int64).min, np.iinfo(np.int64).max, size=memes, dtype=np.int64)
+    year_ago = EPOCH_END - datetime.timedelta(days=365)
+
+    digests = [None]
+    if images and image_store_dir:
+        from src.image_store.store import ImageStore
+
+        store = ImageStore(root=image_store_dir)
+        digests = [store.put(_random_image(rng)) for _ in range(images)]
+
+    meme_rows = []
+    for i, meme_id in enumerate(meme_ids.tolist()):
+        source = sources[meme_sources[i]]
+        created_at = year_ago + datetime.timedelta(seconds=int(seconds[i]))
+        meme_rows.append((meme_id, f"Синтетический мем #{meme_id}", _meme_url(source, meme_id), source,
+                          created_at.isoformat(sep=' '), int(reacted[meme_id]),
+                          (created_at + datetime.timedelta(hours=1)).isoformat(sep=' ') if published[i] else None,
+                          int(phashes[i]), digests[meme_id % len(digests)]))
+
+    reaction_rows, count_rows = [], []
+    frames_total = 0
+    for meme_id in np.flatnonzero(reacted).tolist():
+        liked = rng.random() < like_rate[meme_sources[meme_id - 1]]
+        emotion = str(rng.choice(POSITIVE if liked else NEGATIVE))
+        frames = 1 + int(rng.poisson(max(frames_per_reaction - 1, 0)))
+        # Как на живой веб-камере, нейтральных кадров большинство: улыбка или
+        # удивление мелькают в 10-35% кадров, а реакцией все равно становятся,
+        # потому что важнее нейтрального (EMOTION_PRIORITY). Отрицательная эмоция
+        # важнее нейтрального не считается, поэтому реакцией она бывает, только
+        # если нейтральных кадров не было
+        if emotion in POSITIVE:
+            neutral = frames - max(1, int(frames * rng.uniform(0.1, 0.35)))
+        else:
+            neutral = 0
+        frames_total += frames
+        reaction_rows.append((meme_id, emotion, meme_rows[meme_id - 1][4]))
+        count_rows.append((meme_id, emotion, frames - neutral))
+        if neutral:
+            count_rows.append((meme_id, 'neutral', neutral))
+
+    connection = sqlite3.connect(db_path)
+    try:
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=OFF")
+        with connection:
+            _insert(connection, "INSERT INTO memes (id, title, url, source, created_at, is_seen, published_at, phash, "
+                                "image_digest) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", meme_rows)
+            _insert(connection, "INSERT INTO reactions (meme_id, dominant_emotion, timestamp) VALUES (?, ?, ?)",
+                    reaction_rows)
+            _insert(connection, "INSERT INTO reaction_emotion_counts (meme_id, emotion, count) VALUES (?, ?, ?)",
+                    count_rows)
+        connection.execute("ANALYZE")
+    finally:
+        connection.close()
+
+    if embeddings_path:
+        from src.recommender.embeddings import EMBEDDING_DIM, EMBEDDING_DTYPE, EmbeddingStore
+
+        if os.path.exists(embeddings_path):
+            os.remove(embeddings_path)
+        vectors = rng.random((memes, EMBEDDING_DIM), dtype=np.float32).astype(EMBEDDING_DTYPE)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        EmbeddingStore(embeddings_path).write(meme_ids, vectors)
+
+    events = _write_events(rng, events_dir, count_rows, seconds) if events_dir else 0
+
+    return {
+        'memes': memes,
+        'sources': len(sources),
+        'reactions': len(reaction_rows),
+        'reaction_frames': frames_total,
+        'published': int(published.sum()),
+        'unseen': int(memes - reacted.sum() - (published & ~reacted[1:]).sum()),
+        'images': len(digests) if digests[0] else 0,
+        'emotion_events': events,
+        'seconds': round(time.perf_counter() - started, 2),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Синтетическая база мемов для бенчмарков")
+    parser.add_argument('db_path', help="куда записать базу (существующий файл перезаписывается)")
+    parser.add_argument('--memes', type=int, default=100_000)
+    parser.add_argument('--reactions', type=int, default=50_000, help="мемов с реакцией")
+    parser.add_argument('--frames-per-reaction', type=int, default=20, help="кадров на реакцию в среднем")
+    parser.add_argument('--images', type=int, default=2000, help="разных картинок в кеше (нужен --image-store)")
+    parser.add_argument('--embeddings', help="файл эмбеддингов")
+    parser.add_argument('--image-store', help="папка кеша картинок")
+    parser.add_argument('--events', help="папка событий эмоций")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    summary = generate(args.db_path, args.memes, args.reactions, args.frames_per_reaction, args.images,
+                       args.embeddings, args.image_store, args.events, args.seed)
+    print(', '.join(f"{key}={value}" for key, value in summary.items()))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,22 +1,18 @@
 # create_db.py
 
-from sqlalchemy import create_engine
-from src.database.models import Base
-
-# Имя нашей будущей базы данных
-DB_NAME = "memes.db"
-# Создаем "движок", который будет работать с файлом нашей БД
-engine = create_engine(f"sqlite:///{DB_NAME}")
+from src.config import DB_PATH
+from src.database.engine import get_engine
+from src.database.migrations import upgrade, LATEST_VERSION
 
 def setup_database():
     """
-    Создает таблицы в базе данных на основе моделей.
+    Создает базу или обновляет схему уже существующей до последней версии.
     """
-    print("Создание таблиц в базе данных...")
-    # Base.metadata.create_all() проходит по всем классам, унаследованным от Base,
-    # и создает для них таблицы в БД.
-    Base.metadata.create_all(engine)
-    print(f"База данных '{DB_NAME}' и таблицы успешно созданы.")
+    print("Создание/обновление таблиц в базе данных...")
+    # Миграции идут по порядку от текущей версии базы (PRAGMA user_version),
+    # поэтому этот же скрипт обновляет старые memes.db на месте.
+    upgrade(get_engine())
+    print(f"База данных '{DB_PATH}' готова (версия схемы {LATEST_VERSION}).")
 
 if __name__ == "__main__":
-    setup_database()
\ No newline at end of file
+    setup_database()
@@ -1,23 +1,14 @@
 # scheduler.py
 
-import time
 import os
-import sys
+import time
 import asyncio
-from apscheduler.schedulers.blocking import BlockingScheduler
-from dotenv import load_dotenv
-
-# --- Настройка путей, чтобы планировщик видел наши скрипты ---
-project_root = os.path.dirname(os.path.abspath(__file__))
-sys.path.append(project_root)
 
-# Импортируем наши функции. Переименовываем, чтобы избежать конфликтов.
-from src.parsers.vk_parser import fetch_and_save_vk_memes
-from src.parsers.reddit_parser import fetch_and_save_memes as fetch_and_save_reddit_memes
-from src.telegram_bot.poster import post_best_meme
+from src.config import load_env
+from src.metrics import REGISTRY, timed
 
-# Загружаем переменные окружения (.env)
-load_dotenv()
+# Парсеры и публикация (OpenCV, praw, aiogram, модель) импортируются внутри задач:
+# планировщик стартует мгновенно, а тяжелые модули грузятся при первом запуске задачи
 
 # --- Конфигурация источников ---
 # Русскоязычные
@@ -28,11 +19,29 @@ VK_GROUPS = ['memes', '4ch', 'dayvinchik', 'dobriememy', 'anekdot']
 EN_SUBREDDITS = ["memes", 'dankmemes', "wholesomememes", "comics"]
 
 # --- КОЛИЧЕСТВО МЕМОВ ДЛЯ ЗАГРУЗКИ ---
-# Вот где теперь настраивается количество для каждой группы источников
+# Вот где теперь настраивается количество для каждой группы источников.
+# Оно важно только при первом опросе источника: дальше парсеры читают
+# все посты новее сохраненного курсора (см. src/parsers/cursors.py)
 COUNT_RU_REDDIT = 25
 COUNT_EN_REDDIT = 15
 COUNT_VK = 30
 
+
+def write_metrics():
+    """
+    Файл с метриками для textfile-коллектора node_exporter - METRICS_TEXTFILE
+    (пусто - не писать). Обновляется после каждой задачи: время этапов,
+    пропускная способность парсинга, публикации. Путь читается при вызове,
+    а не при импорте: .env загружается уже в __main__ (load_env).
+    """
+    metrics_textfile = os.getenv("METRICS_TEXTFILE")
+    if not metrics_textfile:
+        return
+    try:
+        REGISTRY.write_textfile(metrics_textfile)
+    except OSError as e:
+        print(f"Не удалось записать метрики в {metrics_textfile}: {e}")
+
 # --- Определение задач (Jobs) ---
 
 def run_parsing_job():
@@ -42,38 +51,84 @@ def run_parsing_job():
     print("="*50)
     print(f"[{time.ctime()}] Запускаю плановый парсинг мемов...")
     try:
-        # Передаем сюда наши переменные с количеством
-        print("\n--- Парсинг русскоязычного Reddit ---")
-        fetch_and_save_reddit_memes(RU_SUBREDDITS, count_per_subreddit=COUNT_RU_REDDIT)
-        
-        print("\n--- Парсинг VK ---")
-        fetch_and_save_vk_memes(VK_GROUPS, count=COUNT_VK)
-        
-        print("\n--- Парсинг англоязычного Reddit ---")
-        fetch_and_save_reddit_memes(EN_SUBREDDITS, count_per_subreddit=COUNT_EN_REDDIT)
-
-        print(f"\n[{time.ctime()}] Все задачи парсинга успешно завершены.")
+        from src.parsers import reddit_parser, vk_parser
+        from src.parsers.ingest import run_ingestion
+
+        # Все источники (Reddit RU, VK, Reddit EN) опрашиваются параллельно,
+        # а не по очереди. Передаем сюда наши переменные с количеством.
+        tasks = (reddit_parser.make_tasks(RU_SUBREDDITS, limit_per_subreddit=COUNT_RU_REDDIT)
+                 + vk_parser.make_tasks(VK_GROUPS, count=COUNT_VK)
+                 + reddit_parser.make_tasks(EN_SUBREDDITS, limit_per_subreddit=COUNT_EN_REDDIT))
+        with timed('job.parsing'):
+            results = run_ingestion(tasks)
+
+        for label, stats in sorted(results.items()):
+            print(f"  {label}: добавлено {stats.inserted}, пропущено {stats.skipped}, почти-дубликатов {stats.duplicates}")
+        inserted = sum(stats.inserted for stats in results.values())
+        print(f"\n[{time.ctime()}] Все задачи парсинга успешно завершены. Всего новых мемов: {inserted}.")
     except Exception as e:
         print(f"[{time.ctime()}] Ошибка во время парсинга: {e}")
+    write_metrics()
     print("="*50)
 
 
-async def run_posting_job():
-    """Асинхронная обертка для задачи публикации в Telegram."""
+# Один цикл asyncio на все публикации: сессия бота привязана к циклу
+# и живет между запусками задачи, а не создается заново каждый раз
+_posting_loop = None
+
+
+def run_posting_job():
+    """Задача публикации в Telegram (корутина выполняется в общем цикле asyncio)."""
+    global _posting_loop
     print("="*50)
     print(f"[{time.ctime()}] Запускаю плановую публикацию лучшего мема...")
     try:
-        # Убедимся, что asyncio правильно используется
-        await post_best_meme()
+        from src.telegram_bot.poster import post_best_meme
+
+        if _posting_loop is None:
+            _posting_loop = asyncio.new_event_loop()
+        with timed('job.posting'):
+            _posting_loop.run_until_complete(post_best_meme())
         print(f"[{time.ctime()}] Задача публикации завершена.")
     except Exception as e:
         print(f"[{time.ctime()}] Ошибка во время публикации: {e}")
+    write_metrics()
     print("="*50)
 
 
+def run_compaction_job():
+    """Сливает закрытые сегменты событий эмоций в сжатые файлы (см. src/emotion_store)."""
+    print(f"[{time.ctime()}] Запускаю компактизацию событий эмоций...")
+    try:
+        from src.emotion_store.store import get_emotion_store
+
+        with timed('job.compaction'):
+            get_emotion_store().compact()
+    except Exception as e:
+        print(f"[{time.ctime()}] Ошибка во время компактизации: {e}")
+    write_metrics()
+
+
+def close_posting_loop():
+    """Закрывает сессию бота и цикл asyncio при остановке планировщика."""
+    global _posting_loop
+    if _posting_loop is None:
+        return
+    from src.telegram_bot.publisher import close_publisher
+
+    _posting_loop.run_until_complete(close_publisher())
+    _posting_loop.close()
+    _posting_loop = None
+
+
 # --- Настройка и запуск планировщика ---
 
 if __name__ == "__main__":
+    from apscheduler.schedulers.blocking import BlockingScheduler
+
+    # Загружаем переменные окружения (.env)
+    load_env()
+
     # Создаем экземпляр планировщика
     # Укажи свой часовой пояс, например "Europe/Moscow", "Asia/Yekaterinburg"
     scheduler = BlockingScheduler(timezone="Europe/Moscow") 
@@ -86,6 +141,10 @@ if __name__ == "__main__":
     scheduler.add_job(run_posting_job, 'cron', hour=20, minute=0, id='posting_job', name="Daily Telegram Post")
     print("Задача публикации настроена: запуск ежедневно в 20:00.")
 
+    # 3. Компактизация событий эмоций: раз в сутки ночью, когда мемы никто не смотрит.
+    scheduler.add_job(run_compaction_job, 'cron', hour=4, minute=0, id='compaction_job', name="Emotion Events Compaction")
+    print("Задача компактизации настроена: запуск ежедневно в 04:00.")
+
     print("\nПланировщик готов к запуску. Нажмите Ctrl+C для выхода.")
     
     # Запускаем первую задачу парсинга сразу при старте, не дожидаясь 4 часов
@@ -98,4 +157,5 @@ if __name__ == "__main__":
     except (KeyboardInterrupt, SystemExit):
         print("\nОстанавливаю планировщик...")
         scheduler.shutdown()
+        close_posting_loop()
         print("Планировщик остановлен.")
\ No newline at end of file
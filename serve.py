@@ -0,0 +1,158 @@
+# serve.py
+#
+# Боевой запуск веб-приложения через gunicorn (вместо app.run(debug=True)):
+#
+#   python serve.py
+#   SERVE_WORKERS=4 SERVE_THREADS=8 SERVE_BIND=0.0.0.0:8000 python serve.py
+#
+# Приложение загружается один раз в мастер-процессе (preload_app): модель
+# рекомендаций, очередь кандидатов и эмбеддинги оказываются в памяти до fork
+# и делятся HTTP-воркерами copy-on-write. DeepFace живет в общем пуле
+# процессов, который мастер тоже запускает до fork, поэтому TensorFlow
+# загружается EMOTION_WORKERS раз на весь сервер, а не в каждом HTTP-воркере.
+#
+# Новая версия модели: каждый воркер сразу переключается на нее сам
+# (см. app.on_model_published), а мастер не чаще раза в SERVE_RELOAD_INTERVAL
+# делает плавный перезапуск (SIGHUP): перечитывает модель у себя, и новые
+# воркеры снова делят ее с мастером, пока старые дорабатывают свои запросы.
+# Балансировщику нужно смотреть на /ready: 200 только после прогрева.
+
+import os
+import time
+import shutil
+import signal
+import threading
+
+from src.config import PROJECT_ROOT, load_env
+
+# serve.py - только точка входа, поэтому .env читается сразу: до настроек ниже
+# и до импорта app (настройки пула эмоций и пути берутся при импорте)
+load_env()
+
+# --- Конфигурация сервера ---
+SERVE_BIND = os.getenv("SERVE_BIND", "0.0.0.0:8000")
+SERVE_WORKERS = int(os.getenv("SERVE_WORKERS", "2"))
+# Потоков на HTTP-воркер: запросы /analyze в основном ждут пул эмоций, а не CPU
+SERVE_THREADS = int(os.getenv("SERVE_THREADS", "8"))
+SERVE_TIMEOUT = int(os.getenv("SERVE_TIMEOUT", "60"))
+# Сколько секунд старый воркер дорабатывает запросы при перезапуске
+SERVE_GRACEFUL_TIMEOUT = int(os.getenv("SERVE_GRACEFUL_TIMEOUT", "30"))
+# Перезапуск воркера после стольких запросов (0 - никогда)
+SERVE_MAX_REQUESTS = int(os.getenv("SERVE_MAX_REQUESTS", "0"))
+# Не чаще чем раз в столько секунд новая версия модели перезапускает воркеры (0 - не перезапускать)
+SERVE_RELOAD_INTERVAL = float(os.getenv("SERVE_RELOAD_INTERVAL", "600"))
+# Как часто мастер проверяет, не появилась ли новая версия модели
+SERVE_MODEL_POLL_INTERVAL = float(os.getenv("SERVE_MODEL_POLL_INTERVAL", "5"))
+# Журнал запросов ("-" - в stdout, пусто - не писать)
+SERVE_ACCESS_LOG = os.getenv("SERVE_ACCESS_LOG", "")
+# Каждый воркер считает свои метрики, а /metrics складывает их через этот каталог
+# (см. src/metrics.py). Задается до импорта app, чтобы его видели все процессы
+METRICS_MULTIPROC_DIR = os.environ.setdefault("METRICS_MULTIPROC_DIR",
+                                              os.path.join(PROJECT_ROOT, "data", "metrics"))
+
+
+def _app_module():
+    import app
+    return app
+
+
+def watch_model_versions(server):
+    """
+    Поток мастера: увидел новую версию модели - SIGHUP самому себе.
+    Сама модель перечитывается в on_reload, в главном потоке мастера.
+    """
+    registry = _app_module().recommender.registry
+
+    def run():
+        last_reload = time.monotonic()
+        while True:
+            time.sleep(SERVE_MODEL_POLL_INTERVAL)
+            version = registry.current_version()
+            if version is None or version == _app_module().recommender.version:
+                continue
+            if time.monotonic() - last_reload < SERVE_RELOAD_INTERVAL:
+                continue
+            last_reload = time.monotonic()
+            server.log.info("Новая версия модели %s: плавно перезапускаю воркеры", version)
+            os.kill(server.pid, signal.SIGHUP)
+
+    threading.Thread(target=run, name='serve-model-watcher', daemon=True).start()
+
+
+def stop_emotion_restarts_on_signal():
+    """
+    SIGTERM/SIGINT/SIGQUIT мастеру: пул эмоций сразу перестает поднимать упавшие
+    воркеры. Иначе при остановке (Ctrl+C уходит всей группе процессов) монитор
+    успевает перезапустить воркеры, которые умирают вместе с сервером, - до
+    atexit мастера, где пул останавливается, дело доходит только после HTTP-воркеров.
+    """
+    pool = _app_module().emotion_pool
+    for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGQUIT):
+        previous = signal.getsignal(signum)
+
+        def handler(signum, frame, previous=previous):
+            pool.begin_shutdown()
+            if callable(previous):
+                previous(signum, frame)
+
+        signal.signal(signum, handler)
+
+
+def when_ready(server):
+    # Обработчики gunicorn к этому моменту уже стоят - наш вызывается перед ними
+    stop_emotion_restarts_on_signal()
+    if SERVE_RELOAD_INTERVAL > 0:
+        watch_model_versions(server)
+
+
+def on_reload(server):
+    # Мастер перечитывает модель до fork новых воркеров - они получат ее уже загруженной
+    _app_module().warm_up()
+
+
+def post_fork(server, worker):
+    _app_module().init_worker()
+
+
+def options():
+    return {
+        'bind': SERVE_BIND,
+        'workers': SERVE_WORKERS,
+        'threads': SERVE_THREADS,
+        'worker_class': 'gthread',
+        'preload_app': True,
+        'timeout': SERVE_TIMEOUT,
+        'graceful_timeout': SERVE_GRACEFUL_TIMEOUT,
+        'max_requests': SERVE_MAX_REQUESTS,
+        'max_requests_jitter': SERVE_MAX_REQUESTS // 10,
+        'accesslog': SERVE_ACCESS_LOG or None,
+        'when_ready': when_ready,
+        'on_reload': on_reload,
+        'post_fork': post_fork,
+    }
+
+
+def main():
+    from gunicorn.app.base import BaseApplication
+
+    class MemePulseApplication(BaseApplication):
+
+        def load_config(self):
+            for key, value in options().items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            app = _app_module()
+            # Пул эмоций - до fork: процессы с моделью общие для всех HTTP-воркеров
+            # (слотов вдвое больше: при перезапуске старые и новые воркеры живут одновременно)
+            app.emotion_pool.start_shared(clients=2 * SERVE_WORKERS)
+            app.warm_up()
+            return app.app
+
+    # Файлы прошлого запуска не нужны: счетчики Prometheus после перезапуска начинаются с нуля
+    shutil.rmtree(METRICS_MULTIPROC_DIR, ignore_errors=True)
+    MemePulseApplication().run()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,23 @@
+# src/config.py
+#
+# Общие пути и загрузка .env. Модуль ничего не делает при импорте:
+# переменные из .env подхватываются только явным вызовом load_env()
+# из точки входа (scheduler.py, poster, ручной запуск парсеров).
+
+import os
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Базу можно вынести из папки проекта (например, синтетическую базу бенчмарков)
+DB_PATH = os.getenv("MEMES_DB_PATH", os.path.join(PROJECT_ROOT, "memes.db"))
+
+_env_loaded = False
+
+
+def load_env():
+    """Читает PROJECT_ROOT/.env в os.environ (один раз на процесс, уже заданные переменные не трогает)."""
+    global _env_loaded
+    if _env_loaded:
+        return
+    from dotenv import load_dotenv
+    load_dotenv(os.path.join(PROJECT_ROOT, '.env'))
+    _env_loaded = True
@@ -0,0 +1,291 @@
+# src/database/aggregator.py
+
+import os
+import sys
+import glob
+import json
+import time
+import uuid
+import atexit
+import threading
+from collections import Counter
+
+from src.database import repository
+from src.database.models import ReactionFlush, EMOTION_PRIORITY
+from src.metrics import STAGE_SECONDS
+
+project_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# --- Конфигурация ---
+# Как часто (в секундах) накопленные реакции сбрасываются в базу
+REACTION_FLUSH_INTERVAL = float(os.getenv("REACTION_FLUSH_INTERVAL", "10"))
+# Где лежит журнал еще не записанных в базу кадров
+REACTION_JOURNAL_DIR = os.getenv("REACTION_JOURNAL_DIR", os.path.join(project_root, "data", "reaction_journal"))
+# fsync после каждой записи в журнал: переживает и отключение питания, но медленнее
+REACTION_JOURNAL_FSYNC = os.getenv("REACTION_JOURNAL_FSYNC", "0") == "1"
+
+
+def _pid_alive(pid):
+    """Жив ли процесс с таким pid (нужен, чтобы не трогать чужой активный журнал)."""
+    if pid == os.getpid():
+        return True
+    if sys.platform == 'win32':
+        # На Windows os.kill(pid, 0) завершает процесс, поэтому не проверяем
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class ReactionAggregator:
+    """
+    Накопитель реакций в памяти вместо запроса и коммита на каждый кадр.
+
+    Для каждой пары (сессия, мем) хранит самую "важную" эмоцию и гистограмму
+    всех эмоций. В базу все уходит одной транзакцией: когда в сессии сменился
+    мем, по таймеру и при остановке. Каждый кадр сначала дописывается в журнал
+    на диске, поэтому после падения процесса ничего не теряется: при старте
+    журналы проигрываются заново, а таблица reaction_flushes не дает записать
+    одну пачку дважды.
+    """
+
+    def __init__(self, session_factory, journal_dir=REACTION_JOURNAL_DIR, flush_interval=REACTION_FLUSH_INTERVAL,
+                 on_flush=None):
+        self.session_factory = session_factory
+        # on_flush(meme_ids, {meme_id: эмоция}) вызывается после каждой записанной
+        # пачки: meme_ids - мемы, которые теперь отмечены в базе просмотренными,
+        # а словарь - реакции, на которых стоит дообучить рекомендательную модель
+        self.on_flush = on_flush
+        self.journal_dir = journal_dir
+        self.flush_interval = flush_interval
+
+        self._pending = {}        # (сессия, meme_id) -> {'emotion': ..., 'counts': Counter()}
+        self._failed = []         # пачки, которые не удалось записать: (batch_id, batch, путь к сегменту)
+        self._current_meme = {}   # сессия -> (мем, который сейчас у нее на экране, время последнего кадра)
+        self._untrained = {}      # meme_id -> записанная эмоция, еще не отданная в on_flush
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._journal = None
+        self._journal_id = None
+        self._thread = None
+        self._stopped = False
+
+    def start(self):
+        """Восстанавливает недописанные журналы и запускает фоновый сброс."""
+        with self._start_lock:
+            if self._thread is not None:
+                return
+            os.makedirs(self.journal_dir, exist_ok=True)
+            self._recover()
+            with self._lock:
+                self._open_journal()
+            self._thread = threading.Thread(target=self._run, name='reaction-flusher', daemon=True)
+            self._thread.start()
+            atexit.register(self.stop)
+
+    def record(self, client_session, meme_id, emotion):
+        """Учитывает эмоцию с одного кадра."""
+        self.start()
+        meme_id = int(meme_id)
+        with self._lock:
+            self._append_to_journal(client_session, meme_id, emotion)
+            self._apply(client_session, meme_id, emotion)
+            meme_changed = self._current_meme.get(client_session, (meme_id,))[0] != meme_id
+            self._current_meme[client_session] = (meme_id, time.monotonic())
+
+        if meme_changed:
+            # Предыдущий мем ушел с экрана - его реакция окончательна
+            self._wakeup.set()
+
+    def flush(self):
+        """Записывает все накопленное в базу одной транзакцией."""
+        self.start()
+        return self._flush()
+
+    def _flush(self):
+        with self._flush_lock:
+            with self._lock:
+                if self._pending:
+                    batch, self._pending = self._pending, {}
+                    batch_id, segment_path = self._rotate_journal()
+                    self._failed.append((batch_id, batch, segment_path))
+
+            written = 0
+            while self._failed:
+                # Повторяем с тем же batch_id: если пачка все-таки успела
+                # записаться, reaction_flushes не даст записать ее второй раз
+                batch_id, batch, segment_path = self._failed[0]
+                written += self._write_batch(batch_id, batch)
+                os.remove(segment_path)
+                self._failed.pop(0)
+            return written
+
+    def stop(self):
+        """Последний сброс при остановке приложения."""
+        if self._stopped:
+            return
+        self._stopped = True
+        self._wakeup.set()
+        try:
+            self._flush()
+        except Exception as e:
+            print(f"Не удалось сбросить реакции при остановке (останутся в журнале): {e}")
+        # Мемы, которые еще на экране, больше не изменятся - отдаем и их
+        self._notify([], {}, final=True)
+        with self._lock:
+            if self._journal is not None:
+                self._journal.close()
+                # Пустой журнал не нужен: все, что в нем было, уже в базе
+                if not self._pending and os.path.getsize(self._journal.name) == 0:
+                    os.remove(self._journal.name)
+                self._journal = None
+
+    # --- Внутренняя кухня ---
+
+    def _apply(self, client_session, meme_id, emotion):
+        self._merge(self._pending, client_session, meme_id, emotion)
+
+    @staticmethod
+    def _merge(batch, client_session, meme_id, emotion):
+        entry = batch.setdefault((client_session, meme_id), {'emotion': emotion, 'counts': Counter()})
+        entry['counts'][emotion] += 1
+        if EMOTION_PRIORITY.get(emotion, 0) > EMOTION_PRIORITY.get(entry['emotion'], 0):
+            entry['emotion'] = emotion
+
+    def _run(self):
+        while not self._stopped:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            if self._stopped:
+                break
+            try:
+                self._flush()
+            except Exception as e:
+                print(f"Ошибка при записи реакций в базу (повторю позже): {e}")
+
+    def _open_journal(self):
+        self._journal_id = f"{os.getpid()}-{uuid.uuid4().hex}"
+        path = os.path.join(self.journal_dir, f"journal-{self._journal_id}.log")
+        self._journal = open(path, 'a', encoding='utf-8')
+
+    def _append_to_journal(self, client_session, meme_id, emotion):
+        self._journal.write(json.dumps([client_session, meme_id, emotion, time.time()], ensure_ascii=False) + "\n")
+        self._journal.flush()
+        if REACTION_JOURNAL_FSYNC:
+            os.fsync(self._journal.fileno())
+
+    def _rotate_journal(self):
+        """Закрывает текущий журнал (он становится сегментом пачки) и открывает новый."""
+        batch_id = self._journal_id
+        segment_path = self._journal.name
+        self._journal.close()
+        self._open_journal()
+        return batch_id, segment_path
+
+    def _write_batch(self, batch_id, batch):
+        # Сводим сессии в одну реакцию на мем: лучшая эмоция и сумма гистограмм
+        best = {}
+        counts = {}
+        for (_, meme_id), entry in batch.items():
+            current = best.get(meme_id)
+            if current is None or EMOTION_PRIORITY.get(entry['emotion'], 0) > EMOTION_PRIORITY.get(current, 0):
+                best[meme_id] = entry['emotion']
+            counts.setdefault(meme_id, Counter()).update(entry['counts'])
+
+        started = time.perf_counter()
+        session = self.session_factory()
+        try:
+            if session.get(ReactionFlush, batch_id) is not None:
+                return 0  # эта пачка уже в базе, осталось только удалить сегмент
+
+            # Первая запись открывает транзакцию и берет блокировку записи, поэтому
+            # чтение ниже видит последние коммиты других процессов, и никто не
+            # изменит реакции до нашего коммита: changed совпадет с тем, что записано
+            repository.add_emotion_counts(session, [
+                {'meme_id': meme_id, 'emotion': emotion, 'count': count}
+                for meme_id, histogram in counts.items() for emotion, count in histogram.items()
+            ])
+            # Реакция переписывается, только если новая эмоция "важнее" записанной;
+            # то же условие повторено в самом UPSERT
+            existing = repository.reaction_emotions(session, best)
+            changed = {
+                meme_id: emotion for meme_id, emotion in best.items()
+                if meme_id not in existing
+                or EMOTION_PRIORITY.get(emotion, 0) > EMOTION_PRIORITY.get(existing[meme_id], 0)
+            }
+            repository.upsert_reactions(session, changed)
+            repository.mark_seen(session, best)
+            session.add(ReactionFlush(batch_id=batch_id))
+            session.commit()
+            STAGE_SECONDS.observe(time.perf_counter() - started, stage='reactions.flush')
+            print(f"Записаны реакции для {len(best)} мемов ({sum(map(len, counts.values()))} эмоций в гистограммах).")
+        except Exception:
+            # Пачка остается в очереди на повтор, а ее сегмент - на диске
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+        self._notify(list(best), changed)
+        return len(best)
+
+    def _notify(self, seen, changed, final=False):
+        """
+        Передает в on_flush записанную пачку. Для дообучения отдаются только
+        реакции, которые изменили эмоцию в базе, и только когда мем ушел
+        с экрана: пока его смотрят, таймер может записать его еще не раз,
+        а модель должна увидеть каждую реакцию один раз - с итоговой эмоцией.
+        """
+        with self._lock:
+            self._untrained.update(changed)
+            # Сессия, от которой давно не было кадров, считается закрытой
+            idle_since = time.monotonic() - 2 * self.flush_interval
+            for client_session, (_, last_frame) in list(self._current_meme.items()):
+                if final or last_frame < idle_since:
+                    del self._current_meme[client_session]
+            on_screen = {meme_id for meme_id, _ in self._current_meme.values()}
+            ready = {meme_id: emotion for meme_id, emotion in self._untrained.items() if meme_id not in on_screen}
+            for meme_id in ready:
+                del self._untrained[meme_id]
+
+        if self.on_flush is None or not (seen or ready):
+            return
+        try:
+            self.on_flush(seen, ready)
+        except Exception as e:
+            # Пачка уже в базе - ошибка подписчика не должна вызывать повтор записи
+            print(f"Ошибка в обработчике записанных реакций: {e}")
+
+    def _recover(self):
+        """Проигрывает журналы, оставшиеся после падения процесса."""
+        for path in sorted(glob.glob(os.path.join(self.journal_dir, "journal-*.log"))):
+            batch_id = os.path.basename(path)[len("journal-"):-len(".log")]
+            pid = int(batch_id.split("-", 1)[0]) if batch_id.split("-", 1)[0].isdigit() else 0
+            if pid and pid != os.getpid() and _pid_alive(pid):
+                continue  # это живой журнал другого процесса приложения
+
+            batch = {}
+            with open(path, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        client_session, meme_id, emotion, _ = json.loads(line)
+                    except ValueError:
+                        continue  # недописанная последняя строка
+                    self._merge(batch, client_session, meme_id, emotion)
+
+            if batch:
+                print(f"Восстанавливаю реакции из журнала {os.path.basename(path)}...")
+                self._failed.append((batch_id, batch, path))
+            else:
+                os.remove(path)
+
+        try:
+            self._flush()
+        except Exception as e:
+            print(f"Не удалось записать восстановленные реакции (повторю позже): {e}")
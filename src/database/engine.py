@@ -0,0 +1,58 @@
+# src/database/engine.py
+
+import os
+import threading
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from src.config import DB_PATH
+from src.database.pragmas import configure_sqlite
+
+# Пул соединений процесса: постоянно открыто до DB_POOL_SIZE соединений,
+# при пиковой нагрузке - еще до DB_MAX_OVERFLOW временных
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "8"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "16"))
+
+_engine = None
+_session_factory = None
+_lock = threading.Lock()
+
+
+def get_engine():
+    """
+    Единственный движок процесса для memes.db (путь - MEMES_DB_PATH из src.config).
+    Создается при первом обращении, а не при импорте модуля, который с базой,
+    может, и не работает. Прагмы SQLite применяются к каждому соединению пула.
+    """
+    global _engine
+    with _lock:
+        if _engine is None:
+            _engine = configure_sqlite(create_engine(
+                f"sqlite:///{DB_PATH}", pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW))
+        return _engine
+
+
+def get_session_factory():
+    """Фабрика сессий поверх общего движка."""
+    global _session_factory
+    engine = get_engine()
+    with _lock:
+        if _session_factory is None:
+            _session_factory = sessionmaker(bind=engine)
+        return _session_factory
+
+
+def _after_fork_in_child():
+    global _lock
+    # Блокировку мог держать другой поток родителя в момент fork
+    _lock = threading.Lock()
+    if _engine is not None:
+        # Соединения SQLite из пула родителя в дочернем процессе использовать нельзя:
+        # пул просто забывает их (не закрывая - они все еще нужны родителю)
+        _engine.dispose(close=False)
+
+
+if hasattr(os, 'register_at_fork'):
+    # Например, HTTP-воркеры serve.py, которые gunicorn форкает от мастера
+    os.register_at_fork(after_in_child=_after_fork_in_child)
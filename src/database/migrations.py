@@ -0,0 +1,187 @@
+# src/database/migrations.py
+#
+# Версионные миграции схемы SQLite. Текущая версия хранится в PRAGMA user_version,
+# каждый шаг выполняется в своей транзакции вместе с повышением версии, поэтому
+# прерванная миграция просто откатывается и при следующем запуске начнется заново.
+#
+# Шаги написаны сырым SQL и больше не меняются: схему на момент шага нельзя
+# брать из models.py, потому что модели со временем уходят вперед.
+# Новая миграция = новая функция + строка в MIGRATIONS.
+
+
+def _has_column(cursor, table, column):
+    return any(row[1] == column for row in cursor.execute(f"PRAGMA table_info({table})"))
+
+
+def _v1_baseline(cursor):
+    """Исходные таблицы. На старых базах они уже есть, и шаг ничего не делает."""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS memes (
+            id INTEGER NOT NULL,
+            title VARCHAR NOT NULL,
+            url VARCHAR NOT NULL,
+            source VARCHAR NOT NULL,
+            created_at DATETIME,
+            PRIMARY KEY (id),
+            UNIQUE (url)
+        )""")
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS reactions (
+            id INTEGER NOT NULL,
+            dominant_emotion VARCHAR NOT NULL,
+            timestamp DATETIME,
+            meme_id INTEGER NOT NULL,
+            PRIMARY KEY (id),
+            FOREIGN KEY(meme_id) REFERENCES memes (id)
+        )""")
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS reaction_emotion_counts (
+            meme_id INTEGER NOT NULL,
+            emotion VARCHAR NOT NULL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (meme_id, emotion),
+            FOREIGN KEY(meme_id) REFERENCES memes (id)
+        )""")
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS reaction_flushes (
+            batch_id VARCHAR NOT NULL,
+            flushed_at DATETIME,
+            PRIMARY KEY (batch_id)
+        )""")
+
+
+def _v2_meme_state(cursor):
+    """
+    Колонки состояния мема вместо NOT IN по реакциям.
+    Фиктивные реакции 'published' от бота превращаются в published_at,
+    дубли реакций на один мем схлопываются в самую важную.
+    """
+    # Базы, созданные через create_all по свежим моделям, уже содержат эти колонки
+    if not _has_column(cursor, 'memes', 'is_seen'):
+        cursor.execute("ALTER TABLE memes ADD COLUMN is_seen BOOLEAN NOT NULL DEFAULT 0")
+    if not _has_column(cursor, 'memes', 'published_at'):
+        cursor.execute("ALTER TABLE memes ADD COLUMN published_at DATETIME")
+
+    cursor.execute("""
+        UPDATE memes SET published_at = (
+            SELECT MIN(COALESCE(r.timestamp, CURRENT_TIMESTAMP)) FROM reactions r
+            WHERE r.meme_id = memes.id AND r.dominant_emotion = 'published'
+        )
+        WHERE id IN (SELECT meme_id FROM reactions WHERE dominant_emotion = 'published')""")
+    cursor.execute("DELETE FROM reactions WHERE dominant_emotion = 'published'")
+
+    # Приоритеты эмоций на момент миграции (копия EMOTION_PRIORITY)
+    cursor.execute("""
+        DELETE FROM reactions WHERE id NOT IN (
+            SELECT id FROM (
+                SELECT id, ROW_NUMBER() OVER (
+                    PARTITION BY meme_id
+                    ORDER BY CASE dominant_emotion
+                        WHEN 'happy' THEN 5 WHEN 'surprise' THEN 4 WHEN 'neutral' THEN 3
+                        WHEN 'fear' THEN 2 WHEN 'sad' THEN 2
+                        WHEN 'disgust' THEN 1 WHEN 'angry' THEN 1
+                        ELSE 0 END DESC, id
+                ) AS rn
+                FROM reactions
+            ) WHERE rn = 1
+        )""")
+
+    cursor.execute("UPDATE memes SET is_seen = 1 WHERE id IN (SELECT meme_id FROM reactions)")
+
+
+def _v3_indexes(cursor):
+    """Индексы под горячие запросы: выбор кандидатов, реакции по мему, фильтры по источнику."""
+    cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS ux_reactions_meme_id ON reactions (meme_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS ix_memes_source ON memes (source)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS ix_memes_created_at ON memes (created_at)")
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS ix_memes_unseen ON memes (id)
+        WHERE is_seen = 0 AND published_at IS NULL""")
+
+
+def _v4_phash(cursor):
+    """Перцептивный хеш картинки. У старых мемов он пустой и в поиске дублей не участвует."""
+    if not _has_column(cursor, 'memes', 'phash'):
+        cursor.execute("ALTER TABLE memes ADD COLUMN phash INTEGER")
+
+
+def _v5_image_digest(cursor):
+    """Адрес картинки в локальном кеше. Старые мемы показываются по-прежнему, по url."""
+    if not _has_column(cursor, 'memes', 'image_digest'):
+        cursor.execute("ALTER TABLE memes ADD COLUMN image_digest VARCHAR")
+
+
+def _v6_tg_file_id(cursor):
+    """file_id картинки в Telegram: повторная публикация идет без загрузки байтов."""
+    if not _has_column(cursor, 'memes', 'tg_file_id'):
+        cursor.execute("ALTER TABLE memes ADD COLUMN tg_file_id VARCHAR")
+
+
+def _v7_source_cursors(cursor):
+    """Курсоры источников: парсеры читают только посты новее уже увиденных."""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS source_cursors (
+            source VARCHAR NOT NULL,
+            last_item_id VARCHAR,
+            last_item_at DATETIME,
+            external_id VARCHAR,
+            updated_at DATETIME,
+            PRIMARY KEY (source)
+        )""")
+
+
+# (версия, описание, функция)
+MIGRATIONS = [
+    (1, "исходные таблицы", _v1_baseline),
+    (2, "состояние мема: is_seen, published_at", _v2_meme_state),
+    (3, "индексы для горячих запросов", _v3_indexes),
+    (4, "перцептивный хеш картинки", _v4_phash),
+    (5, "адрес картинки в кеше", _v5_image_digest),
+    (6, "file_id картинки в Telegram", _v6_tg_file_id),
+    (7, "курсоры источников", _v7_source_cursors),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def get_version(engine):
+    with engine.connect() as conn:
+        return conn.exec_driver_sql("PRAGMA user_version").scalar()
+
+
+def upgrade(engine):
+    """
+    Доводит базу до последней версии схемы. Безопасно вызывать при каждом
+    старте: если база уже актуальна, это один PRAGMA-запрос.
+    """
+    version = get_version(engine)
+    if version >= LATEST_VERSION:
+        return version
+
+    raw = engine.raw_connection()
+    dbapi_connection = raw.driver_connection
+    isolation_level = dbapi_connection.isolation_level
+    try:
+        # Транзакциями управляем сами: модуль sqlite3 не открывает их перед DDL
+        dbapi_connection.isolation_level = None
+        cursor = dbapi_connection.cursor()
+        for step_version, description, step in MIGRATIONS:
+            if step_version <= version:
+                continue
+            print(f"Миграция БД до версии {step_version}: {description}...")
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                step(cursor)
+                cursor.execute(f"PRAGMA user_version = {step_version}")
+                cursor.execute("COMMIT")
+            except Exception:
+                cursor.execute("ROLLBACK")
+                raise
+            version = step_version
+        cursor.close()
+    finally:
+        dbapi_connection.isolation_level = isolation_level
+        raw.close()
+
+    print(f"Схема БД обновлена до версии {version}.")
+    return version
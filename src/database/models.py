@@ -1,6 +1,6 @@
 # src/database/models.py
 
-from sqlalchemy import create_engine, Column, Integer, String, DateTime
+from sqlalchemy import create_engine, Column, Integer, BigInteger, String, DateTime, Boolean, Index, text, and_, false
 from sqlalchemy.orm import declarative_base
 from sqlalchemy import ForeignKey
 from sqlalchemy.orm import relationship
@@ -20,9 +20,45 @@ class Meme(Base):
     source = Column(String, nullable=False)
     created_at = Column(DateTime, default=datetime.datetime.utcnow)
 
+    # Состояние мема: на него уже есть реакция / он уже опубликован в канал.
+    # Хранится прямо в строке, чтобы выборка непросмотренных шла по индексу,
+    # а не через NOT IN по всей таблице реакций.
+    is_seen = Column(Boolean, nullable=False, default=False, server_default=text('0'))
+    published_at = Column(DateTime, nullable=True)
+    # Перцептивный хеш картинки (dHash, см. src/dedup) для поиска почти-дубликатов
+    phash = Column(BigInteger, nullable=True)
+    # sha256 картинки в локальном кеше (src/image_store); пусто у старых мемов
+    image_digest = Column(String, nullable=True)
+    # file_id картинки, которую уже загружали в Telegram (годится для любого чата того же бота)
+    tg_file_id = Column(String, nullable=True)
+
+    __table_args__ = (
+        Index('ix_memes_source', 'source'),
+        Index('ix_memes_created_at', 'created_at'),
+        # Частичный индекс: в нем только кандидаты на показ и публикацию
+        Index('ix_memes_unseen', 'id', sqlite_where=text('is_seen = 0 AND published_at IS NULL')),
+    )
+
     def __repr__(self):
         return f"<Meme(id={self.id}, title='{self.title[:30]}...', source='{self.source}')>"
 
+# Условие "мем еще не видели и не публиковали". Значения подставлены литералами,
+# чтобы SQLite смог использовать частичный индекс ix_memes_unseen.
+MEME_IS_UNSEEN = and_(Meme.is_seen == false(), Meme.published_at.is_(None))
+
+# Рейтинг эмоций: реакция на мем - самая "важная" из эмоций его кадров
+EMOTION_PRIORITY = {
+    'happy': 5,
+    'surprise': 4,
+    'neutral': 3,
+    'fear': 2,
+    'sad': 2,
+    'disgust': 1,
+    'angry': 1,
+    'лицо не найдено': 0,
+    'ошибка анализа': 0
+}
+
 class Reaction(Base):
     __tablename__ = 'reactions'
 
@@ -34,5 +70,49 @@ class Reaction(Base):
     meme_id = Column(Integer, ForeignKey('memes.id'), nullable=False)
     meme = relationship("Meme")
 
+    # Одна реакция на мем: ее обновляет накопитель реакций
+    __table_args__ = (
+        Index('ux_reactions_meme_id', 'meme_id', unique=True),
+    )
+
+    def __repr__(self):
+        return f"<Reaction(meme_id={self.meme_id}, emotion='{self.dominant_emotion}')>"
+
+class ReactionEmotionCount(Base):
+    """Сколько раз каждая эмоция встретилась на кадрах, пока мем был на экране."""
+    __tablename__ = 'reaction_emotion_counts'
+
+    meme_id = Column(Integer, ForeignKey('memes.id'), primary_key=True)
+    emotion = Column(String, primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+
     def __repr__(self):
-        return f"<Reaction(meme_id={self.meme_id}, emotion='{self.dominant_emotion}')>"
\ No newline at end of file
+        return f"<ReactionEmotionCount(meme_id={self.meme_id}, emotion='{self.emotion}', count={self.count})>"
+
+
+class SourceCursor(Base):
+    """
+    Докуда уже прочитан источник (сабреддит или группа VK): самый новый
+    увиденный пост. Парсер запрашивает только посты новее него.
+    """
+    __tablename__ = 'source_cursors'
+
+    source = Column(String, primary_key=True)       # 'r/memes', 'vk/4ch'
+    last_item_id = Column(String, nullable=True)    # fullname поста Reddit или id поста VK
+    last_item_at = Column(DateTime, nullable=True)  # время публикации этого поста (UTC)
+    external_id = Column(String, nullable=True)     # закешированный owner_id группы VK
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+    def __repr__(self):
+        return f"<SourceCursor(source='{self.source}', last_item_id='{self.last_item_id}')>"
+
+
+class ReactionFlush(Base):
+    """
+    Журнал уже записанных пачек реакций. Нужен, чтобы при восстановлении
+    после падения одна и та же пачка не записалась в базу дважды.
+    """
+    __tablename__ = 'reaction_flushes'
+
+    batch_id = Column(String, primary_key=True)
+    flushed_at = Column(DateTime, default=datetime.datetime.utcnow)
@@ -0,0 +1,28 @@
+# src/database/pragmas.py
+
+from sqlalchemy import event
+
+# Настройки SQLite, которые применяются к каждому новому соединению.
+# WAL позволяет читать базу, пока в нее пишет другой процесс (парсер, бот),
+# synchronous=NORMAL в режиме WAL безопасен и заметно быстрее FULL.
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'cache_size': -32000,        # ~32 МБ кэша страниц (отрицательное значение - в КиБ)
+    'mmap_size': 268435456,      # 256 МБ файла читаются через mmap
+    'temp_store': 'MEMORY',
+    'busy_timeout': 5000,        # ждать блокировку до 5 секунд, а не падать сразу
+}
+
+
+def configure_sqlite(engine):
+    """Вешает на движок применение SQLITE_PRAGMAS при каждом подключении."""
+
+    @event.listens_for(engine, "connect")
+    def _set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in SQLITE_PRAGMAS.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
+
+    return engine
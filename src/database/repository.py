@@ -0,0 +1,168 @@
+# src/database/repository.py
+#
+# Горячие запросы приложения в одном месте: выборка кандидатов на показ,
+# проверка известных url, запись реакций, отметка публикации.
+#
+# Каждый запрос собран один раз при импорте модуля, а списки для IN (...)
+# передаются через bindparam(expanding=True). Поэтому при вызове не строится
+# новый ORM-запрос, а скомпилированный SQL берется из кеша движка по одному
+# и тому же ключу - независимо от того, сколько id или url в списке.
+
+import datetime
+
+from sqlalchemy import bindparam, case, select, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from src.database.models import Meme, Reaction, ReactionEmotionCount, MEME_IS_UNSEEN, EMOTION_PRIORITY
+
+# Сколько значений передавать в один IN (...) - с запасом до лимита переменных SQLite
+IN_LIST_CHUNK = 500
+
+_memes = Meme.__table__
+_reactions = Reaction.__table__
+_emotion_counts = ReactionEmotionCount.__table__
+
+# --- Кандидаты на показ и публикацию ---
+
+# Идут по частичному индексу ix_memes_unseen
+_UNSEEN_MEMES = select(Meme.id, Meme.source).where(MEME_IS_UNSEEN)
+_UNSEEN_MEMES_PAGE = (select(Meme.id, Meme.source)
+                      .where(MEME_IS_UNSEEN, Meme.id > bindparam('after_id'))
+                      .order_by(Meme.id)
+                      .limit(bindparam('limit')))
+_MEMES_AFTER = select(Meme.id, Meme.source).where(MEME_IS_UNSEEN, Meme.id > bindparam('after_id'))
+_MEMES_BY_ID = select(Meme).where(Meme.id.in_(bindparam('meme_ids', expanding=True)))
+_MEME_SOURCES = select(Meme.id, Meme.source).where(Meme.id.in_(bindparam('meme_ids', expanding=True)))
+
+# --- Парсеры ---
+
+_KNOWN_URLS = select(Meme.url).where(Meme.url.in_(bindparam('urls', expanding=True)))
+_IDS_BY_URL = select(Meme.id, Meme.url).where(Meme.url.in_(bindparam('urls', expanding=True)))
+
+# --- Реакции ---
+
+_REACTION_HISTORY = (select(Reaction.meme_id, Meme.source, Reaction.dominant_emotion)
+                     .join(Meme, Reaction.meme_id == Meme.id)
+                     .order_by(Reaction.id))
+_REACTION_EMOTIONS = (select(Reaction.meme_id, Reaction.dominant_emotion)
+                      .where(Reaction.meme_id.in_(bindparam('meme_ids', expanding=True))))
+_upsert = sqlite_insert(_reactions)
+
+
+def _priority(column):
+    return case(EMOTION_PRIORITY, value=column, else_=0)
+
+
+# Эмоция заменяется, только если новая "важнее" записанной. Сравнение - в самом
+# UPSERT, а не в Python: иначе два процесса, прочитавшие реакцию до записи,
+# перезаписали бы друг друга в порядке коммита
+_UPSERT_REACTION = _upsert.on_conflict_do_update(
+    index_elements=['meme_id'],
+    set_={'dominant_emotion': _upsert.excluded.dominant_emotion},
+    where=_priority(_upsert.excluded.dominant_emotion) > _priority(_reactions.c.dominant_emotion),
+)
+_counts_upsert = sqlite_insert(_emotion_counts)
+_ADD_EMOTION_COUNTS = _counts_upsert.on_conflict_do_update(
+    index_elements=['meme_id', 'emotion'],
+    set_={'count': _emotion_counts.c.count + _counts_upsert.excluded.count},
+)
+_MARK_SEEN = (update(_memes)
+              .where(_memes.c.id.in_(bindparam('meme_ids', expanding=True)))
+              .values(is_seen=True))
+_MARK_PUBLISHED = (update(_memes)
+                   .where(_memes.c.id.in_(bindparam('meme_ids', expanding=True)))
+                   .values(published_at=bindparam('published_at')))
+
+
+def _chunks(values):
+    values = list(values)
+    for start in range(0, len(values), IN_LIST_CHUNK):
+        yield values[start:start + IN_LIST_CHUNK]
+
+
+def unseen_memes(session):
+    """Все непросмотренные и неопубликованные мемы: строки (id, source)."""
+    return session.execute(_UNSEEN_MEMES).all()
+
+
+def unseen_memes_page(session, after_id, limit):
+    """Следующие limit непросмотренных мемов с id больше after_id, по возрастанию id."""
+    return session.execute(_UNSEEN_MEMES_PAGE, {'after_id': after_id, 'limit': limit}).all()
+
+
+def memes_after(session, after_id):
+    """Непросмотренные мемы, добавленные после мема after_id: строки (id, source)."""
+    return session.execute(_MEMES_AFTER, {'after_id': after_id}).all()
+
+
+def memes_by_id(session, meme_ids):
+    """{id: Meme} для переданных id (отсутствующие в базе просто не попадут в ответ)."""
+    found = {}
+    for chunk in _chunks(meme_ids):
+        found.update((meme.id, meme) for meme in session.scalars(_MEMES_BY_ID, {'meme_ids': chunk}))
+    return found
+
+
+def meme_sources(session, meme_ids):
+    """{id: источник} для переданных id."""
+    found = {}
+    for chunk in _chunks(meme_ids):
+        found.update(session.execute(_MEME_SOURCES, {'meme_ids': chunk}).all())
+    return found
+
+
+def existing_urls(session, urls):
+    """Какие из urls уже есть в базе: один запрос на пачку вместо запроса на каждый мем."""
+    found = set()
+    for chunk in _chunks(urls):
+        found.update(session.execute(_KNOWN_URLS, {'urls': chunk}).scalars())
+    return found
+
+
+def meme_ids_by_url(session, urls):
+    """{url: id} для уже записанных мемов."""
+    found = {}
+    for chunk in _chunks(urls):
+        found.update((url, meme_id) for meme_id, url in session.execute(_IDS_BY_URL, {'urls': chunk}))
+    return found
+
+
+def reaction_emotions(session, meme_ids):
+    """{meme_id: доминирующая эмоция} для мемов, у которых уже есть реакция."""
+    found = {}
+    for chunk in _chunks(meme_ids):
+        found.update(session.execute(_REACTION_EMOTIONS, {'meme_ids': chunk}).all())
+    return found
+
+
+def reaction_history(session, chunk_size):
+    """Все реакции кусками по chunk_size строк (meme_id, source, dominant_emotion), а не целиком."""
+    result = session.execute(_REACTION_HISTORY.execution_options(yield_per=chunk_size))
+    return result.partitions()
+
+
+def upsert_reactions(session, emotions):
+    """Записывает реакции {meme_id: эмоция}: существующая меняется, только если новая эмоция важнее."""
+    if emotions:
+        session.execute(_UPSERT_REACTION, [
+            {'meme_id': meme_id, 'dominant_emotion': emotion, 'timestamp': datetime.datetime.utcnow()}
+            for meme_id, emotion in emotions.items()
+        ])
+
+
+def add_emotion_counts(session, rows):
+    """Прибавляет счетчики эмоций: rows - словари meme_id, emotion, count."""
+    if rows:
+        session.execute(_ADD_EMOTION_COUNTS, rows)
+
+
+def mark_seen(session, meme_ids):
+    for chunk in _chunks(meme_ids):
+        session.execute(_MARK_SEEN, {'meme_ids': chunk})
+
+
+def mark_published(session, meme_ids, published_at=None):
+    """Мемы больше не кандидаты: они вышли в канал."""
+    published_at = published_at or datetime.datetime.utcnow()
+    for chunk in _chunks(meme_ids):
+        session.execute(_MARK_PUBLISHED, {'meme_ids': chunk, 'published_at': published_at})
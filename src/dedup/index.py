@@ -0,0 +1,160 @@
+# src/dedup/index.py
+
+import os
+import threading
+from itertools import combinations
+
+import numpy as np
+from sqlalchemy import select, func
+
+from src.database.models import Meme
+from src.dedup.phash import HASH_BITS, from_signed
+
+project_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# --- Конфигурация ---
+# Максимальное расстояние Хэмминга между dHash, при котором мемы считаются одинаковыми
+DEDUP_MAX_DISTANCE = int(os.getenv("DEDUP_MAX_DISTANCE", "6"))
+# На сколько кусков делится хеш в multi-index hashing
+DEDUP_INDEX_CHUNKS = int(os.getenv("DEDUP_INDEX_CHUNKS", "4"))
+# Где хранится снимок индекса между запусками
+PHASH_INDEX_PATH = os.getenv("PHASH_INDEX_PATH", os.path.join(project_root, "data", "phash_index.npz"))
+
+
+class NearDuplicateIndex:
+    """
+    Индекс почти-дубликатов по перцептивному хешу (multi-index hashing).
+
+    64-битный хеш режется на DEDUP_INDEX_CHUNKS кусков, для каждого куска
+    своя хеш-таблица "значение куска -> позиции хешей". Если два хеша
+    отличаются не больше чем на max_distance бит, то хотя бы один кусок
+    отличается не больше чем на max_distance // chunks бит, поэтому поиск -
+    это несколько десятков обращений к словарям и проверка пары кандидатов,
+    а не перебор всей базы.
+
+    Снимок индекса лежит на диске, при старте дочитываются только мемы
+    с id больше последнего проиндексированного.
+    """
+
+    def __init__(self, path=PHASH_INDEX_PATH, max_distance=DEDUP_MAX_DISTANCE, chunks=DEDUP_INDEX_CHUNKS):
+        if HASH_BITS % chunks:
+            raise ValueError(f"Число кусков должно делить {HASH_BITS}")
+        self.path = path
+        self.max_distance = max_distance
+        self.chunks = chunks
+        self._chunk_bits = HASH_BITS // chunks
+        self._chunk_mask = (1 << self._chunk_bits) - 1
+        # Все варианты куска на расстоянии не больше radius от исходного
+        radius = max_distance // chunks
+        self._probes = [0] + [
+            sum(1 << bit for bit in bits)
+            for r in range(1, radius + 1)
+            for bits in combinations(range(self._chunk_bits), r)
+        ]
+        self._clear()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._hashes)
+
+    def _clear(self):
+        self._tables = [{} for _ in range(self.chunks)]
+        self._hashes = []
+        self._ids = []
+        self.last_meme_id = 0
+
+    def _split(self, phash):
+        return [(phash >> (i * self._chunk_bits)) & self._chunk_mask for i in range(self.chunks)]
+
+    def add(self, phash, meme_id):
+        with self._lock:
+            self._add(phash, meme_id)
+
+    def _add(self, phash, meme_id):
+        position = len(self._hashes)
+        self._hashes.append(phash)
+        self._ids.append(meme_id)
+        for table, part in zip(self._tables, self._split(phash)):
+            table.setdefault(part, []).append(position)
+
+    def find(self, phash):
+        """id ближайшего мема в пределах max_distance или None."""
+        best_id, best_distance = None, self.max_distance + 1
+        with self._lock:
+            checked = set()
+            for table, part in zip(self._tables, self._split(phash)):
+                for probe in self._probes:
+                    for position in table.get(part ^ probe, ()):
+                        if position in checked:
+                            continue
+                        checked.add(position)
+                        distance = (self._hashes[position] ^ phash).bit_count()
+                        if distance < best_distance:
+                            best_id, best_distance = self._ids[position], distance
+        return best_id
+
+    def sync(self, session):
+        """Добавляет в индекс мемы, записанные в базу после последней синхронизации."""
+        with self._lock:
+            max_id = session.execute(select(func.max(Meme.id))).scalar() or 0
+            if max_id < self.last_meme_id:
+                # База пересоздана - снимок от другой базы, строим заново
+                self._clear()
+            rows = session.execute(
+                select(Meme.id, Meme.phash)
+                .where(Meme.id > self.last_meme_id, Meme.phash.is_not(None))
+                .order_by(Meme.id)
+            ).all()
+            for meme_id, phash in rows:
+                self._add(from_signed(phash), meme_id)
+            self.last_meme_id = max(self.last_meme_id, max_id)
+            return len(rows)
+
+    def load(self):
+        """Читает снимок с диска. Битый или отсутствующий снимок - пустой индекс."""
+        with self._lock:
+            self._clear()
+            if not os.path.exists(self.path):
+                return False
+            try:
+                with np.load(self.path) as data:
+                    hashes = data['hashes'].tolist()
+                    ids = data['ids'].tolist()
+                    last_meme_id = int(data['last_meme_id'])
+            except Exception as e:
+                print(f"Не удалось прочитать индекс дубликатов {self.path}, строю заново: {e}")
+                return False
+            for phash, meme_id in zip(hashes, ids):
+                self._add(phash, meme_id)
+            self.last_meme_id = last_meme_id
+            return True
+
+    def save(self):
+        """Атомарно пишет снимок: сначала во временный файл, потом переименование."""
+        with self._lock:
+            hashes = np.array(self._hashes, dtype=np.uint64)
+            ids = np.array(self._ids, dtype=np.int64)
+            last_meme_id = self.last_meme_id
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, hashes=hashes, ids=ids, last_meme_id=np.int64(last_meme_id))
+        os.replace(tmp_path, self.path)
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_phash_index(session):
+    """Один индекс на процесс: снимок с диска плюс все, что появилось в базе с тех пор."""
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = NearDuplicateIndex()
+            _index.load()
+            added = _index.sync(session)
+            if added:
+                _index.save()
+            print(f"Индекс дубликатов готов: {len(_index)} картинок.")
+        return _index
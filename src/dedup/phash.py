@@ -0,0 +1,53 @@
+# src/dedup/phash.py
+
+import cv2
+import numpy as np
+
+# dHash 8x8: картинка сжимается до 9x8 в оттенках серого, и каждый бит
+# говорит, светлее ли пиксель своего правого соседа. Хеш устойчив к
+# пережатию, ресайзу и небольшим правкам, а похожесть - это расстояние Хэмминга.
+HASH_SIZE = 8
+HASH_BITS = HASH_SIZE * HASH_SIZE
+
+_SIGN_BIT = 1 << (HASH_BITS - 1)
+_BIT_WEIGHTS = 1 << np.arange(HASH_BITS - 1, -1, -1, dtype=np.uint64)
+
+
+def decode_image(content):
+    """BGR-картинка из байтов файла или None, если OpenCV не смог ее раскодировать (например, GIF)."""
+    if not content:
+        return None
+    return cv2.imdecode(np.frombuffer(content, dtype=np.uint8), cv2.IMREAD_COLOR)
+
+
+def dhash(content):
+    """Перцептивный хеш картинки из байтов файла (64-битное беззнаковое число) или None."""
+    return dhash_image(decode_image(content))
+
+
+def dhash_image(image):
+    """То же по уже раскодированной картинке: файл декодируется один раз на все признаки."""
+    if image is None:
+        return None
+    if image.ndim == 3:
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    small = cv2.resize(image, (HASH_SIZE + 1, HASH_SIZE), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).ravel().astype(np.uint64)
+    return int((bits * _BIT_WEIGHTS).sum())
+
+
+def hamming(a, b):
+    return (a ^ b).bit_count()
+
+
+def to_signed(value):
+    """INTEGER в SQLite знаковый: беззнаковый хеш хранится как int64."""
+    if value is None:
+        return None
+    return value - (1 << HASH_BITS) if value & _SIGN_BIT else value
+
+
+def from_signed(value):
+    if value is None:
+        return None
+    return value & ((1 << HASH_BITS) - 1)
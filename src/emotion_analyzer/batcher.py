@@ -0,0 +1,84 @@
+# src/emotion_analyzer/batcher.py
+
+import time
+import queue
+import threading
+from collections import Counter
+
+
+class MicroBatcher:
+    """
+    Собирает элементы из разных потоков в пачки: пачка уходит в обработку,
+    как только набралось max_batch_size элементов или с момента прихода
+    первого из них прошло max_wait_ms миллисекунд.
+    """
+
+    def __init__(self, handle_batch, max_batch_size, max_wait_ms, name='micro-batcher'):
+        self.handle_batch = handle_batch
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0, max_wait_ms) / 1000
+        self.name = name
+
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+        # --- Статистика ---
+        self._batch_sizes = Counter()
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._items_total = 0
+
+    def put(self, item):
+        """Добавляет элемент в текущую пачку."""
+        self._ensure_started()
+        self._queue.put((time.monotonic(), item))
+
+    def stats(self):
+        """Размеры пачек и время ожидания элементов в очереди."""
+        with self._lock:
+            batches = sum(self._batch_sizes.values())
+            return {
+                'batches': batches,
+                'frames': self._items_total,
+                'avg_batch_size': round(self._items_total / batches, 2) if batches else 0,
+                'batch_sizes': dict(sorted(self._batch_sizes.items())),
+                'avg_queue_wait_ms': round(1000 * self._wait_total / self._items_total, 2) if self._items_total else 0,
+                'max_queue_wait_ms': round(1000 * self._wait_max, 2),
+                'max_batch_size': self.max_batch_size,
+                'max_wait_ms': round(self.max_wait * 1000, 2),
+            }
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            now = time.monotonic()
+            waits = [now - enqueued_at for enqueued_at, _ in batch]
+            with self._lock:
+                self._batch_sizes[len(batch)] += 1
+                self._items_total += len(batch)
+                self._wait_total += sum(waits)
+                self._wait_max = max(self._wait_max, max(waits))
+
+            try:
+                self.handle_batch([item for _, item in batch])
+            except Exception as e:
+                print(f"Ошибка при отправке пачки ({self.name}): {e}")
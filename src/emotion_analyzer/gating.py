@@ -0,0 +1,191 @@
+# src/emotion_analyzer/gating.py
+
+import os
+import time
+import threading
+from collections import Counter, OrderedDict
+
+import cv2
+import numpy as np
+
+from src.emotion_analyzer.model import NO_FACE
+
+# --- Конфигурация фильтра ---
+# Средняя попиксельная разница (0-255) уменьшенных серых кадров,
+# ниже которой кадр считается "тем же самым"
+GATE_DIFF_THRESHOLD = float(os.getenv("GATE_DIFF_THRESHOLD", "6"))
+# Искать лицо дешевым детектором OpenCV до запуска сети эмоций
+GATE_FACE_DETECTION = os.getenv("GATE_FACE_DETECTION", "1") == "1"
+# Интервал съемки на клиенте: базовый и максимальный при отсутствии изменений
+BASE_INTERVAL_MS = int(os.getenv("CAPTURE_INTERVAL_MS", "1500"))
+MAX_INTERVAL_MS = int(os.getenv("CAPTURE_MAX_INTERVAL_MS", "6000"))
+# Сколько сессий помним и сколько секунд храним неактивную
+GATE_MAX_SESSIONS = 1000
+GATE_SESSION_TTL = 600
+
+# Размер опорного кадра для сравнения
+REFERENCE_SIZE = (32, 32)
+# Ширина кадра, на котором ищем лицо
+DETECTION_WIDTH = 320
+# Запас вокруг найденного лица (доля от его размера)
+FACE_MARGIN = 0.2
+
+
+class GateDecision:
+    """
+    Итог фильтра для одного кадра:
+    skip=True - сеть не нужна, ответ уже в emotion;
+    иначе в frame лежит то, что надо отдать сети (face_crop - это уже вырезанное лицо),
+    а reference и meme_id станут опорными, когда сеть ответит (FrameGate.remember).
+    """
+
+    def __init__(self, skip, emotion=None, frame=None, face_crop=False, reference=None, meme_id=None):
+        self.skip = skip
+        self.emotion = emotion
+        self.frame = frame
+        self.face_crop = face_crop
+        self.reference = reference
+        self.meme_id = meme_id
+
+
+class FrameGate:
+    """
+    Дешевый предфильтр перед DeepFace: для каждой сессии хранит уменьшенный
+    опорный кадр и последнюю эмоцию. Почти одинаковые кадры и кадры без лица
+    до сети эмоций не доходят.
+    """
+
+    def __init__(self, diff_threshold=GATE_DIFF_THRESHOLD, face_detection=GATE_FACE_DETECTION):
+        self.diff_threshold = diff_threshold
+        self.face_detection = face_detection and _cascade_path() is not None
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._counters = Counter()
+
+    def check(self, session_id, meme_id, img_np):
+        """Решает, нужно ли гнать кадр через сеть эмоций."""
+        small = cv2.resize(cv2.cvtColor(img_np, cv2.COLOR_BGR2GRAY), REFERENCE_SIZE,
+                           interpolation=cv2.INTER_AREA)
+        state = self._get_state(session_id)
+        self._count('frames_total')
+
+        same_meme = state.get('meme_id') == meme_id
+        if same_meme and state.get('reference') is not None and state.get('emotion') is not None:
+            diff = float(np.mean(cv2.absdiff(small, state['reference'])))
+            if diff < self.diff_threshold:
+                state['streak'] += 1
+                self._count('skipped_unchanged')
+                return GateDecision(skip=True, emotion=state['emotion'])
+
+        # Кадр для сети становится опорным только после ответа (remember):
+        # если пул откажет, следующий такой же кадр не должен получить
+        # эмоцию предыдущего, которую для него никто не считал
+        if not self.face_detection:
+            state['streak'] = 0
+            self._count('inferred')
+            return GateDecision(skip=False, frame=img_np, reference=small, meme_id=meme_id)
+
+        face = self._find_face(img_np)
+        if face is None:
+            state['reference'] = small
+            state['meme_id'] = meme_id
+            state['emotion'] = NO_FACE
+            state['streak'] = state['streak'] + 1 if same_meme else 0
+            self._count('skipped_no_face')
+            return GateDecision(skip=True, emotion=NO_FACE)
+
+        state['streak'] = 0
+        self._count('inferred')
+        return GateDecision(skip=False, frame=face, face_crop=True, reference=small, meme_id=meme_id)
+
+    def remember(self, session_id, decision, emotion):
+        """
+        Запоминает эмоцию, которую сеть вернула для кадра decision: кадр
+        становится опорным, и похожие на него кадры получат эту эмоцию без сети.
+        """
+        with self._lock:
+            state = self._sessions.get(session_id)
+            if state is not None:
+                state['reference'] = decision.reference
+                state['meme_id'] = decision.meme_id
+                state['emotion'] = emotion
+
+    def next_interval_ms(self, session_id):
+        """
+        Через сколько миллисекунд клиенту стоит прислать следующий кадр:
+        интервал удваивается после каждых трех кадров подряд без изменений.
+        """
+        with self._lock:
+            state = self._sessions.get(session_id)
+            streak = state['streak'] if state else 0
+        return min(MAX_INTERVAL_MS, BASE_INTERVAL_MS * 2 ** (streak // 3))
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self._counters)
+            sessions = len(self._sessions)
+        total = counters.get('frames_total', 0)
+        skipped = counters.get('skipped_unchanged', 0) + counters.get('skipped_no_face', 0)
+        counters['skip_rate'] = round(skipped / total, 3) if total else 0
+        counters['sessions'] = sessions
+        return counters
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    def _get_state(self, session_id):
+        now = time.monotonic()
+        with self._lock:
+            state = self._sessions.pop(session_id, None)
+            if state is None:
+                state = {'reference': None, 'meme_id': None, 'emotion': None, 'streak': 0}
+            state['touched'] = now
+            self._sessions[session_id] = state
+
+            # Выкидываем самые старые сессии: по TTL и по общему лимиту
+            while self._sessions:
+                oldest_id, oldest = next(iter(self._sessions.items()))
+                if len(self._sessions) <= GATE_MAX_SESSIONS and now - oldest['touched'] < GATE_SESSION_TTL:
+                    break
+                del self._sessions[oldest_id]
+            return state
+
+    def _find_face(self, img_np):
+        """
+        Ищет самое крупное лицо каскадом Хаара на уменьшенном кадре
+        и возвращает его вырезку из исходного кадра (или None).
+        """
+        height, width = img_np.shape[:2]
+        scale = min(1.0, DETECTION_WIDTH / width)
+        gray = cv2.cvtColor(img_np, cv2.COLOR_BGR2GRAY)
+        if scale < 1.0:
+            gray = cv2.resize(gray, (int(width * scale), int(height * scale)), interpolation=cv2.INTER_AREA)
+
+        faces = self._cascade().detectMultiScale(gray, scaleFactor=1.2, minNeighbors=5, minSize=(30, 30))
+        if len(faces) == 0:
+            return None
+
+        x, y, w, h = max(faces, key=lambda f: f[2] * f[3]) / scale
+        margin_x, margin_y = w * FACE_MARGIN, h * FACE_MARGIN
+        x0, y0 = max(0, int(x - margin_x)), max(0, int(y - margin_y))
+        x1, y1 = min(width, int(x + w + margin_x)), min(height, int(y + h + margin_y))
+        return img_np[y0:y1, x0:x1]
+
+    def _cascade(self):
+        # CascadeClassifier не потокобезопасен - у каждого потока свой
+        cascade = getattr(self._local, 'cascade', None)
+        if cascade is None:
+            cascade = cv2.CascadeClassifier(_cascade_path())
+            self._local.cascade = cascade
+        return cascade
+
+
+def _cascade_path():
+    """Путь к каскаду лиц из поставки OpenCV (в некоторых сборках его нет)."""
+    data_dir = getattr(getattr(cv2, 'data', None), 'haarcascades', None)
+    if not data_dir:
+        return None
+    path = os.path.join(data_dir, 'haarcascade_frontalface_default.xml')
+    return path if os.path.exists(path) else None
@@ -0,0 +1,114 @@
+# src/emotion_analyzer/model.py
+
+import os
+import logging
+
+import cv2
+import numpy as np
+
+# Надпись, которую получает клиент, если лица на кадре нет
+NO_FACE = "лицо не найдено"
+
+# Кадр для прогрева: размер примерно как у кадра с веб-камеры
+WARMUP_FRAME_SHAPE = (480, 640, 3)
+
+# Детектор лиц DeepFace (opencv - самый быстрый из встроенных)
+EMOTION_DETECTOR = os.getenv("EMOTION_DETECTOR", "opencv")
+
+# Порядок классов на выходе сети эмоций DeepFace
+EMOTION_LABELS = ['angry', 'disgust', 'fear', 'happy', 'sad', 'surprise', 'neutral']
+EMOTION_INPUT_SIZE = (48, 48)
+
+
+class EmotionModel:
+    """
+    Обертка над DeepFace для распознавания эмоций.
+    Модель загружается один раз при load(), дальше analyze() только считает.
+    """
+
+    def __init__(self):
+        self._deepface = None
+        self._emotion_net = None
+
+    def load(self):
+        """Импортирует DeepFace/TensorFlow и прогревает модель эмоций."""
+        from deepface import DeepFace
+
+        # Отключаем лишние логи от deepface
+        logging.getLogger('deepface').setLevel(logging.ERROR)
+        self._deepface = DeepFace
+        self._emotion_net = self._build_emotion_net()
+        self.warmup()
+
+    def _build_emotion_net(self):
+        """
+        Достает из DeepFace саму keras-сеть эмоций, чтобы считать пачку кадров
+        одним predict. Если версия DeepFace устроена иначе, вернет None,
+        и кадры будут считаться по одному через DeepFace.analyze.
+        """
+        try:
+            try:
+                client = self._deepface.build_model(model_name="Emotion", task="facial_attribute")
+            except TypeError:
+                client = self._deepface.build_model("Emotion")
+            return getattr(client, 'model', client)
+        except Exception as e:
+            print(f"Пакетный режим недоступен, анализ будет покадровым: {e}")
+            return None
+
+    def warmup(self):
+        """Первый прогон сети: строит граф и подгружает веса в память."""
+        self.analyze_batch([np.zeros(WARMUP_FRAME_SHAPE, dtype=np.uint8)])
+
+    def analyze(self, img_np, face_crop=False):
+        """
+        Возвращает словарь с доминирующей эмоцией и вероятностями по классам.
+        face_crop=True - на кадре уже вырезанное лицо, детектор пропускается.
+        """
+        detector = 'skip' if face_crop else EMOTION_DETECTOR
+        result = self._deepface.analyze(img_np, actions=['emotion'], detector_backend=detector,
+                                        enforce_detection=False, silent=True)
+
+        if isinstance(result, list) and len(result) > 0:
+            face = result[0]
+            return {
+                'dominant_emotion': face['dominant_emotion'],
+                'emotion': {k: float(v) for k, v in face['emotion'].items()},
+            }
+        return {'dominant_emotion': NO_FACE, 'emotion': {}}
+
+    def analyze_batch(self, frames, face_crops=None):
+        """
+        Анализирует пачку кадров: лица ищутся на каждом кадре отдельно
+        (кроме уже вырезанных), а сеть эмоций прогоняется один раз на все лица.
+        """
+        face_crops = face_crops or [False] * len(frames)
+        if self._emotion_net is None:
+            return [self.analyze(frame, face_crop) for frame, face_crop in zip(frames, face_crops)]
+
+        faces = np.stack([self._prepare_face(frame, face_crop) for frame, face_crop in zip(frames, face_crops)])
+        predictions = self._emotion_net.predict(faces, verbose=0)
+        return [self._to_result(prediction) for prediction in predictions]
+
+    def _prepare_face(self, frame, face_crop=False):
+        """Готовит вход сети: серое изображение лица 48x48 в [0, 1]."""
+        if face_crop:
+            # Вырезка из кадра OpenCV: BGR, uint8
+            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY).astype(np.float32) / 255
+        else:
+            faces = self._deepface.extract_faces(
+                frame, detector_backend=EMOTION_DETECTOR, enforce_detection=False, align=True)
+            # extract_faces отдает лицо в RGB; без лица - весь кадр, как и analyze
+            face = faces[0]['face'] if faces else frame[:, :, ::-1].astype(np.float32) / 255
+            gray = cv2.cvtColor(np.asarray(face, dtype=np.float32), cv2.COLOR_RGB2GRAY)
+        gray = cv2.resize(gray, EMOTION_INPUT_SIZE)
+        return gray[..., np.newaxis]
+
+    @staticmethod
+    def _to_result(prediction):
+        total = float(prediction.sum()) or 1.0
+        emotion = {label: 100 * float(p) / total for label, p in zip(EMOTION_LABELS, prediction)}
+        return {
+            'dominant_emotion': max(emotion, key=emotion.get),
+            'emotion': emotion,
+        }
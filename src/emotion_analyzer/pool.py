@@ -0,0 +1,309 @@
+# src/emotion_analyzer/pool.py
+
+import os
+import time
+import queue
+import importlib
+import atexit
+import itertools
+import threading
+import multiprocessing as mp
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+
+from src.emotion_analyzer.batcher import MicroBatcher
+
+# --- Конфигурация пула ---
+EMOTION_WORKERS = int(os.getenv("EMOTION_WORKERS", "1"))
+# Сколько кадров может одновременно ждать или обрабатываться во всем пуле
+EMOTION_QUEUE_SIZE = int(os.getenv("EMOTION_QUEUE_SIZE", "8"))
+# Сколько секунд запрос ждет результат, прежде чем сдаться
+EMOTION_TIMEOUT = float(os.getenv("EMOTION_TIMEOUT", "10"))
+# Микробатчинг: сколько кадров максимум в одном прогоне сети
+# и сколько миллисекунд ждем, пока пачка наберется
+EMOTION_MAX_BATCH = int(os.getenv("EMOTION_MAX_BATCH", "8"))
+EMOTION_MAX_WAIT_MS = float(os.getenv("EMOTION_MAX_WAIT_MS", "25"))
+# Класс модели в виде "модуль:Класс" вместо DeepFace (например, заглушка из benchmarks/)
+EMOTION_MODEL = os.getenv("EMOTION_MODEL")
+
+
+class PoolBusy(Exception):
+    """Очередь пула заполнена - кадр нужно пропустить."""
+
+
+def _worker_main(task_queue, result_queues, ready_workers):
+    """
+    Тело процесса-воркера: один раз грузит модель, прогревает ее
+    и дальше только берет пачки кадров из очереди. Ответ уходит
+    в очередь результатов того процесса, который прислал пачку.
+    """
+    model = _model_class()()
+    model.load()
+    with ready_workers.get_lock():
+        ready_workers.value += 1
+    print(f"Воркер анализа эмоций готов (pid {os.getpid()}).")
+
+    while True:
+        task = task_queue.get()
+        if task is None:
+            break
+        slot, task_ids, frames, face_crops = task
+        try:
+            result = (task_ids, model.analyze_batch(frames, face_crops), None)
+        except Exception as e:
+            result = (task_ids, None, repr(e))
+        result_queues[slot].put(result)
+
+
+def _model_class():
+    if not EMOTION_MODEL:
+        from src.emotion_analyzer.model import EmotionModel
+        return EmotionModel
+    module_name, class_name = EMOTION_MODEL.split(':')
+    return getattr(importlib.import_module(module_name), class_name)
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class EmotionWorkerPool:
+    """
+    Пул процессов для DeepFace. Flask-потоки только кладут кадр в очередь
+    и ждут Future, а TensorFlow живет в отдельных процессах.
+    Кадры от параллельных запросов склеиваются в пачки и считаются
+    одним прогоном сети.
+
+    Под serve.py пул общий для всех HTTP-воркеров: мастер до fork вызывает
+    start_shared(), и процессы с моделью стартуют один раз на весь сервер,
+    а не на каждый HTTP-воркер. Каждый HTTP-воркер после fork вызывает
+    attach() и получает свою очередь результатов (слот).
+    """
+
+    def __init__(self, workers=EMOTION_WORKERS, max_pending=EMOTION_QUEUE_SIZE,
+                 max_batch_size=EMOTION_MAX_BATCH, max_wait_ms=EMOTION_MAX_WAIT_MS):
+        self.workers = max(1, workers)
+        self.max_pending = max(1, max_pending)
+        self._batcher = MicroBatcher(self._dispatch_batch, max_batch_size, max_wait_ms, name='emotion-batcher')
+
+        # spawn, а не fork: дочерним процессам не нужно состояние Flask
+        self._ctx = mp.get_context('spawn')
+        self._task_queue = None
+        self._result_queues = []
+        self._slot = 0
+        self._slot_owners = None   # pid HTTP-воркера на каждый слот (только в общем режиме)
+        self._processes = []
+        self._futures = {}
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+        self._ready_workers = self._ctx.Value('i', 0)
+        self._owner_pid = None     # процесс, который запустил воркеры и отвечает за их перезапуск
+        self._started = False
+        self._stopping = False
+        self._closing = False      # сервер останавливается: упавшие воркеры больше не поднимаются
+
+    @property
+    def is_ready(self):
+        """True, когда хотя бы один воркер загрузил и прогрел модель."""
+        return self._ready_workers.value > 0
+
+    def start(self):
+        """Запускает воркеры. Повторный вызов ничего не делает."""
+        with self._lock:
+            if self._started:
+                return
+            self._launch(clients=1)
+
+        threading.Thread(target=self._collect_results, name='emotion-results', daemon=True).start()
+        print(f"Пул анализа эмоций запущен: {self.workers} процесс(ов), очередь до {self.max_pending} кадров.")
+
+    def start_shared(self, clients):
+        """
+        Запускает воркеры в мастер-процессе перед fork HTTP-воркеров.
+        clients - сколько HTTP-воркеров может быть подключено одновременно
+        (с запасом на плавный перезапуск, когда старые еще дорабатывают).
+        """
+        with self._lock:
+            if self._started:
+                return
+            self._slot_owners = self._ctx.Array('i', clients)
+            self._launch(clients)
+
+        # Упавшие воркеры перезапускает только мастер - они его дочерние процессы
+        threading.Thread(target=self._monitor, name='emotion-monitor', daemon=True).start()
+        print(f"Общий пул анализа эмоций запущен: {self.workers} процесс(ов) на {clients} HTTP-воркеров.")
+
+    def attach(self):
+        """
+        Подключает HTTP-воркер (сразу после fork) к общему пулу: занимает
+        свободный слот и запускает свои потоки - потоки мастера fork не переживают.
+        """
+        if self._slot_owners is None:
+            raise RuntimeError("attach() нужен только после start_shared() в мастер-процессе")
+        # Блокировки могли быть захвачены потоками мастера в момент fork
+        self._lock = threading.Lock()
+        self._batcher = MicroBatcher(self._dispatch_batch, self._batcher.max_batch_size,
+                                     self._batcher.max_wait * 1000, name='emotion-batcher')
+        self._futures = {}
+        # Процессы пула - дети мастера. Без этого multiprocessing при выходе
+        # HTTP-воркера остановит их (terminate) и сломает очередь задач всем остальным
+        mp.process._children.difference_update(self._processes)
+        # id задач уникальны между процессами: в слот может попасть поздний ответ прежнего владельца
+        self._ids = itertools.count(os.getpid() << 32)
+        pid = os.getpid()
+        with self._slot_owners.get_lock():
+            free = [slot for slot, owner in enumerate(self._slot_owners)
+                    if owner == 0 or not _pid_alive(owner)]
+            if not free:
+                raise RuntimeError(f"Все {len(self._slot_owners)} слотов пула эмоций заняты")
+            self._slot = free[0]
+            self._slot_owners[self._slot] = pid
+        # Читатель у слота один - этот процесс. Общую блокировку чтения мог унести
+        # прежний владелец, убитый посреди get(), поэтому она заменяется локальной
+        self._result_queues[self._slot]._rlock = threading.Lock()
+        atexit.register(self._release_slot, pid)
+        threading.Thread(target=self._collect_results, name='emotion-results', daemon=True).start()
+
+    def _release_slot(self, pid):
+        with self._slot_owners.get_lock():
+            if self._slot_owners[self._slot] == pid:
+                self._slot_owners[self._slot] = 0
+
+    def _launch(self, clients):
+        self._task_queue = self._ctx.Queue()
+        self._result_queues = [self._ctx.Queue() for _ in range(clients)]
+        for _ in range(self.workers):
+            self._spawn_worker()
+        self._owner_pid = os.getpid()
+        self._started = True
+        atexit.register(self.shutdown)
+
+    def submit(self, frame, face_crop=False):
+        """
+        Ставит кадр в очередь и возвращает Future с результатом.
+        face_crop=True - на кадре уже вырезанное лицо, детектор не нужен.
+        Если очередь заполнена, сразу бросает PoolBusy.
+        """
+        self.start()
+        future = Future()
+        with self._lock:
+            if len(self._futures) >= self.max_pending:
+                raise PoolBusy()
+            task_id = next(self._ids)
+            self._futures[task_id] = future
+        future.task_id = task_id
+        self._batcher.put((task_id, frame, face_crop))
+        return future
+
+    def analyze(self, frame, face_crop=False, timeout=EMOTION_TIMEOUT):
+        """Синхронная обертка: отправить кадр и дождаться результата."""
+        future = self.submit(frame, face_crop)
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeout:
+            # Освобождаем место в очереди, поздний результат просто отбросим
+            with self._lock:
+                self._futures.pop(future.task_id, None)
+            raise
+
+    def stats(self):
+        """Статистика микробатчинга и загрузки пула."""
+        stats = self._batcher.stats()
+        stats['pending'] = len(self._futures)
+        stats['ready_workers'] = self._ready_workers.value
+        return stats
+
+    def begin_shutdown(self):
+        """
+        Сервер начал останавливаться: воркеры, которые умрут дальше, не перезапускаются.
+        Без блокировки - вызывается из обработчика сигнала, раньше, чем shutdown().
+        """
+        self._closing = True
+
+    def shutdown(self):
+        """Останавливает воркеры: сначала мягко, через сигнал в очереди."""
+        with self._lock:
+            # HTTP-воркер наследует atexit мастера, но общий пул останавливает только мастер
+            if not self._started or self._stopping or os.getpid() != self._owner_pid:
+                return
+            self._closing = True
+            self._stopping = True
+        for _ in self._processes:
+            self._task_queue.put(None)
+        for process in self._processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+
+    def _dispatch_batch(self, items):
+        """Отправляет собранную пачку кадров в воркеры одной задачей."""
+        task_ids = [task_id for task_id, _, _ in items]
+        frames = [frame for _, frame, _ in items]
+        face_crops = [face_crop for _, _, face_crop in items]
+        try:
+            self._task_queue.put((self._slot, task_ids, frames, face_crops))
+        except Exception as e:
+            self._resolve(task_ids, None, repr(e))
+
+    def _resolve(self, task_ids, results, error):
+        for i, task_id in enumerate(task_ids):
+            with self._lock:
+                future = self._futures.pop(task_id, None)
+            if future is None:
+                continue
+            if error is not None:
+                future.set_exception(RuntimeError(error))
+            else:
+                future.set_result(results[i])
+
+    def _spawn_worker(self):
+        process = self._ctx.Process(
+            target=_worker_main,
+            args=(self._task_queue, self._result_queues, self._ready_workers),
+            name='emotion-worker',
+            daemon=True,
+        )
+        process.start()
+        self._processes.append(process)
+
+    def _collect_results(self):
+        """Фоновый поток: раздает результаты из воркеров по Future."""
+        result_queue = self._result_queues[self._slot]
+        while not self._stopping:
+            try:
+                task_ids, results, error = result_queue.get(timeout=1)
+            except queue.Empty:
+                if os.getpid() == self._owner_pid:
+                    self._restart_dead_workers()
+                continue
+            except (EOFError, OSError):
+                break
+
+            self._resolve(task_ids, results, error)
+
+    def _monitor(self):
+        while not self._stopping:
+            time.sleep(1)
+            self._restart_dead_workers()
+
+    def _restart_dead_workers(self):
+        """Если воркер упал (например, по памяти), поднимаем новый на его место."""
+        with self._lock:
+            for process in list(self._processes):
+                # Флаг проверяется на каждом воркере: остановка могла начаться посреди
+                # обхода, и умершие после этого воркеры перезапускать уже не нужно
+                if self._stopping or self._closing:
+                    return
+                # Под gunicorn мастер сам собирает завершившихся потомков (waitpid),
+                # и is_alive() этого уже не увидит - поэтому проверяем еще и pid
+                if not process.is_alive() or not _pid_alive(process.pid):
+                    print(f"Воркер анализа эмоций (pid {process.pid}) упал, перезапускаю...")
+                    self._processes.remove(process)
+                    with self._ready_workers.get_lock():
+                        self._ready_workers.value = max(0, self._ready_workers.value - 1)
+                    self._spawn_worker()
@@ -0,0 +1,359 @@
+# src/emotion_store/store.py
+
+import os
+import sys
+import glob
+import time
+import uuid
+import zlib
+import atexit
+import threading
+
+import numpy as np
+
+from src.emotion_analyzer.model import EMOTION_LABELS
+
+project_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# --- Конфигурация ---
+EMOTION_EVENTS_DIR = os.getenv("EMOTION_EVENTS_DIR", os.path.join(project_root, "data", "emotion_events"))
+# Размер сегмента, после которого процесс закрывает его и начинает новый (по умолчанию 16 МБ)
+EMOTION_SEGMENT_MAX_BYTES = int(os.getenv("EMOTION_SEGMENT_MAX_BYTES", str(16 * 1024 ** 2)))
+# Сжатых файлов больше этого - компактизация сливает их в один
+EMOTION_COMPACT_MAX_FILES = int(os.getenv("EMOTION_COMPACT_MAX_FILES", "8"))
+# Сколько событий отдает потоковое чтение за раз
+EMOTION_READ_CHUNK = int(os.getenv("EMOTION_READ_CHUNK", "65536"))
+
+# Одно событие - один проанализированный кадр, 23 байта без выравнивания:
+# мем, сессия (crc32 ее id), время в миллисекундах и вероятности классов
+# EMOTION_LABELS, квантованные в uint8 (255 = 100%)
+EVENT_DTYPE = np.dtype([
+    ('meme_id', '<u4'),
+    ('session', '<u4'),
+    ('timestamp_ms', '<i8'),
+    ('probabilities', 'u1', (len(EMOTION_LABELS),)),
+])
+
+_ACTIVE_SUFFIX = '.active'
+_SEGMENT_SUFFIX = '.bin'
+_COMPACT_SUFFIX = '.npz'
+
+
+def _pid_alive(pid):
+    if pid == os.getpid():
+        return True
+    if sys.platform == 'win32':
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def session_key(client_session):
+    """Сессия клиента в 4 байта: хранить сами строки в каждом событии дорого."""
+    return zlib.crc32(str(client_session).encode())
+
+
+def quantize(emotion):
+    """{класс: процент} из EmotionModel в вектор uint8 в порядке EMOTION_LABELS."""
+    values = np.array([emotion.get(label, 0.0) for label in EMOTION_LABELS], dtype=np.float32)
+    return np.clip(np.rint(values * 2.55), 0, 255).astype(np.uint8)
+
+
+class EmotionEventStore:
+    """
+    Хранилище покадровых вероятностей эмоций, только на дописывание.
+
+    Каждый процесс пишет события в свой сегмент - файл из записей
+    EVENT_DTYPE подряд, без заголовков, поэтому запись кадра - это один
+    write() без SQLite и блокировок между процессами, а сегмент читается
+    через np.memmap как есть. Заполненный сегмент (и сегмент процесса,
+    который завершился) закрывается и ждет компактизации: compact()
+    сливает закрытые сегменты в сжатый .npz, отсортированный по мему
+    и времени, и удаляет их.
+
+    В .npz записаны имена сегментов, из которых он собран: если процесс
+    упал между записью .npz и удалением сегментов, читатель не посчитает
+    одно событие дважды, а следующая компактизация просто удалит их.
+    """
+
+    def __init__(self, root=EMOTION_EVENTS_DIR, segment_max_bytes=EMOTION_SEGMENT_MAX_BYTES):
+        self.root = root
+        self.segment_max_bytes = segment_max_bytes
+        self._file = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._compact_lock = threading.Lock()
+
+    # --- Запись ---
+
+    def append(self, meme_id, client_session, emotion, timestamp=None):
+        """Дописывает событие кадра. emotion - {класс: процент}, как в ответе EmotionModel."""
+        record = np.zeros(1, dtype=EVENT_DTYPE)
+        record['meme_id'] = int(meme_id)
+        record['session'] = session_key(client_session)
+        record['timestamp_ms'] = int((time.time() if timestamp is None else timestamp) * 1000)
+        record['probabilities'] = quantize(emotion)
+        self.append_records(record)
+
+    def append_records(self, records):
+        """Дописывает готовый массив EVENT_DTYPE одним write()."""
+        data = np.ascontiguousarray(records, dtype=EVENT_DTYPE).tobytes()
+        if not data:
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                # Первый вызов или процесс форкнут: у родителя свой сегмент
+                self._open_segment()
+            self._file.write(data)
+            self._file.flush()
+            if self._file.tell() >= self.segment_max_bytes:
+                self._seal_segment()
+                self._open_segment()
+
+    def seal(self):
+        """Закрывает текущий сегмент процесса (например, при остановке)."""
+        with self._lock:
+            if self._pid == os.getpid():
+                self._seal_segment()
+                self._pid = None
+
+    def _open_segment(self):
+        os.makedirs(self.root, exist_ok=True)
+        path = os.path.join(self.root, f"events-{os.getpid()}-{uuid.uuid4().hex}{_ACTIVE_SUFFIX}")
+        # Без буфера Python: каждый append сразу уходит в файл целыми записями
+        self._file = open(path, 'ab', buffering=0)
+        if self._pid is None:
+            atexit.register(self.seal)
+        self._pid = os.getpid()
+
+    def _seal_segment(self):
+        path = self._file.name
+        self._file.close()
+        self._file = None
+        try:
+            if os.path.getsize(path):
+                os.replace(path, path[:-len(_ACTIVE_SUFFIX)] + _SEGMENT_SUFFIX)
+            else:
+                os.remove(path)
+        except FileNotFoundError:
+            pass  # каталог хранилища удалили (например, временный в бенчмарке)
+
+    # --- Компактизация ---
+
+    def _files(self, suffix):
+        return sorted(glob.glob(os.path.join(self.root, f"*{suffix}")))
+
+    def _sealed_segments(self):
+        """Закрытые сегменты и активные сегменты процессов, которых уже нет."""
+        segments = self._files(_SEGMENT_SUFFIX)
+        for path in self._files(_ACTIVE_SUFFIX):
+            pid = os.path.basename(path).split('-')[1]
+            if pid.isdigit() and not _pid_alive(int(pid)):
+                segments.append(path)
+        return segments
+
+    def compact(self):
+        """
+        Сливает закрытые сегменты в один сжатый .npz, а если сжатых файлов
+        набралось больше EMOTION_COMPACT_MAX_FILES - то и их тоже.
+        Возвращает число событий в новом файле (0 - сливать было нечего).
+        """
+        with self._compact_lock:
+            already = self._compacted_sources()
+            # Файлы, уже слитые в другой .npz до падения, остается только удалить
+            for path in self._sealed_segments() + self._files(_COMPACT_SUFFIX):
+                if os.path.basename(path) in already:
+                    os.remove(path)
+            segments = self._sealed_segments()
+            compacted = self._files(_COMPACT_SUFFIX)
+            merge = compacted if len(compacted) > EMOTION_COMPACT_MAX_FILES else []
+            if not segments and not merge:
+                return 0
+
+            parts = [self._read_segment(path) for path in segments]
+            sources = [os.path.basename(path) for path in segments + merge]
+            for path in merge:
+                with np.load(path) as data:
+                    parts.append(self._from_columns(data))
+            events = np.concatenate(parts) if parts else np.zeros(0, dtype=EVENT_DTYPE)
+            # Отсортированные столбцы сжимаются заметно лучше
+            events = events[np.lexsort((events['timestamp_ms'], events['session'], events['meme_id']))]
+
+            path = os.path.join(self.root, f"compact-{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}")
+            # Сначала во временный файл: читатели не должны увидеть недописанный .npz
+            with open(path + '.tmp', 'wb') as f:
+                np.savez_compressed(f, sources=np.array(sources, dtype=str),
+                                    **{name: events[name] for name in EVENT_DTYPE.names})
+            os.replace(path + '.tmp', path + _COMPACT_SUFFIX)
+
+            for segment in segments + merge:
+                os.remove(segment)
+            print(f"Компактизация событий эмоций: {len(events)} событий из {len(segments)} сегментов "
+                  f"и {len(merge)} сжатых файлов.")
+            return len(events)
+
+    def _compacted_sources(self):
+        """Имена сегментов и сжатых файлов, которые уже слиты в существующие .npz."""
+        sources = set()
+        for path in self._files(_COMPACT_SUFFIX):
+            with np.load(path) as data:
+                sources.update(data['sources'].tolist())
+        return sources
+
+    @staticmethod
+    def _from_columns(data):
+        events = np.zeros(len(data['meme_id']), dtype=EVENT_DTYPE)
+        for name in EVENT_DTYPE.names:
+            events[name] = data[name]
+        return events
+
+    @staticmethod
+    def _read_segment(path, mmap=False):
+        # Хвост активного сегмента может быть недописан - берем только целые записи
+        rows = os.path.getsize(path) // EVENT_DTYPE.itemsize
+        if not rows:
+            return np.zeros(0, dtype=EVENT_DTYPE)
+        if mmap:
+            return np.memmap(path, dtype=EVENT_DTYPE, mode='r', shape=(rows,))
+        return np.fromfile(path, dtype=EVENT_DTYPE, count=rows)
+
+    # --- Чтение ---
+
+    def read_chunks(self, chunk_rows=EMOTION_READ_CHUNK):
+        """
+        Все события хранилища кусками до chunk_rows: массивы EVENT_DTYPE.
+        Сжатые файлы читаются по одному, сегменты - через memmap, так что
+        в памяти одновременно не больше одного сжатого файла и одного куска.
+        """
+        compacted, segments = self._snapshot()
+        try:
+            already = set()
+            for _, data in compacted:
+                already.update(data['sources'].tolist())
+            for path, data in compacted:
+                if os.path.basename(path) in already:
+                    continue
+                events = self._from_columns(data)
+                for start in range(0, len(events), chunk_rows):
+                    yield events[start:start + chunk_rows]
+                del events
+
+            for path, events in segments:
+                if os.path.basename(path) in already:
+                    continue
+                for start in range(0, len(events), chunk_rows):
+                    yield np.array(events[start:start + chunk_rows])
+        finally:
+            for _, data in compacted:
+                data.close()
+
+    def _snapshot(self):
+        """
+        Открывает сразу все файлы хранилища: ([(путь, NpzFile)], [(путь, memmap)]).
+        Компактизация (в том числе в другом процессе) удаляет сегменты после
+        записи .npz, поэтому читать файлы по очереди нельзя - между списком
+        сжатых файлов и списком сегментов события могли переехать в новый .npz.
+        Список считается целым, если набор .npz не изменился, пока читались
+        имена сегментов, и все файлы удалось открыть. Открытые файлы остаются
+        читаемыми, даже если компактизация удалит их позже.
+        """
+        while True:
+            with self._compact_lock:
+                compacted = self._files(_COMPACT_SUFFIX)
+                # Сначала активные: сегмент, закрытый между двумя glob, найдется среди закрытых
+                paths = self._files(_ACTIVE_SUFFIX) + self._files(_SEGMENT_SUFFIX)
+                if self._files(_COMPACT_SUFFIX) != compacted:
+                    continue
+            opened = []
+            try:
+                segments = [(path, self._read_segment(path, mmap=True)) for path in paths]
+                for path in compacted:
+                    opened.append((path, np.load(path)))
+                return opened, segments
+            except FileNotFoundError:
+                # Файлы только что слили в новый .npz - составляем список заново
+                for _, data in opened:
+                    data.close()
+
+    def mean_probabilities(self, chunk_rows=EMOTION_READ_CHUNK):
+        """
+        Средние вероятности классов по всем кадрам каждого мема за один проход:
+        (meme_ids, матрица (len(meme_ids), len(EMOTION_LABELS)) float32 в [0, 1]).
+        """
+        sums = np.zeros((0, len(EMOTION_LABELS)), dtype=np.float64)
+        counts = np.zeros(0, dtype=np.int64)
+        for events in self.read_chunks(chunk_rows):
+            if not len(events):
+                continue
+            meme_ids = events['meme_id'].astype(np.int64)
+            size = int(meme_ids.max()) + 1
+            if size > len(counts):
+                # id мемов плотные, поэтому суммы лежат в массиве по id, а не в словаре;
+                # массив растет с запасом, чтобы не копировать его на каждом куске
+                size = max(size, 2 * len(counts))
+                sums = np.vstack([sums, np.zeros((size - len(counts), len(EMOTION_LABELS)))])
+                counts = np.concatenate([counts, np.zeros(size - len(counts), dtype=np.int64)])
+            probabilities = events['probabilities']
+            for column in range(len(EMOTION_LABELS)):
+                sums[:, column] += np.bincount(meme_ids, weights=probabilities[:, column], minlength=len(counts))
+            counts += np.bincount(meme_ids, minlength=len(counts))
+        present = np.flatnonzero(counts)
+        return present, (sums[present] / (255.0 * counts[present, np.newaxis])).astype(np.float32)
+
+    def dominant_emotions(self, priority, chunk_rows=EMOTION_READ_CHUNK):
+        """
+        {meme_id: эмоция} по тому же правилу, что и итоговая реакция
+        в ReactionAggregator: у каждого кадра берется доминирующая эмоция,
+        а мему достается самая "важная" из них по priority ({эмоция: ранг}).
+        Среднее по кадрам здесь не годится: на живой веб-камере почти все
+        кадры нейтральные, и короткая улыбка в среднем теряется.
+        При равных рангах побеждает класс, который раньше в EMOTION_LABELS.
+        """
+        ranks = np.array([priority.get(label, 0) for label in EMOTION_LABELS])
+        # Классы от самого важного к наименее важному (sort стабильный)
+        order = np.argsort(-ranks, kind='stable')
+        places = np.argsort(order)
+        best = np.zeros(0, dtype=np.int64)   # meme_id -> позиция в order + 1 (0 - кадров нет)
+        for events in self.read_chunks(chunk_rows):
+            if not len(events):
+                continue
+            meme_ids = events['meme_id'].astype(np.int64)
+            size = int(meme_ids.max()) + 1
+            if size > len(best):
+                best = np.concatenate([best, np.zeros(max(size, 2 * len(best)) - len(best), dtype=np.int64)])
+            # Место доминирующей эмоции кадра в order: меньше - важнее
+            position = places[events['probabilities'].argmax(axis=1)]
+            for place in range(len(order)):
+                hit = np.bincount(meme_ids[position == place], minlength=len(best)) > 0
+                best = np.where(hit & ((best == 0) | (best > place + 1)), place + 1, best)
+        present = np.flatnonzero(best)
+        return {meme_id: EMOTION_LABELS[order[place - 1]]
+                for meme_id, place in zip(present.tolist(), best[present].tolist())}
+
+    def stats(self):
+        """Файлы и место на диске: для метрик и отладки."""
+        files = {suffix: self._files(suffix) for suffix in (_ACTIVE_SUFFIX, _SEGMENT_SUFFIX, _COMPACT_SUFFIX)}
+        return {
+            'active_segments': len(files[_ACTIVE_SUFFIX]),
+            'sealed_segments': len(files[_SEGMENT_SUFFIX]),
+            'compacted_files': len(files[_COMPACT_SUFFIX]),
+            'bytes': sum(os.path.getsize(path) for paths in files.values() for path in paths),
+        }
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_emotion_store():
+    """Один экземпляр на процесс."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = EmotionEventStore()
+        return _store
@@ -0,0 +1,216 @@
+# src/image_store/store.py
+
+import os
+import io
+import time
+import shutil
+import hashlib
+import threading
+
+from PIL import Image, ImageOps
+
+project_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# --- Конфигурация ---
+IMAGE_STORE_DIR = os.getenv("IMAGE_STORE_DIR", os.path.join(project_root, "data", "images"))
+# Сколько места на диске может занимать кеш картинок (по умолчанию 2 ГБ)
+IMAGE_STORE_MAX_BYTES = int(os.getenv("IMAGE_STORE_MAX_BYTES", str(2 * 1024 ** 3)))
+# Как часто (в секундах) обновлять время последнего доступа к картинке на диске
+IMAGE_STORE_TOUCH_INTERVAL = float(os.getenv("IMAGE_STORE_TOUCH_INTERVAL", "3600"))
+WEBP_QUALITY = int(os.getenv("WEBP_QUALITY", "80"))
+
+# Уменьшенные копии: имя -> ширина в пикселях
+RENDITIONS = {
+    'w720': 720,
+    'w320': 320,
+}
+ORIGINAL = 'original'
+# Метка в каталоге картинки: ее нельзя вытеснять из кеша
+PINNED = '.pinned'
+
+_FORMAT_MIMETYPES = {
+    'JPEG': 'image/jpeg',
+    'PNG': 'image/png',
+    'GIF': 'image/gif',
+    'WEBP': 'image/webp',
+}
+
+
+def _is_digest(value):
+    return len(value) == 64 and all(c in '0123456789abcdef' for c in value)
+
+
+class ImageStore:
+    """
+    Локальный кеш картинок с адресацией по содержимому.
+
+    Картинка лежит в каталоге, названном по sha256 ее байтов, поэтому один
+    и тот же файл из разных источников хранится один раз, а содержимое по
+    адресу никогда не меняется - браузеру можно разрешить кешировать его навсегда.
+    Рядом с оригиналом сразу при парсинге готовятся уменьшенные копии в WebP.
+
+    Размер кеша ограничен: при превышении лимита удаляются картинки,
+    к которым дольше всего не обращались (время доступа - mtime каталога).
+    Закрепленные картинки (pin=True) - единственная копия, например у мемов
+    из VK, где нет исходного url: они не вытесняются и в лимит не считаются.
+    """
+
+    def __init__(self, root=IMAGE_STORE_DIR, max_bytes=IMAGE_STORE_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._touched = {}    # digest -> когда последний раз обновляли mtime
+        self._lock = threading.Lock()
+
+    def _dir(self, digest):
+        return os.path.join(self.root, digest[:2], digest[2:4], digest)
+
+    def has(self, digest):
+        return bool(digest) and os.path.isdir(self._dir(digest))
+
+    def put(self, content, pin=False):
+        """
+        Кладет картинку в кеш и готовит уменьшенные копии. Возвращает digest
+        или None, если Pillow не смог открыть файл. С pin=True картинка
+        закрепляется и evict() ее не удалит.
+        """
+        digest = hashlib.sha256(content).hexdigest()
+        target = self._dir(digest)
+        if os.path.isdir(target):
+            if pin:
+                self._pin(target)
+            self._touch(digest, force=True)
+            if not pin or os.path.isdir(target):
+                return digest
+            # Каталог успел удалить evict() - кладем картинку заново
+
+        try:
+            image = Image.open(io.BytesIO(content))
+            image.load()
+        except Exception as e:
+            print(f"    - Не удалось открыть картинку для кеша: {e}")
+            return None
+
+        # Собираем все файлы во временном каталоге и переименовываем его целиком:
+        # читатель никогда не увидит картинку без части копий
+        tmp = f"{target}.tmp-{os.getpid()}-{threading.get_ident()}"
+        os.makedirs(tmp, exist_ok=True)
+        try:
+            ext = (image.format or 'bin').lower()
+            with open(os.path.join(tmp, f"{ORIGINAL}.{ext}"), 'wb') as f:
+                f.write(content)
+            if pin:
+                self._pin(tmp)
+            # Анимацию не пережимаем - копии отдаются оригиналом
+            if not getattr(image, 'is_animated', False):
+                self._write_renditions(image, tmp)
+            try:
+                os.rename(tmp, target)
+            except OSError:
+                # Ту же картинку параллельно положил другой процесс
+                shutil.rmtree(tmp, ignore_errors=True)
+                if pin:
+                    self._pin(target)
+        except Exception:
+            shutil.rmtree(tmp, ignore_errors=True)
+            raise
+        return digest
+
+    @staticmethod
+    def _pin(directory):
+        try:
+            open(os.path.join(directory, PINNED), 'a').close()
+        except FileNotFoundError:
+            pass
+
+    def _write_renditions(self, image, directory):
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA' if 'transparency' in image.info else 'RGB')
+        for name, width in RENDITIONS.items():
+            copy = image
+            if image.width > width:
+                height = max(1, round(image.height * width / image.width))
+                copy = image.resize((width, height), Image.LANCZOS)
+            copy.save(os.path.join(directory, f"{name}.webp"), 'WEBP', quality=WEBP_QUALITY, method=4)
+
+    def open(self, digest, rendition):
+        """
+        Путь к файлу и его MIME-тип или None, если такой картинки нет.
+        Если уменьшенной копии нет (анимация), отдается оригинал.
+        """
+        if not _is_digest(digest) or (rendition != ORIGINAL and rendition not in RENDITIONS):
+            return None
+        directory = self._dir(digest)
+        if rendition != ORIGINAL:
+            path = os.path.join(directory, f"{rendition}.webp")
+            if os.path.exists(path):
+                self._touch(digest)
+                return path, 'image/webp'
+        try:
+            names = [name for name in os.listdir(directory) if name.startswith(ORIGINAL + '.')]
+        except FileNotFoundError:
+            return None
+        if not names:
+            return None
+        self._touch(digest)
+        ext = names[0].split('.', 1)[1].upper()
+        mimetype = _FORMAT_MIMETYPES.get('JPEG' if ext == 'JPG' else ext, 'application/octet-stream')
+        return os.path.join(directory, names[0]), mimetype
+
+    def _touch(self, digest, force=False):
+        """Отмечает доступ для LRU, но не чаще раза в IMAGE_STORE_TOUCH_INTERVAL."""
+        now = time.time()
+        with self._lock:
+            if not force and now - self._touched.get(digest, 0) < IMAGE_STORE_TOUCH_INTERVAL:
+                return
+            self._touched[digest] = now
+        try:
+            os.utime(self._dir(digest), (now, now))
+        except FileNotFoundError:
+            pass
+
+    def evict(self):
+        """Удаляет давно не использованные картинки, пока кеш не влезет в лимит."""
+        entries = []
+        total = 0
+        for level1 in _scandirs(self.root):
+            for level2 in _scandirs(level1.path):
+                for entry in _scandirs(level2.path):
+                    if not _is_digest(entry.name) or os.path.exists(os.path.join(entry.path, PINNED)):
+                        continue
+                    size = sum(f.stat().st_size for f in os.scandir(entry.path) if f.is_file())
+                    entries.append((entry.stat().st_mtime, size, entry.path))
+                    total += size
+
+        removed = 0
+        if total > self.max_bytes:
+            entries.sort()
+            for _, size, path in entries:
+                if total <= self.max_bytes:
+                    break
+                shutil.rmtree(path, ignore_errors=True)
+                total -= size
+                removed += 1
+        if removed:
+            print(f"Кеш картинок: удалено {removed} старых картинок, занято {total / 1024 ** 2:.0f} МБ.")
+        return removed
+
+
+def _scandirs(path):
+    try:
+        return [entry for entry in os.scandir(path) if entry.is_dir()]
+    except FileNotFoundError:
+        return []
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_image_store():
+    """Один экземпляр на процесс."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = ImageStore()
+        return _store
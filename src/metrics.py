@@ -0,0 +1,496 @@
+# src/metrics.py
+#
+# Счетчики и гистограммы времени для горячих участков кода и их выдача
+# в текстовом формате Prometheus (/metrics в app.py, файл для textfile-коллектора
+# node_exporter в scheduler.py). Своя маленькая реализация вместо prometheus_client:
+# одно измерение - это поиск корзины bisect'ом и инкремент под коротким локом,
+# поэтому метрики можно не выключать под нагрузкой.
+#
+# Несколько процессов (воркеры gunicorn в serve.py) складывают метрики через
+# каталог METRICS_MULTIPROC_DIR, как multiprocess-режим prometheus_client:
+# каждый процесс дублирует свои значения в файл, отображенный в память, а
+# /metrics любого воркера суммирует файлы всех процессов.
+
+import os
+import io
+import sys
+import glob
+import json
+import mmap
+import time
+import uuid
+import random
+import struct
+import cProfile
+import threading
+from bisect import bisect_left
+
+try:
+    import fcntl
+except ImportError:  # Windows: архив метрик завершившихся процессов не блокируется
+    fcntl = None
+from contextlib import contextmanager
+
+# Границы корзин по умолчанию (секунды): от миллисекунды до минуты
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Доля запросов, которые профилируются cProfile (0 - профилирование выключено)
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+# Куда складывать .prof-файлы (смотреть: python -m pstats файл или snakeviz)
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                                    "data", "profiles"))
+
+_ARCHIVE_NAME = 'metrics-archive.json'
+
+
+def _multiprocess_dir():
+    # Читается при использовании, а не при импорте: .env загружает точка входа (load_env)
+    return os.getenv("METRICS_MULTIPROC_DIR", "")
+
+
+def _pid_alive(pid):
+    if pid == os.getpid():
+        return True
+    if sys.platform == 'win32':
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class _ProcessValues:
+    """
+    Значения метрик процесса в файле metrics-<pid>-<id>.bin, отображенном
+    в память: запись значения - struct.pack_into по известному смещению,
+    без системных вызовов. Формат: 8 байт - занятая длина, дальше записи
+    (длина ключа - 4 байта, ключ JSON с пробелами до кратности 8, float64).
+    """
+
+    INITIAL_SIZE = 64 * 1024
+
+    def __init__(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, f"metrics-{os.getpid()}-{uuid.uuid4().hex[:8]}.bin")
+        self._file = open(self.path, 'w+b')
+        self._file.truncate(self.INITIAL_SIZE)
+        self._map = mmap.mmap(self._file.fileno(), self.INITIAL_SIZE)
+        self._used = 8
+        struct.pack_into('<Q', self._map, 0, self._used)
+        self._positions = {}
+        self._lock = threading.Lock()
+
+    def write(self, name, part, key, value):
+        with self._lock:
+            position = self._positions.get((name, part, key))
+            if position is None:
+                position = self._add(name, part, key)
+            struct.pack_into('<d', self._map, position, value)
+
+    def _add(self, name, part, key):
+        encoded = json.dumps([name, part, list(key)], ensure_ascii=False).encode()
+        encoded += b' ' * (-(4 + len(encoded)) % 8)
+        size = 4 + len(encoded) + 8
+        if self._used + size > len(self._map):
+            new_size = max(2 * len(self._map), self._used + size)
+            self._map.close()
+            self._file.truncate(new_size)
+            self._map = mmap.mmap(self._file.fileno(), new_size)
+        struct.pack_into(f'<I{len(encoded)}sd', self._map, self._used, len(encoded), encoded, 0.0)
+        position = self._used + 4 + len(encoded)
+        self._used += size
+        # Длина обновляется последней: читатель не увидит недописанную запись
+        struct.pack_into('<Q', self._map, 0, self._used)
+        self._positions[(name, part, key)] = position
+        return position
+
+
+def _read_values(path):
+    """[(имя метрики, часть, метки, значение)] из файла _ProcessValues."""
+    with open(path, 'rb') as f:
+        data = f.read()
+    if len(data) < 8:
+        return []
+    used = min(struct.unpack_from('<Q', data, 0)[0], len(data))
+    values = []
+    position = 8
+    while position + 4 <= used:
+        length = struct.unpack_from('<I', data, position)[0]
+        name, part, key = json.loads(data[position + 4:position + 4 + length].decode())
+        position += 4 + length
+        values.append((name, part, tuple(key), struct.unpack_from('<d', data, position)[0]))
+        position += 8
+    return values
+
+
+_process_values = None
+_process_values_pid = None
+_process_values_lock = threading.Lock()
+
+
+def _shared_values():
+    """Файл значений текущего процесса или None, если METRICS_MULTIPROC_DIR не задан."""
+    global _process_values, _process_values_pid
+    if _process_values_pid != os.getpid():
+        with _process_values_lock:
+            if _process_values_pid != os.getpid():
+                directory = _multiprocess_dir()
+                _process_values = _ProcessValues(directory) if directory else None
+                _process_values_pid = os.getpid()
+    return _process_values
+
+
+def _share(name, part, key, value):
+    values = _shared_values()
+    if values is not None:
+        values.write(name, part, key, value)
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [(name, value) for name, value in zip(names, values)] + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if len(labels) != len(self.labelnames):
+            raise ValueError(f"{self.name}: нужны метки {self.labelnames}, переданы {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self, out, items=None, labelnames=None):
+        """Свои значения или items (значения, сложенные из файлов процессов)."""
+        out.write(f"# HELP {self.name} {self.documentation}\n# TYPE {self.name} {self.kind}\n")
+        if items is None:
+            with self._lock:
+                items = sorted(self._values.items())
+        self._render_items(out, items, labelnames or self.labelnames)
+
+    def _reset(self):
+        # После fork: значения родителя уже лежат в его файле
+        self._values = {}
+        self._lock = threading.Lock()
+
+
+class Counter(_Metric):
+    """Монотонно растущий счетчик (число событий, байты)."""
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            value = self._values[key] = self._values.get(key, 0) + amount
+            _share(self.name, '', key, value)
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def _render_items(self, out, items, labelnames):
+        for key, value in items:
+            out.write(f"{self.name}{_format_labels(labelnames, key)} {_format_value(value)}\n")
+
+
+class Gauge(_Metric):
+    """Текущее значение (длина очереди, число готовых воркеров)."""
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+            _share(self.name, '', key, value)
+
+    def _render_items(self, out, items, labelnames):
+        for key, value in items:
+            out.write(f"{self.name}{_format_labels(labelnames, key)} {_format_value(value)}\n")
+
+
+class Histogram(_Metric):
+    """Распределение длительностей (или размеров) по корзинам."""
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # [счетчики корзин (последняя - +Inf), сумма, количество]
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+            _share(self.name, index, key, state[0][index])
+            _share(self.name, 'sum', key, state[1])
+            _share(self.name, 'count', key, state[2])
+
+    @contextmanager
+    def time(self, **labels):
+        """with histogram.time(stage='...'): ... - замер длительности блока."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def count(self, **labels):
+        with self._lock:
+            state = self._values.get(self._key(labels))
+            return state[2] if state else 0
+
+    def _render_items(self, out, items, labelnames):
+        for key, (bucket_counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), bucket_counts):
+                cumulative += bucket_count
+                labels = _format_labels(labelnames, key, [('le', _format_value(float(bound)))])
+                out.write(f"{self.name}_bucket{labels} {cumulative}\n")
+            labels = _format_labels(labelnames, key)
+            out.write(f"{self.name}_sum{labels} {_format_value(total)}\n")
+            out.write(f"{self.name}_count{labels} {count}\n")
+
+
+class Registry:
+    """Все метрики процесса. Повторная регистрация с тем же именем возвращает ту же метрику."""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, cls, name, documentation, labelnames, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, documentation, labelnames, **kwargs)
+            elif not isinstance(metric, cls) or metric.labelnames != tuple(labelnames):
+                raise ValueError(f"Метрика {name} уже зарегистрирована с другим типом или метками")
+            return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._get_or_create(Counter, name, documentation, labelnames)
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._get_or_create(Gauge, name, documentation, labelnames)
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._get_or_create(Histogram, name, documentation, labelnames, buckets=buckets)
+
+    def render(self):
+        """
+        Все метрики в текстовом формате Prometheus. С METRICS_MULTIPROC_DIR -
+        сумма по всем процессам: счетчики и гистограммы складываются (в том
+        числе завершившихся воркеров), а значения gauge показываются по
+        живым процессам с меткой pid.
+        """
+        out = io.StringIO()
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda metric: metric.name)
+        directory = _multiprocess_dir()
+        if not directory:
+            for metric in metrics:
+                metric.render(out)
+            return out.getvalue()
+
+        _shared_values()  # файл этого процесса должен быть среди прочитанных
+        merged = self._collect(directory)
+        for metric in metrics:
+            states = merged.get(metric.name, {})
+            if isinstance(metric, Histogram):
+                items = []
+                for key, parts in sorted(states.items()):
+                    buckets = [int(parts.get(index, 0)) for index in range(len(metric.buckets) + 1)]
+                    items.append((key, (buckets, parts.get('sum', 0.0), int(parts.get('count', 0)))))
+                metric.render(out, items)
+            else:
+                items = sorted((key, int(parts['']) if parts[''].is_integer() else parts[''])
+                               for key, parts in states.items())
+                labelnames = metric.labelnames + ('pid',) if isinstance(metric, Gauge) else None
+                metric.render(out, items, labelnames)
+        return out.getvalue()
+
+    def _collect(self, directory):
+        """{имя: {метки: {часть: значение}}} по файлам всех процессов."""
+        with self._lock:
+            kinds = {name: metric.kind for name, metric in self._metrics.items()}
+        merged = {}
+
+        def add(name, part, key, value):
+            parts = merged.setdefault(name, {}).setdefault(key, {})
+            parts[part] = parts.get(part, 0) + value
+
+        # Под блокировкой каталога: другой воркер не перенесет файл в архив,
+        # пока этот его читает
+        with open(os.path.join(directory, '.lock'), 'a') as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                for name, part, key, value in self._archive_dead(directory, kinds):
+                    add(name, part, tuple(key), value)
+                for path in glob.glob(os.path.join(directory, "metrics-*.bin")):
+                    pid = int(os.path.basename(path).split('-')[1])
+                    for name, part, key, value in _read_values(path):
+                        if kinds.get(name) != 'gauge':
+                            add(name, part, key, value)
+                        elif _pid_alive(pid):
+                            add(name, part, key + (str(pid),), value)
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+        return merged
+
+    @staticmethod
+    def _archive_dead(directory, kinds):
+        """
+        Сливает счетчики и гистограммы завершившихся процессов в metrics-archive.json
+        и удаляет их файлы, чтобы после перезапусков воркеров каталог не рос.
+        Возвращает значения архива. Как и в хранилище событий эмоций, в архиве
+        записаны имена слитых файлов: если процесс упал между записью архива
+        и удалением файлов, они не посчитаются дважды.
+        """
+        archive_path = os.path.join(directory, _ARCHIVE_NAME)
+        try:
+            with open(archive_path, encoding='utf-8') as f:
+                archive = json.load(f)
+        except FileNotFoundError:
+            archive = {'sources': [], 'values': []}
+
+        merged = [os.path.join(directory, name) for name in archive['sources']]
+        dead = [path for path in glob.glob(os.path.join(directory, "metrics-*.bin"))
+                if os.path.basename(path) not in archive['sources']
+                and not _pid_alive(int(os.path.basename(path).split('-')[1]))]
+        if not dead and not merged:
+            return archive['values']
+
+        totals = {(name, part, tuple(key)): value for name, part, key, value in archive['values']}
+        for path in dead:
+            for name, part, key, value in _read_values(path):
+                if kinds.get(name) != 'gauge':
+                    totals[(name, part, key)] = totals.get((name, part, key), 0) + value
+        values = [[name, part, list(key), value] for (name, part, key), value in totals.items()]
+
+        def write(sources):
+            tmp_path = f"{archive_path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({'sources': sources, 'values': values}, f, ensure_ascii=False)
+            os.replace(tmp_path, archive_path)
+
+        if dead:
+            write(sorted(archive['sources'] + [os.path.basename(path) for path in dead]))
+        for path in merged + dead:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        write([])
+        return values
+
+    def _after_fork_in_child(self):
+        global _process_values_lock
+        self._lock = threading.Lock()
+        _process_values_lock = threading.Lock()
+        if _multiprocess_dir():
+            for metric in self._metrics.values():
+                metric._reset()
+
+    def write_textfile(self, path):
+        """Пишет метрики в файл атомарно (для textfile-коллектора node_exporter)."""
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(self.render())
+        os.replace(tmp_path, path)
+
+
+REGISTRY = Registry()
+
+if hasattr(os, 'register_at_fork'):
+    # Воркеры serve.py форкаются от мастера: свои значения они пишут в свой файл
+    os.register_at_fork(after_in_child=REGISTRY._after_fork_in_child)
+
+# Content-Type текстового формата Prometheus
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# --- Общие метрики горячих участков ---
+# Этапы внутри запросов и фоновых задач: analyze.decode, queue.score, train...
+STAGE_SECONDS = REGISTRY.histogram(
+    'memepulse_stage_seconds', 'Длительность этапов обработки', ['stage'])
+DOWNLOAD_SECONDS = REGISTRY.histogram(
+    'memepulse_download_seconds', 'Время скачивания одного файла парсером', ['host'])
+DOWNLOAD_BYTES = REGISTRY.counter(
+    'memepulse_download_bytes_total', 'Скачано байт парсерами', ['host'])
+
+
+def timed(stage):
+    """with timed('analyze.decode'): ... - замер этапа в memepulse_stage_seconds."""
+    return STAGE_SECONDS.time(stage=stage)
+
+
+class RequestProfiler:
+    """
+    Выборочное профилирование запросов cProfile: профилируется примерно
+    sample_rate запросов, результат пишется в out_dir/<время>-<имя>.prof.
+    cProfile не умеет профилировать два потока сразу, поэтому одновременно
+    профилируется не больше одного запроса - остальные просто пропускаются.
+    """
+
+    def __init__(self, sample_rate=PROFILE_SAMPLE_RATE, out_dir=PROFILE_DIR):
+        self.sample_rate = sample_rate
+        self.out_dir = out_dir
+        self._busy = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.sample_rate > 0
+
+    def start(self):
+        """Профайлер, если этот запрос попал в выборку, иначе None."""
+        if not self.enabled or random.random() >= self.sample_rate:
+            return None
+        if not self._busy.acquire(blocking=False):
+            return None
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Профилировщик уже запущен кем-то еще (например, отладчиком)
+            self._busy.release()
+            return None
+        return profile
+
+    def finish(self, profile, name):
+        if profile is None:
+            return
+        try:
+            profile.disable()
+            os.makedirs(self.out_dir, exist_ok=True)
+            safe_name = ''.join(c if c.isalnum() or c in '-_.' else '_' for c in name)
+            now = time.time()
+            stamp = f"{time.strftime('%Y%m%d-%H%M%S', time.localtime(now))}.{int(now * 1000) % 1000:03d}"
+            profile.dump_stats(os.path.join(self.out_dir, f"{stamp}-{os.getpid()}-{safe_name}.prof"))
+        finally:
+            self._busy.release()
@@ -0,0 +1,42 @@
+# src/parsers/cursors.py
+
+import datetime
+from collections import namedtuple
+
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from src.database.models import SourceCursor
+
+# Снимок курсора источника. Поля - как в таблице source_cursors;
+# у источника, который еще ни разу не читали, все, кроме source, пустые
+Cursor = namedtuple('Cursor', ['source', 'last_item_id', 'last_item_at', 'external_id'])
+
+# Что возвращает fetch() парсера с курсором: кандидаты и курсор после них
+FetchResult = namedtuple('FetchResult', ['candidates', 'cursor'])
+
+
+def load_cursor(session_factory, source):
+    session = session_factory()
+    try:
+        row = session.get(SourceCursor, source)
+        if row is None:
+            return Cursor(source, None, None, None)
+        return Cursor(source, row.last_item_id, row.last_item_at, row.external_id)
+    finally:
+        session.close()
+
+
+def save_cursor(session_factory, cursor):
+    """Записывает курсор (вставка или обновление одним запросом)."""
+    values = dict(cursor._asdict(), updated_at=datetime.datetime.utcnow())
+    stmt = sqlite_insert(SourceCursor.__table__).values(**values)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['source'],
+        set_={name: stmt.excluded[name] for name in values if name != 'source'},
+    )
+    session = session_factory()
+    try:
+        session.execute(stmt)
+        session.commit()
+    finally:
+        session.close()
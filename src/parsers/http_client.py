@@ -0,0 +1,98 @@
+# src/parsers/http_client.py
+
+import os
+import time
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from src.metrics import DOWNLOAD_BYTES, DOWNLOAD_SECONDS
+
+# --- Конфигурация HTTP-клиента парсеров ---
+# Сколько одновременных запросов разрешено к одному хосту
+HTTP_PER_HOST_LIMIT = int(os.getenv("HTTP_PER_HOST_LIMIT", "4"))
+# Размер пула соединений на хост
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "16"))
+# Таймауты в секундах: на установку соединения и на чтение ответа
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "20"))
+# Повторы с экспоненциальной паузой: 0.5, 1, 2... секунды
+HTTP_RETRIES = int(os.getenv("HTTP_RETRIES", "3"))
+HTTP_BACKOFF = float(os.getenv("HTTP_BACKOFF", "0.5"))
+
+
+class HttpClient:
+    """
+    Общий HTTP-клиент для парсеров: один пул keep-alive соединений,
+    таймауты, повторы с backoff и ограничение параллельных запросов на хост.
+    Потокобезопасен - его можно звать из нескольких потоков парсинга сразу.
+    """
+
+    def __init__(self, per_host_limit=HTTP_PER_HOST_LIMIT, pool_size=HTTP_POOL_SIZE,
+                 retries=HTTP_RETRIES, backoff=HTTP_BACKOFF,
+                 timeout=(HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT)):
+        self.timeout = timeout
+        self.session = requests.Session()
+        retry = Retry(
+            total=retries,
+            backoff_factor=backoff,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=frozenset({'GET', 'POST'}),
+            respect_retry_after_header=True,
+        )
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self._per_host_limit = max(1, per_host_limit)
+        self._host_slots = defaultdict(lambda: threading.BoundedSemaphore(self._per_host_limit))
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def _host_slot(self, url):
+        host = urlsplit(url).netloc
+        with self._lock:
+            slot = self._host_slots[host]
+        with slot:
+            yield
+
+    def get(self, url, **kwargs):
+        """GET с лимитом на хост; при статусе 4xx/5xx бросает исключение."""
+        kwargs.setdefault('timeout', self.timeout)
+        with self._host_slot(url):
+            response = self.session.get(url, **kwargs)
+        response.raise_for_status()
+        return response
+
+    def get_json(self, url, **kwargs):
+        return self.get(url, **kwargs).json()
+
+    def download(self, url):
+        """Скачивает файл целиком и возвращает его байты."""
+        host = urlsplit(url).netloc
+        started = time.perf_counter()
+        content = self.get(url).content
+        DOWNLOAD_SECONDS.observe(time.perf_counter() - started, host=host)
+        DOWNLOAD_BYTES.inc(len(content), host=host)
+        return content
+
+    def close(self):
+        self.session.close()
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_http_client():
+    """Один клиент (и один пул соединений) на процесс."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = HttpClient()
+        return _client
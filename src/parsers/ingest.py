@@ -0,0 +1,205 @@
+# src/parsers/ingest.py
+
+import os
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from src.database.models import Meme
+from src.database.repository import existing_urls, meme_ids_by_url
+from src.dedup.index import get_phash_index
+from src.dedup.phash import decode_image, dhash_image, hamming, to_signed
+from src.image_store.store import get_image_store
+from src.metrics import REGISTRY
+from src.recommender.embeddings import get_embedding_store, image_embedding
+
+# Сколько источников (сабреддитов, групп VK) опрашивается одновременно
+PARSER_MAX_WORKERS = int(os.getenv("PARSER_MAX_WORKERS", "8"))
+# Сколько картинок скачивается одновременно (поверх лимита на хост в HttpClient)
+DOWNLOAD_MAX_WORKERS = int(os.getenv("DOWNLOAD_MAX_WORKERS", "8"))
+
+# Итог сохранения одного источника
+IngestStats = namedtuple('IngestStats', ['inserted', 'skipped', 'duplicates'])
+
+PARSE_SECONDS = REGISTRY.histogram(
+    'memepulse_parse_seconds', 'Время опроса источника (fetch) и записи его мемов (save)', ['source', 'step'])
+PARSE_MEMES = REGISTRY.counter(
+    'memepulse_parse_memes_total', 'Мемы из источников: inserted, skipped, duplicates', ['source', 'result'])
+PARSE_ERRORS = REGISTRY.counter(
+    'memepulse_parse_errors_total', 'Ошибки опроса и записи источников', ['source', 'step'])
+
+
+class IngestTask:
+    """
+    Один источник для параллельного парсинга.
+    fetch() ходит только в сеть и возвращает кандидатов (у парсеров с курсором -
+    FetchResult из src.parsers.cursors), save(результат fetch) пишет их в базу
+    и возвращает IngestStats.
+    """
+
+    def __init__(self, label, fetch, save):
+        self.label = label
+        self.fetch = fetch
+        self.save = save
+
+
+def run_ingestion(tasks, max_workers=PARSER_MAX_WORKERS):
+    """
+    Опрашивает все источники параллельно в пуле потоков. Запись в базу
+    идет в вызывающем потоке по мере готовности источников: SQLite все равно
+    пускает только одного писателя, а так не нужно делить сессии между потоками.
+    Возвращает {label: IngestStats}.
+    """
+    results = {}
+    if not tasks:
+        return results
+
+    def timed_fetch(task):
+        with PARSE_SECONDS.time(source=task.label, step='fetch'):
+            return task.fetch()
+
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='ingest') as pool:
+        futures = {pool.submit(timed_fetch, task): task for task in tasks}
+        for future in as_completed(futures):
+            task = futures[future]
+            try:
+                candidates = future.result()
+            except Exception as e:
+                PARSE_ERRORS.inc(source=task.label, step='fetch')
+                print(f"Не удалось получить мемы из {task.label}. Ошибка: {e}")
+                continue
+            try:
+                with PARSE_SECONDS.time(source=task.label, step='save'):
+                    stats = results[task.label] = task.save(candidates)
+            except Exception as e:
+                PARSE_ERRORS.inc(source=task.label, step='save')
+                print(f"Не удалось сохранить мемы из {task.label}. Ошибка: {e}")
+                continue
+            for result, count in stats._asdict().items():
+                PARSE_MEMES.inc(count, source=task.label, result=result)
+
+    print(f"Параллельный парсинг {len(tasks)} источников занял {time.monotonic() - started:.1f} c.")
+    get_image_store().evict()
+    return results
+
+
+def download_all(http, candidates, max_workers=DOWNLOAD_MAX_WORKERS):
+    """
+    Параллельно скачивает candidate['image_url'] в candidate['content']
+    и считает признаки картинки: candidate['phash'] и candidate['embedding'].
+    Кандидаты, которые скачать не удалось, выбрасываются из списка.
+    """
+    def download(candidate):
+        try:
+            candidate['content'] = http.download(candidate['image_url'])
+            image = decode_image(candidate['content'])
+            candidate['phash'] = dhash_image(image)
+            candidate['embedding'] = image_embedding(image)
+            return candidate
+        except Exception as e:
+            print(f"    - Ошибка скачивания {candidate['image_url']}: {e}")
+            return None
+
+    if not candidates:
+        return []
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='download') as pool:
+        return [c for c in pool.map(download, candidates) if c is not None]
+
+
+def bulk_insert_memes(session, rows):
+    """
+    Вставляет все мемы одним INSERT ... ON CONFLICT(url) DO NOTHING.
+    Если кто-то успел добавить тот же url между проверкой и вставкой,
+    строка просто пропускается. Возвращает число реально вставленных строк.
+    """
+    if not rows:
+        return 0
+    stmt = sqlite_insert(Meme.__table__).on_conflict_do_nothing(index_elements=['url'])
+    result = session.execute(stmt, [
+        {'title': row['title'], 'url': row['url'], 'source': row['source'],
+         'phash': to_signed(row.get('phash')), 'image_digest': row.get('image_digest')}
+        for row in rows
+    ])
+    return max(result.rowcount, 0)
+
+
+def store_images(candidates, max_workers=DOWNLOAD_MAX_WORKERS):
+    """
+    Кладет скачанные картинки в кеш и готовит их уменьшенные копии
+    (параллельно: Pillow отпускает GIL при ресайзе и кодировании).
+    Записывает candidate['image_digest'] и освобождает байты картинки.
+    Если в url не ссылка, а имя файла (VK), картинке больше неоткуда
+    взяться, поэтому в кеше она закрепляется.
+    """
+    store = get_image_store()
+
+    def put(candidate):
+        content = candidate.pop('content', None)
+        if content is not None:
+            candidate['image_digest'] = store.put(content, pin=not candidate['url'].startswith('http'))
+
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='renditions') as pool:
+        list(pool.map(put, candidates))
+
+
+def _store_embeddings(session, candidates):
+    """Эмбеддинги пишутся по id мема, поэтому - после вставки, одним запросом за id."""
+    embeddings = {c['url']: c['embedding'] for c in candidates if c.get('embedding') is not None}
+    if not embeddings:
+        return
+    ids = meme_ids_by_url(session, embeddings)
+    get_embedding_store().write(list(ids.values()), [embeddings[url] for url in ids])
+
+
+def _drop_near_duplicates(index, candidates):
+    """Отсеивает картинки, похожие на уже известные или на соседей по пачке."""
+    accepted = []
+    accepted_hashes = []
+    for candidate in candidates:
+        phash = candidate.get('phash')
+        if phash is not None:
+            if index.find(phash) is not None:
+                continue
+            if any(hamming(phash, other) <= index.max_distance for other in accepted_hashes):
+                continue
+            accepted_hashes.append(phash)
+        accepted.append(candidate)
+    return accepted
+
+
+def save_candidates(session_factory, candidates):
+    """
+    Общий путь записи для всех парсеров: дубли внутри пачки схлопываются,
+    уже известные url отсекаются одним запросом, почти-дубликаты по
+    перцептивному хешу - через индекс. Картинки новых мемов кладутся
+    в кеш, а сами мемы вставляются одним INSERT.
+    Кандидаты с known=True парсер уже отсеял сам - они считаются пропущенными.
+    """
+    unique = {}
+    for candidate in candidates:
+        if not candidate.get('known'):
+            unique.setdefault(candidate['url'], candidate)
+
+    session = session_factory()
+    try:
+        known = existing_urls(session, unique)
+        new_candidates = [c for url, c in unique.items() if url not in known]
+        index = get_phash_index(session)
+        distinct = _drop_near_duplicates(index, new_candidates)
+        duplicates = len(new_candidates) - len(distinct)
+        new_candidates = distinct
+        store_images(new_candidates)
+        # Мем без картинки показать нельзя - такие строки не вставляем
+        new_candidates = [c for c in new_candidates if c.get('image_digest')]
+        inserted = bulk_insert_memes(session, new_candidates)
+        session.commit()
+        _store_embeddings(session, new_candidates)
+        if index.sync(session):
+            index.save()
+    finally:
+        session.close()
+
+    return IngestStats(inserted=inserted, skipped=len(candidates) - inserted, duplicates=duplicates)
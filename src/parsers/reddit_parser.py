@@ -1,84 +1,148 @@
 # src/parsers/reddit_parser.py
 
 import os
-import sys
-import praw
-from dotenv import load_dotenv
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
-
-# --- ВОТ ГЛАВНОЕ ИСПРАВЛЕНИЕ ---
-# Это "объясняет" Python, где искать другие наши файлы (например, models.py)
-# Мы добавляем корневую папку проекта в путь поиска модулей
-project_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-sys.path.append(project_root)
-
-# --- ЯВНО УКАЗЫВАЕМ ПУТЬ К .ENV ФАЙЛУ ---
-load_dotenv(os.path.join(project_root, '.env'))
-
-# Теперь, после настройки пути, можно импортировать как обычно
-from src.database.models import Meme
-
-# --- Настройка подключения к БД ---
-# Путь к БД теперь строится относительно корневой папки проекта
-DB_PATH = os.path.join(project_root, "memes.db")
-engine = create_engine(f"sqlite:///{DB_PATH}")
-Session = sessionmaker(bind=engine)
-session = Session()
-
-# --- Загрузка ключей API ---
-load_dotenv(os.path.join(project_root, '.env')) # Указываем путь к .env
-REDDIT_CLIENT_ID = os.getenv("REDDIT_CLIENT_ID")
-REDDIT_CLIENT_SECRET = os.getenv("REDDIT_CLIENT_SECRET")
-REDDIT_USER_AGENT = os.getenv("REDDIT_USER_AGENT")
+import datetime
+from functools import partial
+
+from src.config import load_env
+from src.database.engine import get_session_factory
+from src.database.repository import existing_urls
+from src.parsers.cursors import Cursor, FetchResult, load_cursor, save_cursor
+from src.parsers.http_client import get_http_client
+from src.parsers.ingest import IngestTask, run_ingestion, download_all, save_candidates
+
+# --- Ключи API ---
+# Читаются при использовании, а не при импорте: .env загружает точка входа (load_env)
+REDDIT_CREDENTIALS = ("REDDIT_CLIENT_ID", "REDDIT_CLIENT_SECRET", "REDDIT_USER_AGENT")
+
+IMAGE_EXTENSIONS = ('jpg', 'jpeg', 'png', 'gif')
+# Сколько новых постов сабреддита читать за один запуск, если курсор далеко позади
+REDDIT_MAX_NEW_POSTS = int(os.getenv("REDDIT_MAX_NEW_POSTS", "300"))
+
+
+def _connect():
+    """
+    Новый клиент PRAW. Экземпляр praw.Reddit не потокобезопасен,
+    поэтому у каждого параллельно обрабатываемого сабреддита он свой.
+    """
+    import praw
+
+    config = {}
+    # Адреса API можно переопределить (например, на локальную заглушку для тестов)
+    if os.getenv("REDDIT_OAUTH_URL"):
+        config['oauth_url'] = os.getenv("REDDIT_OAUTH_URL")
+    if os.getenv("REDDIT_URL"):
+        config['reddit_url'] = os.getenv("REDDIT_URL")
+    return praw.Reddit(
+        client_id=os.getenv("REDDIT_CLIENT_ID"),
+        client_secret=os.getenv("REDDIT_CLIENT_SECRET"),
+        user_agent=os.getenv("REDDIT_USER_AGENT"),
+        read_only=True, # Работаем в режиме "только чтение"
+        **config
+    )
+
+
+def read_new_posts(subreddit, cursor, limit_per_subreddit=10):
+    """
+    Без курсора (первый запуск) - limit_per_subreddit * 2 постов из "горячих",
+    как и раньше: в ленту попадают популярные мемы. Дальше - посты из "новых"
+    новее курсора, от новых к старым, чтобы не пропустить ничего между
+    запусками. PRAW подгружает ленту страницами по 100 постов, и чтение
+    прекращается на первом уже прочитанном посте - лишние страницы не запрашиваются.
+    """
+    if cursor.last_item_id is None:
+        return list(subreddit.hot(limit=limit_per_subreddit * 2))
+
+    posts = []
+    for post in subreddit.new(limit=REDDIT_MAX_NEW_POSTS):
+        # Пост курсора могли удалить - тогда останавливаемся по времени
+        if post.name == cursor.last_item_id or (
+                cursor.last_item_at is not None and _created_at(post) < cursor.last_item_at):
+            return posts
+        posts.append(post)
+    if len(posts) >= REDDIT_MAX_NEW_POSTS:
+        print(f"  - r/{subreddit.display_name}: больше {REDDIT_MAX_NEW_POSTS} новых постов, остальные пропускаю")
+    return posts
+
+
+def _created_at(post):
+    return datetime.datetime.utcfromtimestamp(post.created_utc)
+
+
+def fetch_subreddit_posts(sub_name, limit_per_subreddit=10):
+    """
+    Возвращает FetchResult: кандидатов-картинки из постов сабреддита новее
+    его курсора и новый курсор. Новые картинки скачиваются: по ним считается
+    перцептивный хеш (один и тот же мем часто лежит в нескольких сабреддитах
+    под разными ссылками) и готовятся уменьшенные копии, чтобы страница
+    не зависела от i.redd.it.
+    """
+    print(f"\n--- Обрабатываю r/{sub_name} ---")
+    cursor = load_cursor(get_session_factory(), f"r/{sub_name}")
+    posts = read_new_posts(_connect().subreddit(sub_name), cursor, limit_per_subreddit)
+    if posts:
+        # "Горячие" не упорядочены по времени, поэтому курсор - на самом новом посте
+        newest = max(posts, key=lambda post: post.created_utc)
+        cursor = Cursor(cursor.source, newest.name, _created_at(newest), None)
+
+    candidates = []
+    for post in posts:
+        if not post.stickied and post.url.endswith(IMAGE_EXTENSIONS):
+            candidates.append({'title': post.title, 'url': post.url, 'source': sub_name, 'image_url': post.url})
+
+    session = get_session_factory()()
+    try:
+        known = existing_urls(session, [c['url'] for c in candidates])
+    finally:
+        session.close()
+    for candidate in candidates:
+        candidate['known'] = candidate['url'] in known
+
+    new_candidates = download_all(get_http_client(), [c for c in candidates if not c['known']])
+    return FetchResult([c for c in candidates if c['known']] + new_candidates, cursor)
+
+
+def save_memes(result):
+    """
+    Сохраняет новых кандидатов в базу одной пачкой и возвращает IngestStats.
+    Курсор сдвигается только после записи: если она упала, посты прочитаются снова.
+    """
+    candidates, cursor = result
+    # Сохраняем пачкой после каждого сабреддита
+    stats = save_candidates(get_session_factory(), candidates)
+    save_cursor(get_session_factory(), cursor)
+    if candidates:
+        print(f"  [+] r/{candidates[0]['source']}: добавлено {stats.inserted}, пропущено {stats.skipped} "
+              f"(из них похожих на известные: {stats.duplicates})")
+    return stats
+
+
+def make_tasks(subreddit_names, limit_per_subreddit=10):
+    """Задачи для параллельного парсинга: по одной на сабреддит."""
+    if not all(os.getenv(name) for name in REDDIT_CREDENTIALS):
+        print("Ошибка: Не найдены ключи API Reddit в .env файле.")
+        return []
+
+    return [
+        IngestTask(f"r/{sub_name}", partial(fetch_subreddit_posts, sub_name, limit_per_subreddit), save_memes)
+        for sub_name in subreddit_names
+    ]
+
 
 def fetch_and_save_memes(subreddit_names, limit_per_subreddit=10):
     """
     Получает мемы и СОХРАНЯЕТ их в базу данных.
+    Сабреддиты опрашиваются параллельно.
     """
-    if not all([REDDIT_CLIENT_ID, REDDIT_CLIENT_SECRET, REDDIT_USER_AGENT]):
-        print("Ошибка: Не найдены ключи API Reddit в .env файле.")
+    load_env()
+    tasks = make_tasks(subreddit_names, limit_per_subreddit)
+    if not tasks:
         return
 
     print("Подключаюсь к Reddit API...")
-    try:
-        reddit = praw.Reddit(
-            client_id=REDDIT_CLIENT_ID,
-            client_secret=REDDIT_CLIENT_SECRET,
-            user_agent=REDDIT_USER_AGENT,
-            read_only=True # Работаем в режиме "только чтение"
-        )
-        
-        new_memes_count = 0
-        for sub_name in subreddit_names:
-            try:
-                print(f"\n--- Обрабатываю r/{sub_name} ---")
-                subreddit = reddit.subreddit(sub_name)
-                
-                for post in subreddit.hot(limit=limit_per_subreddit * 2):
-                    if not post.stickied and post.url.endswith(('jpg', 'jpeg', 'png', 'gif')):
-                        existing_meme = session.query(Meme).filter_by(url=post.url).first()
-                        
-                        if not existing_meme:
-                            new_meme = Meme(
-                                title=post.title,
-                                url=post.url,
-                                source=sub_name
-                            )
-                            session.add(new_meme)
-                            new_memes_count += 1
-                            print(f"  [+] Добавлен новый мем: {post.title[:50]}...")
-                
-                # Сохраняем пачкой после каждого сабреддита
-                session.commit()
-
-            except Exception as e:
-                print(f"Не удалось обработать r/{sub_name}. Ошибка: {e}")
-
-        print(f"\n--- ГОТОВО! Всего добавлено {new_memes_count} новых мемов в базу. ---")
-
-    except Exception as e:
-        print(f"Критическая ошибка при подключении к Reddit: {e}")
+    results = run_ingestion(tasks)
+    inserted = sum(stats.inserted for stats in results.values())
+    print(f"\n--- ГОТОВО! Всего добавлено {inserted} новых мемов в базу. ---")
 
 # Блок для ручного тестирования
 if __name__ == "__main__":
@@ -1,96 +1,176 @@
 # src/parsers/vk_parser.py 
 
 import os
-import sys
-import requests
-from dotenv import load_dotenv
-import vk_api
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+import datetime
+from functools import partial
 
-# --- Настройка путей ---
-project_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-sys.path.append(project_root)
+from src.config import load_env
+from src.database.engine import get_session_factory
+from src.database.repository import existing_urls
+from src.parsers.cursors import Cursor, FetchResult, load_cursor, save_cursor
+from src.parsers.http_client import get_http_client
+from src.parsers.ingest import IngestTask, run_ingestion, download_all, save_candidates
 
-# --- ЯВНО УКАЗЫВАЕМ ПУТЬ К .ENV ФАЙЛУ ---
-load_dotenv(os.path.join(project_root, '.env'))
+# --- Конфигурация ---
+# Токен и адреса читаются при использовании, а не при импорте:
+# .env загружает точка входа (load_env), и к этому моменту модуль уже может быть импортирован
+DEFAULT_VK_API_URL = "https://api.vk.com"
+DEFAULT_VK_API_VERSION = "5.131"
+# Сколько постов wall.get отдает за раз (максимум API)
+VK_WALL_PAGE_SIZE = 100
+# Сколько новых постов группы читать за один запуск, если курсор далеко позади
+VK_MAX_NEW_POSTS = int(os.getenv("VK_MAX_NEW_POSTS", "300"))
 
-# Создаем путь к папке для сохранения изображений
-IMAGES_DIR = os.path.join(project_root, 'static', 'images')
-os.makedirs(IMAGES_DIR, exist_ok=True) # Создаем папку, если ее нет
 
-from src.database.models import Meme
+class VkApiError(Exception):
+    """Ошибка, которую вернул сам API VK (в теле ответа, а не HTTP-статусом)."""
 
-# --- Конфигурация ---
-DB_PATH = os.path.join(project_root, "memes.db")
-VK_ACCESS_TOKEN = os.getenv("VK_ACCESS_TOKEN")
 
-engine = create_engine(f"sqlite:///{DB_PATH}")
-Session = sessionmaker(bind=engine)
+class VkApiClient:
+    """
+    Минимальный клиент API VK поверх общего HTTP-клиента парсеров:
+    keep-alive соединения, таймауты и повторы вместо отдельной сессии vk_api.
+    """
 
-def fetch_and_save_vk_memes(group_ids, count=20):
-    if not VK_ACCESS_TOKEN:
+    def __init__(self, http, token=None, api_url=None, version=None):
+        self.http = http
+        self.token = token or os.getenv("VK_ACCESS_TOKEN")
+        # Адрес API можно переопределить (например, на локальную заглушку для тестов)
+        self.api_url = (api_url or os.getenv("VK_API_URL", DEFAULT_VK_API_URL)).rstrip('/')
+        self.version = version or os.getenv("VK_API_VERSION", DEFAULT_VK_API_VERSION)
+
+    def call(self, method, **params):
+        params.update(access_token=self.token, v=self.version)
+        data = self.http.get_json(f"{self.api_url}/method/{method}", params=params)
+        if 'error' in data:
+            raise VkApiError(data['error'].get('error_msg', data['error']))
+        return data['response']
+
+    def resolve_owner_id(self, group_id):
+        """Короткое имя группы -> owner_id для wall.get (со знаком минус)."""
+        response = self.call('groups.getById', group_id=group_id)
+        # Новые версии API заворачивают список в {'groups': [...]}
+        groups = response['groups'] if isinstance(response, dict) else response
+        return f"-{groups[0]['id']}"
+
+
+def read_new_posts(vk, owner_id, last_post_id, count=20):
+    """
+    Посты стены новее last_post_id, от новых к старым. Страницы читаются
+    по смещению (offset), пока не встретится уже прочитанный пост.
+    Без курсора (первый запуск) - только count последних постов.
+    Закрепленный пост стоит первым независимо от даты, поэтому пропускается.
+    """
+    page_size = count if last_post_id is None else VK_WALL_PAGE_SIZE
+    posts = []
+    offset = 0
+    while True:
+        items = vk.call('wall.get', owner_id=owner_id, count=page_size, offset=offset)['items']
+        for post in items:
+            if post.get('is_pinned'):
+                continue
+            if last_post_id is not None and post['id'] <= last_post_id:
+                return posts  # дальше - уже прочитанный хвост стены
+            posts.append(post)
+        offset += len(items)
+        if last_post_id is None or len(items) < page_size:
+            return posts
+        if len(posts) >= VK_MAX_NEW_POSTS:
+            print(f"  - {owner_id}: больше {VK_MAX_NEW_POSTS} новых постов, остальные пропускаю")
+            return posts
+
+
+def fetch_group_posts(vk, http, group_id, count=20):
+    """
+    Только сеть: новые посты стены (новее курсора группы) и скачивание их картинок.
+    Возвращает FetchResult: кандидатов с байтами картинки в 'content' и новый курсор.
+    """
+    print(f"Обрабатываю группу: {group_id}")
+    cursor = load_cursor(get_session_factory(), f"vk/{group_id}")
+    # owner_id группы не меняется - groups.getById нужен только в первый раз
+    owner_id = cursor.external_id or vk.resolve_owner_id(group_id)
+    last_post_id = int(cursor.last_item_id) if cursor.last_item_id else None
+    posts = read_new_posts(vk, owner_id, last_post_id, count)
+
+    newest = max(posts, key=lambda post: post['id'], default=None)
+    if newest is not None:
+        cursor = Cursor(cursor.source, str(newest['id']),
+                        datetime.datetime.utcfromtimestamp(newest.get('date', 0)), owner_id)
+    else:
+        cursor = cursor._replace(external_id=owner_id)
+
+    candidates = []
+    for post in posts:
+        for att in post.get('attachments', []):
+            if att['type'] == 'photo':
+                photo = max(att['photo']['sizes'], key=lambda size: size['width'])
+
+                # Генерируем уникальное имя файла
+                file_name = f"vk_{post['id']}_{att['photo']['id']}.jpg"
+                title = post['text'][:250] if post['text'] else f"Мем из {group_id}"
+                candidates.append({
+                    'title': title,
+                    'url': file_name, # <-- В БАЗУ ИДЕТ ИМЯ ФАЙЛА (КЛЮЧ), САМА КАРТИНКА - В КЕШЕ
+                    'source': f"vk/{group_id}",
+                    'image_url': photo['url'],
+                })
+
+                # Берем только первую картинку и идем дальше
+                break
+
+    # Что уже есть в базе, не скачиваем. Посты новее курсора почти всегда новые,
+    # но после упавшей записи или при первом запуске известные тоже попадаются
+    session = get_session_factory()()
+    try:
+        known = existing_urls(session, [c['url'] for c in candidates])
+    finally:
+        session.close()
+    for candidate in candidates:
+        candidate['known'] = candidate['url'] in known
+
+    # --- ЛОГИКА СКАЧИВАНИЯ: все картинки группы параллельно через общий пул ---
+    new_candidates = download_all(http, [c for c in candidates if not c['known']])
+    return FetchResult([c for c in candidates if c['known']] + new_candidates, cursor)
+
+
+def save_vk_memes(result):
+    """
+    Кладет скачанные картинки в кеш картинок, а мемы - в базу одной пачкой.
+    Курсор сдвигается только после записи: если она упала, посты прочитаются снова.
+    """
+    candidates, cursor = result
+    stats = save_candidates(get_session_factory(), candidates)
+    save_cursor(get_session_factory(), cursor)
+    if candidates:
+        print(f"  [+] {candidates[0]['source']}: скачано и сохранено {stats.inserted}, пропущено {stats.skipped} "
+              f"(из них похожих на известные: {stats.duplicates})")
+    return stats
+
+
+def make_tasks(group_ids, count=20):
+    """Задачи для параллельного парсинга: по одной на группу."""
+    if not os.getenv("VK_ACCESS_TOKEN"):
         print("Ошибка: VK_ACCESS_TOKEN не найден в .env файле.")
+        return []
+
+    http = get_http_client()
+    vk = VkApiClient(http)
+    return [
+        IngestTask(f"vk/{group_id}", partial(fetch_group_posts, vk, http, group_id, count), save_vk_memes)
+        for group_id in group_ids
+    ]
+
+
+def fetch_and_save_vk_memes(group_ids, count=20):
+    load_env()
+    tasks = make_tasks(group_ids, count)
+    if not tasks:
         return
 
-    session = Session()
-    vk_session = vk_api.VkApi(token=VK_ACCESS_TOKEN)
-    vk = vk_session.get_api()
-    
-    new_memes_count = 0
     print("\n--- Начинаю парсинг и скачивание из VK ---")
-    for group_id in group_ids:
-        try:
-            owner_id = f"-{vk.groups.getById(group_id=group_id)[0]['id']}"
-            print(f"Обрабатываю группу: {group_id}")
-            wall = vk.wall.get(owner_id=owner_id, count=count)
-
-            for post in wall['items']:
-                if 'attachments' in post:
-                    for att in post['attachments']:
-                        if att['type'] == 'photo':
-                            photo = max(att['photo']['sizes'], key=lambda size: size['width'])
-                            photo_url = photo['url']
-                            
-                            # Генерируем уникальное имя файла
-                            file_name = f"vk_{post['id']}_{att['photo']['id']}.jpg"
-                            local_path = os.path.join(IMAGES_DIR, file_name)
-                            
-                            # Проверяем, не скачивали ли мы уже этот файл
-                            # И нет ли его в базе (по локальному пути)
-                            if not os.path.exists(local_path) and not session.query(Meme).filter_by(url=file_name).first():
-                                
-                                # --- ЛОГИКА СКАЧИВАНИЯ ---
-                                try:
-                                    response = requests.get(photo_url, stream=True)
-                                    response.raise_for_status() # Проверяем, что запрос успешный
-                                    with open(local_path, 'wb') as f:
-                                        for chunk in response.iter_content(1024):
-                                            f.write(chunk)
-                                    
-                                    # Сохраняем в БД ЛОКАЛЬНЫЙ ПУТЬ
-                                    title = post['text'][:250] if post['text'] else f"Мем из {group_id}"
-                                    new_meme = Meme(
-                                        title=title,
-                                        url=file_name, # <-- СОХРАНЯЕМ ИМЯ ФАЙЛА, А НЕ URL
-                                        source=f"vk/{group_id}"
-                                    )
-                                    session.add(new_meme)
-                                    new_memes_count += 1
-                                    print(f"  [+] Скачан и сохранен мем: {file_name}")
-
-                                except requests.exceptions.RequestException as e:
-                                    print(f"    - Ошибка скачивания {photo_url}: {e}")
-
-                            # Берем только первую картинку и идем дальше
-                            break
-            
-            session.commit()
-        except Exception as e:
-            print(f"Ошибка при обработке группы {group_id}: {e}")
-
-    print(f"--- Парсинг VK завершен. Скачано {new_memes_count} новых мемов. ---")
-    session.close()
+    results = run_ingestion(tasks)
+    inserted = sum(stats.inserted for stats in results.values())
+    print(f"--- Парсинг VK завершен. Скачано {inserted} новых мемов. ---")
 
 # Блок для ручного тестирования
 if __name__ == "__main__":
@@ -0,0 +1,124 @@
+# src/recommender/embeddings.py
+
+import os
+import threading
+
+import numpy as np
+
+project_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# --- Конфигурация ---
+# Матрица эмбеддингов: строка с номером meme_id, float32, дописывается только в конец
+EMBEDDINGS_PATH = os.getenv("EMBEDDINGS_PATH", os.path.join(project_root, "data", "embeddings.f32"))
+
+# Эмбеддинг картинки: цветовая гистограмма HSV (12 тонов x 2 насыщенности x 2 яркости)
+# плюс низкочастотные коэффициенты DCT яркости 4x4 (общая композиция кадра).
+# Считается на CPU за доли миллисекунды и не требует нейросети.
+HSV_BINS = (12, 2, 2)
+DCT_SIZE = 32
+DCT_KEEP = 4
+EMBEDDING_DIM = HSV_BINS[0] * HSV_BINS[1] * HSV_BINS[2] + DCT_KEEP * DCT_KEEP
+EMBEDDING_DTYPE = np.float32
+
+_ROW_BYTES = EMBEDDING_DIM * np.dtype(EMBEDDING_DTYPE).itemsize
+
+
+def image_embedding(image):
+    """Вектор длины EMBEDDING_DIM с единичной нормой по BGR-картинке из cv2.imdecode."""
+    if image is None:
+        return None
+    # OpenCV нужен только парсерам, которые считают эмбеддинги; процессам,
+    # которые лишь читают матрицу (публикация, оценка), он не нужен
+    import cv2
+
+    if image.ndim == 2:
+        image = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+    small = cv2.resize(image, (128, 128), interpolation=cv2.INTER_AREA)
+
+    hsv = cv2.cvtColor(small, cv2.COLOR_BGR2HSV)
+    hist = cv2.calcHist([hsv], [0, 1, 2], None, list(HSV_BINS), [0, 180, 0, 256, 0, 256]).ravel()
+    hist /= hist.sum() or 1.0
+
+    gray = cv2.resize(cv2.cvtColor(small, cv2.COLOR_BGR2GRAY), (DCT_SIZE, DCT_SIZE), interpolation=cv2.INTER_AREA)
+    dct = cv2.dct(np.float32(gray) / 255.0)[:DCT_KEEP, :DCT_KEEP].ravel()
+    dct /= np.linalg.norm(dct) or 1.0
+
+    vector = np.concatenate([hist, dct]).astype(EMBEDDING_DTYPE)
+    return vector / (np.linalg.norm(vector) or 1.0)
+
+
+class EmbeddingStore:
+    """
+    Эмбеддинги всех мемов в одном файле, отображенном в память (np.memmap).
+
+    Строка i - эмбеддинг мема с id = i, поэтому выборка по списку id - это
+    просто индексирование, без словарей и запросов к базе. Файл только растет:
+    новые мемы дописываются в конец, пропуски заполнены нулями (нулевой вектор
+    = "эмбеддинга нет"). В памяти процесса ничего не копится - страницы
+    подгружает и вытесняет ОС.
+    """
+
+    def __init__(self, path=EMBEDDINGS_PATH):
+        self.path = path
+        self._matrix = None
+        self._rows = 0
+        self._lock = threading.Lock()
+
+    def _file_rows(self):
+        try:
+            return os.path.getsize(self.path) // _ROW_BYTES
+        except FileNotFoundError:
+            return 0
+
+    def _map(self):
+        """Текущее отображение файла; переоткрывается, если файл вырос."""
+        rows = self._file_rows()
+        with self._lock:
+            if rows != self._rows:
+                self._matrix = np.memmap(self.path, dtype=EMBEDDING_DTYPE, mode='r',
+                                         shape=(rows, EMBEDDING_DIM)) if rows else None
+                self._rows = rows
+            return self._matrix
+
+    def write(self, meme_ids, vectors):
+        """Записывает эмбеддинги новых мемов (дописывая файл до нужного размера)."""
+        items = sorted((int(meme_id), vector) for meme_id, vector in zip(meme_ids, vectors)
+                       if vector is not None)
+        if not items:
+            return 0
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, 'ab') as f:
+            pass  # создаем файл, если его нет
+        with open(self.path, 'r+b') as f:
+            rows = os.fstat(f.fileno()).st_size // _ROW_BYTES
+            needed = items[-1][0] + 1
+            if needed > rows:
+                f.truncate(needed * _ROW_BYTES)
+            for meme_id, vector in items:
+                f.seek(meme_id * _ROW_BYTES)
+                f.write(np.asarray(vector, dtype=EMBEDDING_DTYPE).tobytes())
+        return len(items)
+
+    def get(self, meme_ids):
+        """Матрица (len(meme_ids), EMBEDDING_DIM); для мемов без эмбеддинга - нули."""
+        meme_ids = np.asarray(meme_ids, dtype=np.int64)
+        result = np.zeros((len(meme_ids), EMBEDDING_DIM), dtype=EMBEDDING_DTYPE)
+        matrix = self._map()
+        if matrix is None or not len(meme_ids):
+            return result
+        present = meme_ids < matrix.shape[0]
+        result[present] = matrix[meme_ids[present]]
+        return result
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_embedding_store():
+    """Один экземпляр на процесс."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = EmbeddingStore()
+        return _store
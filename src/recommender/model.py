@@ -1,78 +1,301 @@
 # src/recommender/model.py
 
-import pandas as pd
-from sklearn.model_selection import train_test_split
-from sklearn.linear_model import LogisticRegression
-from sklearn.preprocessing import OneHotEncoder
-from sklearn.compose import ColumnTransformer
-from sklearn.pipeline import Pipeline
-import joblib # Библиотека для сохранения и загрузки моделей
+import os
+import time
+import threading
+
+import numpy as np
+
+from src.recommender.embeddings import EMBEDDING_DIM, get_embedding_store
+from src.recommender.registry import ModelRegistry
+from src.recommender.scorer import LinearScorer, source_bucket
+
+# Источники хешируются в фиксированное число корзин: новый сабреддит или группа
+# не меняют размерность признаков, и модель можно дообучать без пересборки
+SOURCE_BUCKETS = int(os.getenv("RECOMMENDER_SOURCE_BUCKETS", "64"))
+# Как часто (в секундах) дообучаемая модель сохраняется на диск
+RECOMMENDER_CHECKPOINT_INTERVAL = float(os.getenv("RECOMMENDER_CHECKPOINT_INTERVAL", "60"))
+# Сколько проходов по истории реакций делает полное переобучение
+RECOMMENDER_REFIT_EPOCHS = int(os.getenv("RECOMMENDER_REFIT_EPOCHS", "5"))
+
+# Меньше реакций - модель не используется, оценки остаются равными
+MIN_TRAIN_REACTIONS = 10
+
+POSITIVE_EMOTIONS = ('happy', 'surprise')
+CLASSES = np.array([0, 1])
+
+
+def _new_classifier():
+    # scikit-learn нужен только для обучения, поэтому импортируется здесь
+    from sklearn.linear_model import SGDClassifier
+    # Логистическая регрессия, которая умеет учиться по кусочкам (partial_fit)
+    return SGDClassifier(loss='log_loss', alpha=1e-3, learning_rate='invscaling', eta0=0.05, power_t=0.25,
+                         random_state=42)
+
 
 class MemeRecommender:
-    def __init__(self):
-        # Мы будем использовать простую логистическую регрессию.
-        # Она отлично подходит для бинарной классификации (нравится/не нравится).
-        # OneHotEncoder превращает текстовые категории (источник мема) в числа.
-        preprocessor = ColumnTransformer(
-            transformers=[
-                ('cat', OneHotEncoder(handle_unknown='ignore'), ['source'])
-            ])
-        
-        self.pipeline = Pipeline(steps=[('preprocessor', preprocessor),
-                                        ('classifier', LogisticRegression(class_weight='balanced'))])
-        self.is_trained = False
-
-    def train(self, reactions_df):
+    """
+    Логистическая регрессия по двум группам признаков: источник мема
+    (one-hot по хеш-корзинам) и эмбеддинг картинки (см. embeddings.py).
+
+    Модель учится инкрементально: каждая пачка реакций, записанная в базу,
+    сразу дообучает ее через partial_fit, а на диск модель сохраняется
+    не чаще раза в RECOMMENDER_CHECKPOINT_INTERVAL. Полное переобучение
+    читает историю реакций кусками, а не целиком. Каждое сохранение - новая
+    версия в ModelRegistry; другие процессы подхватывают ее через reload().
+
+    Дообучаются все воркеры сервера, поэтому свежие реакции хранятся до
+    сохранения: перед публикацией и при переходе на чужую версию они
+    проигрываются поверх ее классификатора (_rebase), и обновления разных
+    процессов складываются, а не затирают друг друга.
+
+    Оценивает мемы LinearScorer (только NumPy) по компактному JSON-артефакту.
+    Состояние sklearn читается с диска лишь при первом дообучении, так что
+    процесс, который только ранжирует мемы, scikit-learn не импортирует.
+    """
+
+    def __init__(self, embeddings=None, registry=None):
+        self.embeddings = embeddings or get_embedding_store()
+        self.registry = registry or ModelRegistry()
+        self.version = None
+        # Оценщик для выдачи. Заменяется целиком, поэтому потоки оценки
+        # не видят полуобновленную модель и не ждут блокировок
+        self.scorer = None
+        # Состояние обучения: поднимается лениво (_ensure_training_state)
+        self.classifier = None
+        self.class_counts = np.zeros(2)
+        self._training_loaded = False
+        # Реакции, на которых модель дообучилась после последнего сохранения:
+        # [(meme_ids, sources, emotions)]
+        self._pending = []
+        self._last_checkpoint = time.monotonic()
+        self._lock = threading.Lock()
+
+    @property
+    def is_trained(self):
+        return self.scorer is not None
+
+    # --- Признаки ---
+
+    def _features(self, meme_ids, sources):
+        one_hot = np.zeros((len(meme_ids), SOURCE_BUCKETS), dtype=np.float32)
+        one_hot[np.arange(len(meme_ids)), [source_bucket(source, SOURCE_BUCKETS) for source in sources]] = 1.0
+        return np.hstack([one_hot, self.embeddings.get(meme_ids)])
+
+    @staticmethod
+    def _targets(emotions):
+        # 1 - "понравилось", 0 - "не понравилось"
+        return np.array([1 if emotion in POSITIVE_EMOTIONS else 0 for emotion in emotions])
+
+    # --- Обучение ---
+
+    def _partial_fit(self, classifier, class_counts, meme_ids, sources, emotions, count_classes=True):
+        y = self._targets(emotions)
+        if count_classes:
+            class_counts += np.bincount(y, minlength=2)
+        # Аналог class_weight='balanced' по всем реакциям, увиденным до сих пор
+        class_weight = class_counts.sum() / (2.0 * np.maximum(class_counts, 1))
+        classifier.partial_fit(self._features(meme_ids, sources), y,
+                               classes=CLASSES, sample_weight=class_weight[y])
+
+    @staticmethod
+    def _enough_data(class_counts):
+        return class_counts.sum() >= MIN_TRAIN_REACTIONS and class_counts.min() > 0
+
+    @staticmethod
+    def _scorer_from_classifier(classifier):
+        coef = classifier.coef_[0]
+        return LinearScorer(classifier.intercept_[0], coef[:SOURCE_BUCKETS], coef[SOURCE_BUCKETS:])
+
+    def _ensure_training_state(self):
         """
-        Обучает модель на данных из DataFrame.
-        DataFrame должен содержать колонки 'dominant_emotion' и 'source'.
+        Поднимает классификатор текущей версии для дообучения.
+        False, если дообучать нечего (веса из старого формата - нужен /train).
         """
-        # 1. Готовим данные
-        # Определяем целевую переменную y (что мы хотим предсказать)
-        # 1 - "понравилось", 0 - "не понравилось"
-        positive_emotions = ['happy', 'surprise']
-        reactions_df['target'] = reactions_df['dominant_emotion'].apply(lambda x: 1 if x in positive_emotions else 0)
-
-        # Определяем признаки X (на основе чего мы предсказываем)
-        # Пока что у нас только один признак - источник мема.
-        features = ['source']
-        X = reactions_df[features]
-        y = reactions_df['target']
-
-        # Если у нас слишком мало данных или только один тип реакции, модель не обучить
-        if len(reactions_df) < 10 or len(y.unique()) < 2:
-            print("Недостаточно данных для обучения. Нужно хотя бы 10 реакций и 2 разных исхода.")
+        if not self._training_loaded:
+            state = self.registry.load_training_state(self.version) if self.scorer is not None else None
+            if self.scorer is None:
+                # Модели еще нет - учимся с нуля
+                self.classifier, self.class_counts = _new_classifier(), np.zeros(2)
+            elif isinstance(state, dict) and 'classifier' in state and state.get('source_buckets') == SOURCE_BUCKETS:
+                self.classifier = state['classifier']
+                self.class_counts = np.asarray(state['class_counts'], dtype=float)
+            else:
+                self.classifier = None
+            self._training_loaded = True
+        return self.classifier is not None
+
+    def partial_update(self, meme_ids, sources, emotions):
+        """
+        Дообучает модель на свежих реакциях. Новые веса сразу используются
+        для оценки, на диск модель сохраняется периодически.
+        """
+        if not len(meme_ids):
             return
+        with self._lock:
+            if not self._ensure_training_state():
+                # Веса из старого формата файла: их нельзя продолжить дообучать,
+                # сначала нужно полное переобучение через /train
+                return
+            self._partial_fit(self.classifier, self.class_counts, meme_ids, sources, emotions)
+            # Пока не встретились оба исхода, модель ничего не умеет
+            if self._enough_data(self.class_counts):
+                self.scorer = self._scorer_from_classifier(self.classifier)
+            self._pending.append((list(meme_ids), list(sources), list(emotions)))
+            if time.monotonic() - self._last_checkpoint >= RECOMMENDER_CHECKPOINT_INTERVAL:
+                self._checkpoint()
 
-        # 2. Обучаем модель (весь конвейер)
+    def refit(self, read_chunks, epochs=RECOMMENDER_REFIT_EPOCHS, progress=None):
+        """
+        Полное переобучение с нуля. read_chunks() каждый раз заново отдает
+        историю реакций кусками (meme_ids, sources, emotions), поэтому вся
+        история никогда не лежит в памяти целиком. Новая модель собирается
+        отдельно и подменяет текущую только в конце.
+        progress(эпоха, всего эпох, реакций в эпохе) вызывается после каждого куска.
+        """
+        classifier = _new_classifier()
+        class_counts = np.zeros(2)
         print("Начинаю обучение модели...")
-        self.pipeline.fit(X, y)
-        self.is_trained = True
+        for epoch in range(epochs):
+            rows = 0
+            for meme_ids, sources, emotions in read_chunks():
+                # Счетчики классов копятся только на первом проходе
+                self._partial_fit(classifier, class_counts, meme_ids, sources, emotions,
+                                  count_classes=(epoch == 0))
+                rows += len(meme_ids)
+                if progress is not None:
+                    progress(epoch + 1, epochs, rows)
+            if not self._enough_data(class_counts):
+                print(f"Недостаточно данных для обучения. Нужно хотя бы {MIN_TRAIN_REACTIONS} реакций и 2 разных исхода.")
+                return False
+
+        with self._lock:
+            self.classifier = classifier
+            self.class_counts = class_counts
+            self._training_loaded = True
+            self.scorer = self._scorer_from_classifier(classifier)
+            # Эти реакции уже в базе, а значит - в прочитанной истории
+            self._pending = []
+            self._checkpoint()
         print("Модель успешно обучена!")
+        return True
+
+    def checkpoint(self):
+        """Сохраняет модель, если с прошлого сохранения были обновления."""
+        with self._lock:
+            if self._pending:
+                self._checkpoint()
 
-        # 3. Сохраняем обученную модель в файл
-        joblib.dump(self.pipeline, 'recommender_model.pkl')
-        print("Модель сохранена в файл recommender_model.pkl")
+    def _checkpoint(self):
+        if self.scorer is None:
+            return  # пока модель не готова, публиковать нечего
+        with self.registry.publish_lock():
+            current = self.registry.current_version()
+            if self._pending and current is not None and current != self.version:
+                # Другой воркер успел опубликовать свою версию - продолжаем от нее
+                self._rebase(current)
+            self.version = self.registry.publish(self.scorer, {
+                'classifier': self.classifier,
+                'class_counts': self.class_counts,
+                'source_buckets': SOURCE_BUCKETS,
+            })
+        self._pending = []
+        self._last_checkpoint = time.monotonic()
+        print(f"Модель сохранена, версия {self.version}")
 
-    def predict_scores(self, memes_df):
+    def _rebase(self, version):
+        """
+        Берет классификатор версии version и заново дообучает его на реакциях
+        из self._pending. False, если состояние версии продолжить нельзя
+        (старый формат) - тогда остается своя модель.
         """
-        Предсказывает вероятность "лайка" для новых мемов.
+        state = self.registry.load_training_state(version)
+        if not (isinstance(state, dict) and 'classifier' in state and state.get('source_buckets') == SOURCE_BUCKETS):
+            return False
+        classifier = state['classifier']
+        class_counts = np.asarray(state['class_counts'], dtype=float)
+        for meme_ids, sources, emotions in self._pending:
+            self._partial_fit(classifier, class_counts, meme_ids, sources, emotions)
+        self.classifier, self.class_counts = classifier, class_counts
+        self._training_loaded = True
+        if self._enough_data(class_counts):
+            self.scorer = self._scorer_from_classifier(classifier)
+        self.version = version
+        return True
+
+    # --- Оценка ---
+
+    def score(self, meme_ids, sources):
         """
-        if not self.is_trained:
+        Вероятность "лайка" для мемов с данными id и источниками (numpy-массив).
+        """
+        scorer = self.scorer
+        if scorer is None:
             # Если модель не обучена, возвращаем для всех мемов одинаковую вероятность
-            return [0.5] * len(memes_df)
-            
-        # Используем модель для предсказания вероятностей
-        # Нам нужна вероятность класса "1" (понравится)
-        scores = self.pipeline.predict_proba(memes_df[['source']])[:, 1]
-        return scores
-
-    def load(self):
-        """Загружает модель из файла."""
-        try:
-            self.pipeline = joblib.load('recommender_model.pkl')
-            self.is_trained = True
-            print("Модель успешно загружена из файла.")
-        except FileNotFoundError:
-            print("Файл модели не найден. Модель не загружена.")
-            self.is_trained = False
\ No newline at end of file
+            return np.full(len(meme_ids), 0.5)
+        return scorer.score(meme_ids, sources, self.embeddings)
+
+    def load(self, version=None):
+        """Загружает текущую (или указанную) версию модели: только веса для оценки."""
+        version, scorer = self.registry.load_scorer(version)
+        if scorer is None:
+            # Версий еще нет - читаем recommender_model.pkl старого формата
+            scorer = self._scorer_from_legacy(self.registry.load_training_state(None))
+            if scorer is None:
+                print("Файл модели не найден. Модель не загружена.")
+                return
+
+        with self._lock:
+            if self._pending and version is not None and self._rebase(version):
+                # Свои еще не сохраненные реакции не теряются при смене версии
+                print(f"Модель переключена на версию {version}, поверх проиграно {len(self._pending)} пачек реакций.")
+                return
+            self.scorer = scorer
+            self.version = version
+            self.classifier = None
+            self._training_loaded = False
+            self._pending = []
+        print(f"Модель успешно загружена (версия {version or 'без версии'}).")
+
+    def reload(self, version):
+        """
+        Переключается на версию, опубликованную другим процессом. Свою же
+        версию не перечитывает. Оценка в это время идет по старым весам.
+        """
+        if version == self.version:
+            return False
+        self.load(version)
+        return True
+
+    def _scorer_from_legacy(self, state):
+        """
+        Старые форматы recommender_model.pkl: классификатор SGD, веса по именам
+        источников или sklearn Pipeline только с one-hot источника.
+        """
+        if state is None:
+            return None
+        if isinstance(state, dict) and 'classifier' in state:
+            counts = np.asarray(state.get('class_counts', np.zeros(2)), dtype=float)
+            if state.get('source_buckets') != SOURCE_BUCKETS or not self._enough_data(counts):
+                return None
+            return self._scorer_from_classifier(state['classifier'])
+        if isinstance(state, dict) and 'sources' in state:
+            sources, source_coef = state['sources'], state['source_weights']
+            embedding_weights, intercept = state['embedding_weights'], state['intercept']
+        elif hasattr(state, 'named_steps'):
+            encoder = state.named_steps['preprocessor'].named_transformers_['cat']
+            classifier = state.named_steps['classifier']
+            sources, source_coef = encoder.categories_[0], classifier.coef_[0]
+            embedding_weights, intercept = np.zeros(EMBEDDING_DIM), classifier.intercept_[0]
+        else:
+            print("Неизвестный формат файла модели, нужно переобучение.")
+            return None
+
+        # Веса по именам переносятся в корзины (при коллизии - среднее)
+        source_weights = np.zeros(SOURCE_BUCKETS, dtype=np.float32)
+        bucket_sizes = np.zeros(SOURCE_BUCKETS)
+        for source, weight in zip(sources, source_coef):
+            source_weights[source_bucket(source, SOURCE_BUCKETS)] += weight
+            bucket_sizes[source_bucket(source, SOURCE_BUCKETS)] += 1
+        source_weights /= np.maximum(bucket_sizes, 1)
+        return LinearScorer(intercept, source_weights, embedding_weights)
@@ -0,0 +1,191 @@
+# src/recommender/queue.py
+
+import os
+import time
+import heapq
+import random
+import threading
+
+from src.database import repository
+from src.metrics import timed
+
+# Не чаще чем раз в столько секунд очередь пересчитывается после дообучения модели
+QUEUE_RESCORE_INTERVAL = float(os.getenv("QUEUE_RESCORE_INTERVAL", "5"))
+
+
+class CandidateQueue:
+    """
+    Очередь непросмотренных мемов, упорядоченная по оценке модели.
+
+    Полностью строится один раз (и заново - только после переобучения модели),
+    а дальше обновляется точечно: новые мемы из парсера дочитываются по id,
+    мемы с реакцией помечаются просмотренными. Выбор следующего мема - это
+    просто pop из кучи, без запросов ко всей таблице.
+
+    После дообучения модели (mark_stale) база не перечитывается: мемы,
+    которые уже в куче, переоцениваются в фоновом потоке, и готовая куча
+    подменяет старую под блокировкой. Запросы в это время идут по старой.
+    """
+
+    def __init__(self, recommender, rescore_interval=QUEUE_RESCORE_INTERVAL):
+        self.recommender = recommender
+        self.rescore_interval = rescore_interval
+        self._heap = []          # элементы: (-оценка, случайный тай-брейк, meme_id, источник)
+        # id мемов с реакцией. Живут и после пересборки кучи: пока реакция
+        # ждет записи в буфере агрегатора, в базе мем еще не просмотрен
+        self._seen = set()
+        self._confirmed = set()  # из них - уже отмеченные просмотренными в базе
+        self._last_meme_id = 0   # самый большой id мема, который уже попал в кучу
+        self._built = False
+        self._built_at = 0.0
+        self._stale = False      # модель дообучилась, оценки в куче устарели
+        self._generation = 0     # номер полной сборки: фоновая переоценка старой кучи не подменит новую
+        self._rescoring = False
+        self._popped_during_rescore = set()
+        self._added_during_rescore = []
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._heap)
+
+    def invalidate(self):
+        """Помечает очередь устаревшей (например, после обучения модели)."""
+        with self._lock:
+            self._built = False
+
+    def mark_stale(self):
+        """
+        Модель дообучилась: следующий запрос запустит фоновую переоценку
+        очереди, но не чаще раза в rescore_interval секунд.
+        """
+        with self._lock:
+            self._stale = True
+
+    def mark_seen(self, meme_id):
+        """Исключает мем из выдачи. Сам элемент удалится из кучи лениво."""
+        with self._lock:
+            self._seen.add(int(meme_id))
+
+    def confirm_seen(self, meme_ids):
+        """Реакции на эти мемы записаны в базу: после пересборки помнить их не нужно."""
+        with self._lock:
+            self._confirmed.update(int(meme_id) for meme_id in meme_ids)
+
+    def pop(self, session):
+        """
+        Возвращает id лучшего непросмотренного мема или None, если таких нет.
+        """
+        with self._lock:
+            self._ensure_fresh(session)
+            return self._pop()
+
+    def pop_many(self, session, k):
+        """
+        До k лучших непросмотренных мемов за один вызов (для предзагрузки на клиенте).
+        Выданные мемы уходят из очереди, поэтому разные вкладки получают разные мемы.
+        """
+        with self._lock:
+            self._ensure_fresh(session)
+            meme_ids = []
+            while len(meme_ids) < k:
+                meme_id = self._pop()
+                if meme_id is None:
+                    break
+                meme_ids.append(meme_id)
+            return meme_ids
+
+    def warm_up(self, session):
+        """Собирает (или дочитывает) очередь заранее, чтобы первый запрос не платил за сборку."""
+        with self._lock:
+            self._ensure_fresh(session)
+
+    def _ensure_fresh(self, session):
+        if not self._built:
+            self._rebuild(session)
+            return
+        self._refresh(session)
+        rescore_due = self._stale and time.monotonic() - self._built_at >= self.rescore_interval
+        if rescore_due and not self._rescoring:
+            self._stale = False
+            self._rescoring = True
+            self._popped_during_rescore = set()
+            self._added_during_rescore = []
+            threading.Thread(target=self._rescore, args=(list(self._heap), self._generation),
+                             name='queue-rescore', daemon=True).start()
+
+    def _pop(self):
+        while self._heap:
+            meme_id = heapq.heappop(self._heap)[2]
+            if self._rescoring:
+                self._popped_during_rescore.add(meme_id)
+            if meme_id not in self._seen:
+                return meme_id
+        return None
+
+    def _rescore(self, entries, generation):
+        """Фоновый поток: новые оценки для мемов из кучи, без запросов к базе."""
+        try:
+            with timed('queue.rescore'):
+                heap = self._score([(entry[2], entry[3]) for entry in entries])
+                heapq.heapify(heap)
+            dropped = set()
+            while True:
+                # Фильтруем вне блокировки; под ней - только проверка, что за это
+                # время никто больше не забрал мем из очереди
+                with self._lock:
+                    popped = self._popped_during_rescore - dropped
+                    if not popped:
+                        if generation == self._generation:
+                            for item in self._added_during_rescore:
+                                heapq.heappush(heap, item)
+                            self._heap = heap
+                            self._built_at = time.monotonic()
+                        return
+                dropped |= popped
+                heap = [item for item in heap if item[2] not in popped]
+                heapq.heapify(heap)
+        except Exception as e:
+            print(f"Не удалось переоценить очередь кандидатов: {e}")
+        finally:
+            with self._lock:
+                self._rescoring = False
+
+    def _rebuild(self, session):
+        """Полная пересборка: все непросмотренные мемы, оцененные текущей моделью."""
+        with timed('queue.load'):
+            rows = repository.unseen_memes(session)
+
+        self._heap = self._score(rows)
+        heapq.heapify(self._heap)
+        # Подтвержденные до этого запроса мемы в него уже не попали
+        self._seen -= self._confirmed
+        self._confirmed = set()
+        # Новые мемы дочитываются от последнего загруженного, а не от max(id)
+        # отдельным запросом: мем, вставленный между ними, не потеряется
+        self._last_meme_id = max((row[0] for row in rows), default=0)
+        self._built = True
+        self._built_at = time.monotonic()
+        self._stale = False
+        self._generation += 1
+        print(f"Очередь кандидатов собрана: {len(self._heap)} непросмотренных мемов.")
+
+    def _refresh(self, session):
+        """Дочитывает мемы, добавленные парсером после последней сборки."""
+        with timed('queue.refresh'):
+            rows = repository.memes_after(session, self._last_meme_id)
+        if not rows:
+            return
+        for item in self._score(rows):
+            heapq.heappush(self._heap, item)
+            if self._rescoring:
+                self._added_during_rescore.append(item)
+        self._last_meme_id = max(self._last_meme_id, max(row[0] for row in rows))
+        print(f"В очередь кандидатов добавлено {len(rows)} новых мемов.")
+
+    def _score(self, rows):
+        if not rows:
+            return []
+        # Без модели все оценки 0.5, и порядок случайный, как и раньше
+        with timed('queue.score'):
+            scores = self.recommender.score([row[0] for row in rows], [row[1] for row in rows])
+        return [(-float(score), random.random(), int(row[0]), row[1]) for row, score in zip(rows, scores)]
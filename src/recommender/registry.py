@@ -0,0 +1,150 @@
+# src/recommender/registry.py
+
+import os
+import time
+import uuid
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: процессы не блокируются, остается только атомарность файлов
+    fcntl = None
+
+from src.recommender.scorer import LinearScorer
+
+project_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# --- Конфигурация ---
+MODELS_DIR = os.getenv("MODELS_DIR", os.path.join(project_root, "data", "models"))
+# Сколько последних версий модели хранить на диске
+MODEL_KEEP_VERSIONS = int(os.getenv("MODEL_KEEP_VERSIONS", "10"))
+# Как часто (в секундах) работающие процессы проверяют, не вышла ли новая версия
+MODEL_WATCH_INTERVAL = float(os.getenv("MODEL_WATCH_INTERVAL", "5"))
+# Файл модели до появления версий: читается, пока не опубликована первая версия
+LEGACY_MODEL_PATH = 'recommender_model.pkl'
+
+CURRENT_POINTER = "CURRENT"
+
+
+class ModelRegistry:
+    """
+    Версии модели на диске. Каждая версия - пара неизменяемых файлов:
+    model-<версия>.json - компактные веса для оценки (LinearScorer, без sklearn)
+    и model-<версия>.pkl - состояние обучения (нужно только для дообучения).
+    Файл CURRENT хранит имя текущей версии.
+
+    И файл версии, и CURRENT пишутся во временный файл и переименовываются
+    (os.replace атомарен), поэтому читатель - веб-приложение, бот или второй
+    воркер - видит либо старую версию целиком, либо новую целиком.
+    """
+
+    def __init__(self, models_dir=MODELS_DIR, keep_versions=MODEL_KEEP_VERSIONS):
+        self.models_dir = models_dir
+        self.keep_versions = keep_versions
+
+    def _path(self, name):
+        return os.path.join(self.models_dir, name)
+
+    def current_version(self):
+        """Имя текущей версии или None, если ни одна еще не опубликована."""
+        try:
+            with open(self._path(CURRENT_POINTER), encoding='utf-8') as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def publish(self, scorer, training_state=None):
+        """Сохраняет новую версию и делает ее текущей. Возвращает имя версии."""
+        os.makedirs(self.models_dir, exist_ok=True)
+        # Имена версий сортируются по времени: по ним же выбираются старые для удаления
+        now = time.time()
+        version = f"{time.strftime('%Y%m%d-%H%M%S', time.localtime(now))}.{int(now * 1000) % 1000:03d}-{uuid.uuid4().hex[:6]}"
+        if training_state is not None:
+            import joblib
+            self._write_atomic(f"model-{version}.pkl", lambda path: joblib.dump(training_state, path))
+        self._write_atomic(f"model-{version}.json", lambda path: scorer.save(path, model_version=version))
+
+        pointer_tmp = self._path(f".{CURRENT_POINTER}.{uuid.uuid4().hex}.tmp")
+        with open(pointer_tmp, 'w', encoding='utf-8') as f:
+            f.write(version)
+        os.replace(pointer_tmp, self._path(CURRENT_POINTER))
+
+        self._prune(keep=version)
+        return version
+
+    @contextmanager
+    def publish_lock(self):
+        """
+        Блокировка публикации между процессами: внутри нее можно прочитать
+        текущую версию, слить с ней свои обновления и опубликовать результат,
+        не затерев версию, которую в это же время публикует другой воркер.
+        """
+        os.makedirs(self.models_dir, exist_ok=True)
+        with open(self._path(".publish.lock"), 'a') as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _write_atomic(self, file_name, write):
+        tmp_path = self._path(f".{file_name}.tmp")
+        write(tmp_path)
+        os.replace(tmp_path, self._path(file_name))
+
+    def load_scorer(self, version=None):
+        """(версия, LinearScorer) для указанной или текущей версии; (None, None), если версий нет."""
+        version = version or self.current_version()
+        if version is None:
+            return None, None
+        return version, LinearScorer.load(self._path(f"model-{version}.json"))
+
+    def load_training_state(self, version=None):
+        """
+        Состояние обучения версии (классификатор sklearn). Без опубликованных
+        версий читается старый recommender_model.pkl; если нет и его - None.
+        """
+        import joblib
+        version = version or self.current_version()
+        path = self._path(f"model-{version}.pkl") if version else LEGACY_MODEL_PATH
+        try:
+            return joblib.load(path)
+        except FileNotFoundError:
+            return None
+
+    def _prune(self, keep):
+        """Удаляет старые версии, оставляя keep_versions последних (и текущую)."""
+        versions = sorted({name[len("model-"):].rsplit(".", 1)[0] for name in os.listdir(self.models_dir)
+                           if name.startswith("model-") and name.endswith((".pkl", ".json"))})
+        for version in versions[:-self.keep_versions]:
+            if version == keep:
+                continue
+            for ext in (".json", ".pkl"):
+                try:
+                    os.remove(self._path(f"model-{version}{ext}"))
+                except FileNotFoundError:
+                    pass
+
+    def watch(self, on_change, interval=MODEL_WATCH_INTERVAL):
+        """
+        Фоновый поток, который вызывает on_change(версия), когда CURRENT
+        начинает указывать на другую версию. Путь оценки при этом не блокируется.
+        """
+        def run():
+            last = self.current_version()
+            while True:
+                time.sleep(interval)
+                version = self.current_version()
+                if version is not None and version != last:
+                    last = version
+                    try:
+                        on_change(version)
+                    except Exception as e:
+                        print(f"Не удалось переключиться на версию модели {version}: {e}")
+
+        thread = threading.Thread(target=run, name='model-watcher', daemon=True)
+        thread.start()
+        return thread
@@ -0,0 +1,93 @@
+# src/recommender/scorer.py
+#
+# Оценка мемов по экспортированной линейной модели. Здесь только NumPy:
+# веб-приложению и боту не нужно импортировать scikit-learn, чтобы ранжировать мемы.
+
+import json
+import zlib
+from functools import lru_cache
+
+import numpy as np
+
+ARTIFACT_FORMAT = "memepulse-linear"
+ARTIFACT_FORMAT_VERSION = 1
+
+# Сколько мемов оценивается за один матричный проход: память не растет с размером базы
+SCORE_CHUNK = 65536
+
+
+@lru_cache(maxsize=4096)
+def source_bucket(source, buckets):
+    """Номер корзины источника. Тот же crc32 используется и при обучении."""
+    return zlib.crc32(source.encode('utf-8')) % buckets
+
+
+class LinearScorer:
+    """
+    Логистическая модель в виде таблицы коэффициентов:
+    sigmoid(свободный член + коэффициент корзины источника + E @ w).
+
+    Артефакт - небольшой JSON: intercept, таблица коэффициентов источников
+    по хеш-корзинам и необязательные плотные веса (сейчас - для эмбеддинга картинки).
+    """
+
+    def __init__(self, intercept, source_coefficients, embedding_weights=None):
+        self.intercept = float(intercept)
+        self.source_coefficients = np.asarray(source_coefficients, dtype=np.float32)
+        self.embedding_weights = None if embedding_weights is None else np.asarray(embedding_weights, dtype=np.float32)
+
+    @property
+    def buckets(self):
+        return len(self.source_coefficients)
+
+    @property
+    def source_only(self):
+        """Оценка зависит только от источника (плотных весов нет или они нулевые)."""
+        return self.embedding_weights is None or not self.embedding_weights.any()
+
+    def score(self, meme_ids, sources, embeddings=None):
+        """Вероятность "лайка" для мемов с данными id и источниками (numpy-массив)."""
+        meme_ids = np.asarray(meme_ids, dtype=np.int64)
+        buckets = self.buckets
+        bucket_index = np.fromiter((source_bucket(source, buckets) for source in sources),
+                                   dtype=np.int64, count=len(meme_ids))
+
+        logits = self.source_coefficients[bucket_index] + self.intercept
+        if embeddings is not None and not self.source_only:
+            for start in range(0, len(meme_ids), SCORE_CHUNK):
+                end = start + SCORE_CHUNK
+                logits[start:end] += embeddings.get(meme_ids[start:end]) @ self.embedding_weights
+        return 1.0 / (1.0 + np.exp(-np.clip(logits, -30, 30)))
+
+    # --- Формат артефакта ---
+
+    def to_dict(self, model_version=None):
+        dense = {}
+        if self.embedding_weights is not None:
+            dense['embedding'] = self.embedding_weights.tolist()
+        return {
+            'format': ARTIFACT_FORMAT,
+            'format_version': ARTIFACT_FORMAT_VERSION,
+            'model_version': model_version,
+            'intercept': self.intercept,
+            'source_hashing': {'function': 'crc32', 'buckets': self.buckets},
+            'source_coefficients': self.source_coefficients.tolist(),
+            'dense': dense,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        if data.get('format') != ARTIFACT_FORMAT:
+            raise ValueError(f"Неизвестный формат модели: {data.get('format')}")
+        if data.get('format_version', 0) > ARTIFACT_FORMAT_VERSION:
+            raise ValueError(f"Модель в формате версии {data['format_version']}, поддерживается до {ARTIFACT_FORMAT_VERSION}")
+        return cls(data['intercept'], data['source_coefficients'], data.get('dense', {}).get('embedding'))
+
+    def save(self, path, model_version=None):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(model_version), f, separators=(',', ':'))
+
+    @classmethod
+    def load(cls, path):
+        with open(path, encoding='utf-8') as f:
+            return cls.from_dict(json.load(f))
@@ -0,0 +1,82 @@
+# src/recommender/selection.py
+
+import os
+import heapq
+
+import numpy as np
+from sqlalchemy import case, select
+
+from src.database import repository
+from src.database.models import Meme, MEME_IS_UNSEEN
+
+# Сколько непросмотренных мемов читается и оценивается за раз при потоковом отборе
+SELECTION_CHUNK = int(os.getenv("SELECTION_CHUNK", "5000"))
+
+
+def select_top_memes(session, recommender, k=1, chunk_size=SELECTION_CHUNK):
+    """
+    k лучших непросмотренных мемов: список (meme_id, оценка), лучший первым.
+    При равной оценке выигрывает мем с меньшим id (тот, что раньше попал в базу).
+
+    Если оценка зависит только от источника, весь отбор делает SQLite:
+    оценки источников подставляются в ORDER BY через CASE, и в Python
+    приходят лишь k строк. Иначе непросмотренные мемы читаются кусками
+    по chunk_size, а лучшие k держатся в куче - память не зависит от размера базы.
+    """
+    scorer = recommender.scorer
+    if scorer is None or k <= 0:
+        return []
+    if scorer.source_only:
+        return _top_by_source(session, scorer, k)
+    return _top_streaming(session, recommender, k, chunk_size)
+
+
+def fetch_memes(session, scored):
+    """Полные строки только для выбранных мемов: [(Meme, оценка)] в порядке scored."""
+    if not scored:
+        return []
+    memes = repository.memes_by_id(session, [meme_id for meme_id, _ in scored])
+    return [(memes[meme_id], score) for meme_id, score in scored if meme_id in memes]
+
+
+def _top_by_source(session, scorer, k):
+    # Источников немного, поэтому их оценки дешево посчитать в Python
+    sources = session.execute(select(Meme.source).where(MEME_IS_UNSEEN).distinct()).scalars().all()
+    if not sources:
+        return []
+    scores = scorer.score(np.zeros(len(sources), dtype=np.int64), sources)
+    source_score = case({source: float(score) for source, score in zip(sources, scores)},
+                        value=Meme.source, else_=0.0)
+    rows = session.execute(
+        select(Meme.id, source_score.label('score'))
+        .where(MEME_IS_UNSEEN)
+        .order_by(source_score.desc(), Meme.id)
+        .limit(k)
+    ).all()
+    return [(meme_id, float(score)) for meme_id, score in rows]
+
+
+def _top_streaming(session, recommender, k, chunk_size):
+    heap = []  # min-куча из k лучших: (оценка, -meme_id)
+    last_id = 0
+    while True:
+        # Постраничное чтение по id идет по частичному индексу ix_memes_unseen
+        rows = repository.unseen_memes_page(session, last_id, chunk_size)
+        if not rows:
+            break
+        meme_ids = np.fromiter((row.id for row in rows), dtype=np.int64, count=len(rows))
+        scores = recommender.score(meme_ids, [row.source for row in rows])
+        # В кучу идут только мемы не хуже k-го в куске, а не весь кусок
+        # (порог, а не argpartition: при равных оценках решает id, а не случай)
+        if len(rows) > k:
+            threshold = np.partition(scores, len(rows) - k)[len(rows) - k]
+            keep = scores >= threshold
+            meme_ids, scores = meme_ids[keep], scores[keep]
+        for meme_id, score in zip(meme_ids.tolist(), scores.tolist()):
+            item = (score, -meme_id)
+            if len(heap) < k:
+                heapq.heappush(heap, item)
+            elif item > heap[0]:
+                heapq.heapreplace(heap, item)
+        last_id = rows[-1].id
+    return [(-neg_id, score) for score, neg_id in sorted(heap, reverse=True)]
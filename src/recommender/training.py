@@ -0,0 +1,97 @@
+# src/recommender/training.py
+
+import time
+import threading
+
+from src.database import repository
+from src.database.aggregator import EMOTION_PRIORITY
+from src.metrics import timed
+
+
+class TrainingJob:
+    """
+    Полное переобучение модели в фоновом потоке. /train только запускает его
+    и сразу отвечает, а ход обучения виден через status(). Одновременно идет
+    не больше одного обучения.
+    """
+
+    def __init__(self, recommender, on_success=None):
+        self.recommender = recommender
+        # on_success(версия) - например, пересобрать очередь кандидатов
+        self.on_success = on_success
+        self._status = {'state': 'idle'}
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self, read_chunks):
+        """Запускает обучение. False, если предыдущее еще не закончилось."""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return False
+            self._status = {'state': 'running', 'started_at': time.time(), 'epoch': 0, 'epochs': None, 'rows': 0}
+            self._thread = threading.Thread(target=self._run, args=(read_chunks,), name='training', daemon=True)
+            self._thread.start()
+            return True
+
+    def status(self):
+        with self._lock:
+            return dict(self._status)
+
+    def _progress(self, epoch, epochs, rows):
+        with self._lock:
+            self._status.update(epoch=epoch, epochs=epochs, rows=rows)
+
+    def _run(self, read_chunks):
+        try:
+            with timed('train'):
+                trained = self.recommender.refit(read_chunks, progress=self._progress)
+        except Exception as e:
+            print(f"Ошибка при обучении модели: {e}")
+            self._finish('failed', f"Ошибка обучения: {e}")
+            return
+
+        if not trained:
+            self._finish('failed', "Обучение невозможно: нужны и положительные, и отрицательные реакции.")
+            return
+        if self.on_success is not None:
+            self.on_success(self.recommender.version)
+        self._finish('done', "Модель обучена!", version=self.recommender.version)
+
+    def _finish(self, state, message, **extra):
+        with self._lock:
+            self._status.update(state=state, message=message, finished_at=time.time(), **extra)
+
+
+def reaction_history(session_factory, event_store, chunk_size):
+    """
+    read_chunks() для MemeRecommender.refit: история реакций кусками
+    (meme_ids, sources, emotions). Мемы, по которым есть покадровые события
+    (src/emotion_store), размечаются так же, как итоговая реакция агрегатора
+    (самая важная из доминирующих эмоций кадров), и метки совпадают с теми,
+    на которых модель дообучается онлайн. Остальные мемы - доминирующей
+    эмоцией из таблицы reactions
+    (реакции, записанные до появления хранилища событий). События читаются
+    потоково и один раз - на первой эпохе.
+    """
+    labels = None
+
+    def read_chunks():
+        nonlocal labels
+        if labels is None:
+            labels = event_store.dominant_emotions(EMOTION_PRIORITY)
+        session = session_factory()
+        try:
+            meme_ids = list(labels)
+            for start in range(0, len(meme_ids), chunk_size):
+                sources = repository.meme_sources(session, meme_ids[start:start + chunk_size])
+                chunk = [meme_id for meme_id in meme_ids[start:start + chunk_size] if meme_id in sources]
+                if chunk:
+                    yield chunk, [sources[meme_id] for meme_id in chunk], [labels[meme_id] for meme_id in chunk]
+            for rows in repository.reaction_history(session, chunk_size):
+                rows = [row for row in rows if row[0] not in labels]
+                if rows:
+                    yield [row[0] for row in rows], [row[1] for row in rows], [row[2] for row in rows]
+        finally:
+            session.close()
+
+    return read_chunks
@@ -1,97 +1,97 @@
 # src/telegram_bot/poster.py
 
 import os
-import sys
 import asyncio
-import pandas as pd
-from aiogram import Bot
-from sqlalchemy import create_engine, not_
-from sqlalchemy.orm import sessionmaker
-from dotenv import load_dotenv
 
-# --- Настройка путей, чтобы скрипт видел другие модули ---
-project_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-sys.path.append(project_root)
-
-from src.database.models import Meme, Reaction
+from src.config import load_env
+from src.database import repository
+from src.database.engine import get_session_factory
 from src.recommender.model import MemeRecommender
+from src.recommender.selection import select_top_memes, fetch_memes
+
+# Сколько лучших мемов публиковать за один запуск
+TG_POST_COUNT = int(os.getenv("TG_POST_COUNT", "1"))
+
+# Модель живет между запусками (планировщик - долгоживущий процесс)
+# и перечитывается с диска, только когда вышла новая версия
+_recommender = None
 
-# Загружаем переменные окружения (.env)
-load_dotenv()
 
-# --- Конфигурация ---
-DB_PATH = os.path.join(project_root, "memes.db")
-BOT_TOKEN = os.getenv("BOT_TOKEN")
-CHANNEL_ID = os.getenv("TG_CHANNEL_ID") 
+def get_recommender():
+    global _recommender
+    if _recommender is None:
+        _recommender = MemeRecommender()
+        _recommender.load()
+    else:
+        _recommender.reload(_recommender.registry.current_version())
+    return _recommender
 
-engine = create_engine(f"sqlite:///{DB_PATH}")
-Session = sessionmaker(bind=engine)
 
-async def post_best_meme():
+async def post_best_meme(count=None):
     """
-    Находит лучший мем и публикует его в Telegram-канал.
+    Находит count лучших мемов (по умолчанию TG_POST_COUNT) и публикует их
+    в Telegram-канал. В TG_CHANNEL_ID можно перечислить несколько каналов
+    через запятую: в первый картинки загружаются, в остальные уходят по file_id.
     """
-    if not all([BOT_TOKEN, CHANNEL_ID]):
+    count = count or TG_POST_COUNT
+    # Токен и каналы читаются при вызове: .env загружает точка входа (load_env)
+    bot_token = os.getenv("BOT_TOKEN")
+    channel_ids = [channel.strip() for channel in os.getenv("TG_CHANNEL_ID", "").split(',') if channel.strip()]
+    if not all([bot_token, channel_ids]):
         print("Ошибка: BOT_TOKEN или TG_CHANNEL_ID не найдены в .env файле.")
         return
 
-    session = Session()
-    bot = Bot(token=BOT_TOKEN)
-    
     print("Идет подбор лучшего мема для публикации...")
 
-    # 1. Загружаем обученную модель
-    recommender = MemeRecommender()
-    recommender.load()
-
+    # 1. Берем обученную модель
+    recommender = get_recommender()
     if not recommender.is_trained:
         print("Модель не обучена. Публикация невозможна.")
-        await bot.session.close()
-        return
-
-    # 2. Находим все мемы, которые еще не были просмотрены (и не будут опубликованы)
-    reacted_meme_ids_query = session.query(Reaction.meme_id).distinct()
-    reacted_ids = [id_tuple[0] for id_tuple in reacted_meme_ids_query.all()]
-    
-    unseen_memes_query = session.query(Meme).filter(not_(Meme.id.in_(reacted_ids)))
-    unseen_memes = unseen_memes_query.all()
-    
-    if not unseen_memes:
-        print("Нет непросмотренных мемов для оценки.")
-        await bot.session.close()
         return
 
-    # 3. Оцениваем все непросмотренные мемы
-    unseen_memes_df = pd.DataFrame([{'id': m.id, 'source': m.source, 'url': m.url, 'title': m.title} for m in unseen_memes])
-    scores = recommender.predict_scores(unseen_memes_df)
-    unseen_memes_df['score'] = scores
-    
-    # 4. Находим самый лучший
-    best_meme = unseen_memes_df.sort_values(by='score', ascending=False).iloc[0]
+    session = get_session_factory()()
+    try:
+        # 2. Отбираем лучшие непросмотренные и неопубликованные мемы: в память
+        # попадают только (id, оценка), полные строки читаются лишь для победителей
+        best = fetch_memes(session, select_top_memes(session, recommender, count))
+        if not best:
+            print("Нет непросмотренных мемов для оценки.")
+            return
+
+        # aiogram нужен только в момент публикации, поэтому импортируется здесь
+        from src.telegram_bot.publisher import get_publisher
+
+        # 3. Публикуем == НАСТРОЙКА ВИДА ПУБЛИКАЦИИ (CAPTION) ==
+        posts = []
+        for meme, score in best:
+            print(f"Выбран мем: '{meme.title}' с оценкой {score:.2f}")
+            posts.append((meme, f"Источник: r/{meme.source}\n\n<i>Оценка мема моделью: {score:.2f}</i>"))
+
+        publisher = get_publisher()
+        for channel_number, channel_id in enumerate(channel_ids):
+            published = await publisher.publish(channel_id, posts)
+            print(f"Опубликовано мемов в канале {channel_id}: {len(published)} из {len(posts)}.")
+            if channel_number == 0:
+                # 4. Важно! Помечаем мемы опубликованными, чтобы они больше не рассматривались
+                repository.mark_published(session, [meme.id for meme in published])
+                # В другие каналы идут только мемы, которые вышли в основном
+                posts = [(meme, caption) for meme, caption in posts if meme in published]
+            # Вместе с отметкой сохраняются и полученные file_id
+            session.commit()
+    finally:
+        session.close()
 
-    print(f"Выбран лучший мем: '{best_meme['title']}' с оценкой {best_meme['score']:.2f}")
 
-    # 5. Публикуем его в канал == НАСТРОЙКА ВИДА ПУБЛИКАЦИИ (CAPTION) ==
+async def _main():
     try:
-        caption = f"Источник: r/{best_meme['source']}\n\n<i>Оценка мема моделью: {best_meme['score']}</i>"
-        await bot.send_photo(chat_id=CHANNEL_ID, photo=best_meme['url'], caption=caption, parse_mode="HTML")
-        print(f"Мем успешно опубликован в канале {CHANNEL_ID}!")
-
-        # 6. Важно! Добавляем "реакцию", чтобы этот мем больше не рассматривался
-        # Мы используем фиктивную эмоцию "published"
-        published_reaction = Reaction(meme_id=int(best_meme['id']), dominant_emotion="published")
-        session.add(published_reaction)
-        session.commit()
-        print("Мем помечен как опубликованный.")
-
-    except Exception as e:
-        print(f"Ошибка при публикации в Telegram: {e}")
+        await post_best_meme()
     finally:
-        # Важно закрыть сессию с Telegram API
-        await bot.session.close()
-        session.close()
+        from src.telegram_bot.publisher import close_publisher
+        await close_publisher()
+
 
 # Блок для ручного тестирования скрипта
 if __name__ == "__main__":
+    load_env()
     # Для запуска асинхронной функции из синхронного кода
-    asyncio.run(post_best_meme())
\ No newline at end of file
+    asyncio.run(_main())
\ No newline at end of file
@@ -0,0 +1,141 @@
+# src/telegram_bot/publisher.py
+
+import os
+import time
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import FSInputFile, InputMediaPhoto
+
+from src.config import PROJECT_ROOT
+from src.image_store.store import ORIGINAL, get_image_store
+from src.metrics import REGISTRY
+
+# Telegram принимает в одну медиагруппу от 2 до 10 фото
+MEDIA_GROUP_MAX = 10
+
+POST_SECONDS = REGISTRY.histogram(
+    'memepulse_telegram_post_seconds', 'Время одного вызова Bot API на публикацию', ['method'])
+POSTED_MEMES = REGISTRY.counter(
+    'memepulse_telegram_posted_memes_total', 'Мемы, отправленные в Telegram: published или failed', ['result'])
+
+
+class TelegramPublisher:
+    """
+    Публикация мемов через один долгоживущий Bot: сессия и пул соединений
+    с Bot API создаются один раз на процесс, а не на каждую публикацию.
+
+    Картинка берется в таком порядке: file_id из базы (байты не передаются
+    вообще), оригинал из кеша картинок (файл отдается потоком, целиком
+    в память не читается), старый файл из static/images, и только потом -
+    исходный url, который Telegram скачает сам. file_id, который вернул
+    Telegram, записывается в meme.tg_file_id: повтор и публикация в другие
+    каналы того же бота идут уже без загрузки.
+
+    Bot привязан к циклу asyncio, в котором его впервые использовали, поэтому
+    вызывать publish нужно всегда из одного цикла (см. scheduler.py).
+    """
+
+    def __init__(self, token, api_url=None, image_store=None):
+        self.token = token
+        # Свой адрес Bot API: локальный сервер telegram-bot-api или заглушка для тестов
+        self.api_url = api_url
+        self.image_store = image_store or get_image_store()
+        self._bot = None
+
+    @property
+    def bot(self):
+        if self._bot is None:
+            session = None
+            if self.api_url:
+                from aiogram.client.session.aiohttp import AiohttpSession
+                from aiogram.client.telegram import TelegramAPIServer
+                session = AiohttpSession(api=TelegramAPIServer.from_base(self.api_url.rstrip('/')))
+            self._bot = Bot(token=self.token, session=session)
+        return self._bot
+
+    def _photo(self, meme, use_file_id=True):
+        if use_file_id and meme.tg_file_id:
+            return meme.tg_file_id
+        opened = self.image_store.open(meme.image_digest, ORIGINAL) if meme.image_digest else None
+        if opened is not None:
+            return FSInputFile(opened[0])
+        if not meme.url.startswith('http'):
+            # Старые мемы из VK: в url лежит имя файла в static/images
+            legacy_path = os.path.join(PROJECT_ROOT, 'static', 'images', meme.url)
+            if os.path.isfile(legacy_path):
+                return FSInputFile(legacy_path)
+        return meme.url
+
+    async def publish(self, chat_id, posts):
+        """
+        Публикует posts - список (Meme, подпись) - в чат chat_id. Несколько
+        мемов уходят медиагруппами по MEDIA_GROUP_MAX, один - обычным фото.
+        Возвращает мемы, которые удалось опубликовать, и обновляет их
+        meme.tg_file_id (сохранить его в базу должен вызывающий).
+        """
+        published = []
+        for start in range(0, len(posts), MEDIA_GROUP_MAX):
+            group = posts[start:start + MEDIA_GROUP_MAX]
+            try:
+                messages = await self._send_with_retry(chat_id, group)
+            except Exception as e:
+                POSTED_MEMES.inc(len(group), result='failed')
+                print(f"Ошибка при публикации в Telegram: {e}")
+                continue
+            POSTED_MEMES.inc(len(group), result='published')
+            for (meme, _), message in zip(group, messages):
+                if message.photo:
+                    # Последний размер - самый большой, то есть исходная картинка
+                    meme.tg_file_id = message.photo[-1].file_id
+                published.append(meme)
+        return published
+
+    async def _send_with_retry(self, chat_id, group):
+        try:
+            return await self._send(chat_id, group, use_file_id=True)
+        except TelegramBadRequest as e:
+            if not any(meme.tg_file_id for meme, _ in group):
+                raise
+            # file_id мог устареть (например, сменили бота) - загружаем заново
+            print(f"Telegram не принял сохраненный file_id ({e}), загружаю картинки заново...")
+            return await self._send(chat_id, group, use_file_id=False)
+
+    async def _send(self, chat_id, group, use_file_id):
+        started = time.perf_counter()
+        if len(group) == 1:
+            meme, caption = group[0]
+            method = 'sendPhoto'
+            messages = [await self.bot.send_photo(chat_id=chat_id, photo=self._photo(meme, use_file_id),
+                                                  caption=caption, parse_mode="HTML")]
+        else:
+            method = 'sendMediaGroup'
+            media = [InputMediaPhoto(media=self._photo(meme, use_file_id), caption=caption, parse_mode="HTML")
+                     for meme, caption in group]
+            messages = await self.bot.send_media_group(chat_id=chat_id, media=media)
+        POST_SECONDS.observe(time.perf_counter() - started, method=method)
+        return messages
+
+    async def close(self):
+        if self._bot is not None:
+            await self._bot.session.close()
+            self._bot = None
+
+
+_publisher = None
+
+
+def get_publisher():
+    """Один публикатор (и одна сессия Bot API) на процесс."""
+    global _publisher
+    if _publisher is None:
+        _publisher = TelegramPublisher(os.getenv("BOT_TOKEN"), api_url=os.getenv("TELEGRAM_API_URL"))
+    return _publisher
+
+
+async def close_publisher():
+    """Закрывает сессию Bot API при остановке процесса."""
+    global _publisher
+    if _publisher is not None:
+        await _publisher.close()
+        _publisher = None
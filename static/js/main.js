@@ -6,7 +6,22 @@ document.addEventListener('DOMContentLoaded', () => {
     const videoElement = document.getElementById('webcam');
     const emotionResultElement = document.getElementById('emotion-result');
     const trainButton = document.getElementById('trainButton');
-    let analysisInterval;
+    const memeImageElement = document.getElementById('memeImage');
+    const memeTitleElement = document.querySelector('.meme-title');
+    const memeIdElement = document.getElementById('memeId');
+    const nextMemeButton = document.getElementById('nextMemeButton');
+
+    // --- Интервал съемки: сервер увеличивает его, пока в кадре ничего не меняется ---
+    const BASE_INTERVAL_MS = 1500; // 1.5 секунды
+    let nextIntervalMs = BASE_INTERVAL_MS;
+    let analysisTimer;
+    let analysisStopped = false;
+    let analysisInFlight = false;
+
+    // Идентификатор вкладки: по нему сервер сравнивает кадр с предыдущим
+    const sessionId = sessionStorage.getItem('memePulseSession') ||
+        (window.crypto && crypto.randomUUID ? crypto.randomUUID() : String(Math.random()).slice(2));
+    sessionStorage.setItem('memePulseSession', sessionId);
 
     // --- Функция для отправки кадра на анализ ---
     async function analyzeFrame() {
@@ -34,19 +49,28 @@ document.addEventListener('DOMContentLoaded', () => {
         context.scale(-1, 1);
         context.drawImage(videoElement, 0, 0, canvas.width, canvas.height);
 
-        // 3. Получаем изображение с холста в формате Base64
-        const imageData = canvas.toDataURL('image/jpeg');
+        // 3. Получаем JPEG прямо в бинарном виде (без base64 - так на треть меньше)
+        const frameBlob = await new Promise(resolve => canvas.toBlob(resolve, 'image/jpeg', 0.85));
+        if (!frameBlob) {
+            return;
+        }
 
         try {
-            // 4. Отправляем изображение и ID мема на наш бэкенд-API
-            const response = await fetch('/analyze', {
+            // 4. Отправляем кадр телом запроса, а ID мема - в адресе
+            const params = new URLSearchParams({ meme_id: memeId, session_id: sessionId });
+            const response = await fetch(`/analyze/frame?${params}`, {
                 method: 'POST',
                 headers: {
-                    'Content-Type': 'application/json',
+                    'Content-Type': 'image/jpeg',
                 },
-                body: JSON.stringify({ image: imageData, meme_id: memeId }),
+                body: frameBlob,
             });
 
+            // 503 - сервер занят другими кадрами, просто пропускаем этот
+            if (response.status === 503) {
+                return;
+            }
+
             if (!response.ok) {
                 throw new Error(`Ошибка сервера: ${response.status}`);
             }
@@ -54,14 +78,110 @@ document.addEventListener('DOMContentLoaded', () => {
             // 5. Получаем результат анализа и отображаем его
             const result = await response.json();
             emotionResultElement.textContent = translateEmotion(result.emotion);
+            nextIntervalMs = result.next_interval_ms || BASE_INTERVAL_MS;
 
         } catch (error) {
             console.error('Ошибка при отправке кадра на анализ:', error);
             // Если анализ не удался, останавливаем его, чтобы не спамить ошибками
-            if (analysisInterval) clearInterval(analysisInterval);
+            analysisStopped = true;
+        }
+    }
+
+    // Следующий кадр снимаем только после ответа на предыдущий,
+    // с паузой, которую подсказал сервер
+    async function analysisLoop() {
+        analysisInFlight = true;
+        try {
+            await analyzeFrame();
+        } finally {
+            analysisInFlight = false;
+        }
+        if (!analysisStopped) {
+            analysisTimer = setTimeout(analysisLoop, nextIntervalMs);
+        }
+    }
+
+    // --- Очередь следующих мемов: переключение без перезагрузки страницы ---
+    const PREFETCH_COUNT = 5;   // сколько мемов просить у сервера за раз
+    const LOW_WATER_MARK = 2;   // когда в очереди осталось столько - просим еще
+    const memeQueue = [];
+    let refillPromise = null;
+
+    // Заранее скачиваем картинку, чтобы при переключении она была уже в кеше браузера
+    function preloadImage(meme) {
+        const img = new Image();
+        img.sizes = memeImageElement.sizes;
+        if (meme.image.srcset) {
+            img.srcset = meme.image.srcset;
+        }
+        img.src = meme.image.src;
+        meme.preloaded = img;
+    }
+
+    function refillQueue() {
+        if (!refillPromise) {
+            refillPromise = fetch(`/next?k=${PREFETCH_COUNT}`)
+                .then(response => {
+                    if (!response.ok) {
+                        throw new Error(`Ошибка сервера: ${response.status}`);
+                    }
+                    return response.json();
+                })
+                .then(result => {
+                    const known = new Set(memeQueue.map(meme => meme.id));
+                    known.add(Number(memeIdElement.value));
+                    for (const meme of result.memes) {
+                        if (!known.has(meme.id)) {
+                            preloadImage(meme);
+                            memeQueue.push(meme);
+                        }
+                    }
+                })
+                .catch(error => console.error('Не удалось получить следующие мемы:', error))
+                .finally(() => { refillPromise = null; });
+        }
+        return refillPromise;
+    }
+
+    function showMeme(meme) {
+        memeIdElement.value = meme.id;
+        memeTitleElement.textContent = meme.title;
+        memeImageElement.alt = meme.title;
+        memeImageElement.dataset.fallback = meme.image.fallback;
+        if (meme.image.srcset) {
+            memeImageElement.srcset = meme.image.srcset;
+        } else {
+            memeImageElement.removeAttribute('srcset');
+        }
+        memeImageElement.src = meme.image.src;
+
+        // Новый мем - новая реакция: снимаем кадр сразу, а не через накопившуюся паузу
+        nextIntervalMs = BASE_INTERVAL_MS;
+        if (!analysisStopped && !analysisInFlight && videoElement.srcObject) {
+            clearTimeout(analysisTimer);
+            analysisTimer = setTimeout(analysisLoop, BASE_INTERVAL_MS);
         }
     }
 
+    nextMemeButton.addEventListener('click', async (event) => {
+        event.preventDefault();
+        if (memeQueue.length === 0) {
+            await refillQueue();
+        }
+        const meme = memeQueue.shift();
+        if (!meme) {
+            // Сервер недоступен - по-старому перезагружаем страницу
+            window.location.href = nextMemeButton.href;
+            return;
+        }
+        showMeme(meme);
+        if (memeQueue.length <= LOW_WATER_MARK) {
+            refillQueue();
+        }
+    });
+
+    refillQueue();
+
     // Простая функция для перевода эмоций на русский язык и добавления иконок
     function translateEmotion(emotion) {
         const translations = {
@@ -73,6 +193,7 @@ document.addEventListener('DOMContentLoaded', () => {
             'surprise': 'Удивление 😮',
             'neutral': 'Нейтрально 😐',
             'face not found': 'Лицо не найдено',
+            'лицо не найдено': 'Лицо не найдено',
             'ошибка анализа': 'Ошибка анализа'
         };
         return translations[emotion] || emotion;
@@ -80,17 +201,41 @@ document.addEventListener('DOMContentLoaded', () => {
 
 
     // --- Логика для кнопки обучения ---
+    const modelStatusElement = document.getElementById('modelStatus');
+    const TRAIN_POLL_MS = 1000;
+
+    async function waitForTraining() {
+        for (;;) {
+            await new Promise(resolve => setTimeout(resolve, TRAIN_POLL_MS));
+            const status = await (await fetch('/train/status')).json();
+            if (status.state !== 'running') {
+                return status;
+            }
+            if (status.epochs) {
+                trainButton.textContent = `Обучение... эпоха ${status.epoch}/${status.epochs}`;
+            }
+        }
+    }
+
     trainButton.addEventListener('click', async () => {
         trainButton.disabled = true;
         trainButton.textContent = 'Обучение...';
 
         try {
-            const response = await fetch('/train'); // Отправляем запрос на обучение
+            const response = await fetch('/train'); // Запускаем обучение в фоне
             const result = await response.json();
-
-            // Показываем результат прямо на кнопке
             trainButton.textContent = result.message;
 
+            // Обучение идет на сервере в фоне - опрашиваем его состояние
+            if (response.status === 202 || response.status === 409) {
+                const status = await waitForTraining();
+                trainButton.textContent = status.message || 'Обучение завершено';
+                if (status.state === 'done') {
+                    modelStatusElement.textContent = 'Обучена';
+                    modelStatusElement.className = 'status-trained';
+                }
+            }
+
         } catch (error) {
             console.error('Ошибка при запуске обучения:', error);
             trainButton.textContent = 'Ошибка! См. консоль';
@@ -114,8 +259,7 @@ document.addEventListener('DOMContentLoaded', () => {
                 console.log("Веб-камера успешно подключена!");
 
                 // После успешного подключения камеры, запускаем анализ
-                // с заданной периодичностью
-                analysisInterval = setInterval(analyzeFrame, 1500); // 1.5 секунды
+                analysisTimer = setTimeout(analysisLoop, BASE_INTERVAL_MS);
             })
             .catch(err => {
                 console.error("Ошибка доступа к веб-камере: ", err);